@@ -0,0 +1,87 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 10:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # databases created by Base.metadata.create_all already have these tables, stamp them with
+    # "alembic stamp 0001" instead of running this revision
+    op.create_table(
+        'books',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('author', sa.String(), nullable=False),
+        sa.Column('title', sa.String(), nullable=False),
+        sa.Column('rating', sa.Float(), nullable=False),
+        sa.Column('description', sa.String(), nullable=True),
+        sa.Column('content_url', sa.String(), nullable=False),
+        sa.Column('slug', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index('ix_books_id', 'books', ['id'])
+    op.create_index('ix_books_title', 'books', ['title'])
+    op.create_index('ix_books_slug', 'books', ['slug'], unique=True)
+
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('username', sa.String(), nullable=False, unique=True),
+        sa.Column('email', sa.String(), nullable=False, unique=True),
+        sa.Column('password_hash', sa.String(), nullable=False),
+        sa.Column('role', sa.String(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index('ix_users_id', 'users', ['id'])
+
+    op.create_table(
+        'user_library',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('book_id', sa.Integer(), sa.ForeignKey('books.id'), nullable=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=True),
+        sa.Column('added_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.UniqueConstraint('book_id', 'user_id', name='uq_user_id_user_id'),
+    )
+    op.create_index('ix_user_library_id', 'user_library', ['id'])
+
+    op.create_table(
+        'chat_sessions',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=True),
+        sa.Column('book_id', sa.Integer(), sa.ForeignKey('books.id'), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index('ix_chat_sessions_id', 'chat_sessions', ['id'])
+
+    op.create_table(
+        'chat_messages',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('session_id', sa.Integer(), sa.ForeignKey('chat_sessions.id'), nullable=True),
+        sa.Column('sender', sa.String(), nullable=False),
+        sa.Column('content', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index('ix_chat_messages_id', 'chat_messages', ['id'])
+
+
+def downgrade() -> None:
+    op.drop_table('chat_messages')
+    op.drop_table('chat_sessions')
+    op.drop_table('user_library')
+    op.drop_table('users')
+    op.drop_table('books')
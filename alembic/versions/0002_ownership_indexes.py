@@ -0,0 +1,31 @@
+"""indexes for library and chat ownership lookups
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 10:30:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # if_not_exists because create_all may already have built them from the models
+    op.create_index('ix_user_library_user_id_added_at', 'user_library', ['user_id', 'added_at'],
+                    if_not_exists=True)
+    op.create_index('ix_chat_sessions_user_id_id', 'chat_sessions', ['user_id', 'id'], if_not_exists=True)
+    op.create_index('ix_chat_messages_session_id_id', 'chat_messages', ['session_id', 'id'], if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_chat_messages_session_id_id', table_name='chat_messages')
+    op.drop_index('ix_chat_sessions_user_id_id', table_name='chat_sessions')
+    op.drop_index('ix_user_library_user_id_added_at', table_name='user_library')
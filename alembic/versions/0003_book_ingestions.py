@@ -0,0 +1,45 @@
+"""per book ingestion status and progress
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 12:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'book_ingestions',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('book_id', sa.Integer(), nullable=False),
+        sa.Column('slug', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('lane', sa.String(), nullable=True),
+        sa.Column('pages_total', sa.Integer(), nullable=False),
+        sa.Column('pages_done', sa.Integer(), nullable=False),
+        sa.Column('chunks', sa.Integer(), nullable=False),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.Column('started_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+        sa.UniqueConstraint('book_id'),
+        # create_all may already have built it from the models
+        if_not_exists=True,
+    )
+    op.create_index('ix_book_ingestions_id', 'book_ingestions', ['id'], if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_book_ingestions_id', table_name='book_ingestions')
+    op.drop_table('book_ingestions')
@@ -1,28 +1,44 @@
-from typing import Annotated
-
-from fastapi import FastAPI, Depends
-from sqlalchemy.orm import Session
-
-from .routers import books, users, ai, admin, auth, sessions
-from .database import Base, engine, SessionLocal
-
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-db_dependency = Annotated[Session, Depends(get_db)]
-
-Base.metadata.create_all(bind=engine)
-
-app = FastAPI()
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+
+from .routers import books, users, ai, admin, auth, sessions, ready, metrics as metrics_router
+from .database import engine, async_engine, async_read_engine
+from .schema import create_schema
+from .services import metrics
+from .services.chat_writer import chat_writer
+
+# creating the schema on startup keeps `uvicorn app.main:app` working on a fresh checkout,
+# deployments that run their migrations as a separate step turn it off with 0
+CREATE_SCHEMA_ON_STARTUP = os.getenv("SMART_BOOK_CREATE_SCHEMA", "1") != "0"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if CREATE_SCHEMA_ON_STARTUP:
+        await asyncio.to_thread(create_schema)
+    await chat_writer.start()
+    yield
+    await chat_writer.stop()
+    # pooled aiosqlite connections each hold a thread that would keep the process alive
+    await async_engine.dispose()
+    await async_read_engine.dispose()
+
+
+for instrumented_engine in {engine, async_engine.sync_engine, async_read_engine.sync_engine}:
+    metrics.instrument_engine(instrumented_engine)
+
+# routes with a response model are serialized by pydantic and rendered by orjson, skipping jsonable_encoder
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(metrics.MetricsMiddleware)
 app.include_router(books.router)
 app.include_router(users.router)
 app.include_router(ai.router)
 app.include_router(admin.router)
 app.include_router(auth.router)
 app.include_router(sessions.router)
+app.include_router(ready.router)
+app.include_router(metrics_router.router)
@@ -1,6 +1,6 @@
 from enum import Enum
 
-from sqlalchemy import Column, Integer, Float, String, Boolean, UniqueConstraint, event, Enum as SAEnum, DateTime, func
+from sqlalchemy import Column, Integer, Float, String, Boolean, UniqueConstraint, Index, event, Enum as SAEnum, DateTime, func
 from sqlalchemy.sql.schema import ForeignKey
 from slugify import slugify
 
@@ -58,6 +58,7 @@ class UserLibrary(Base):
 
     __table_args__ = (
         UniqueConstraint('book_id', 'user_id', name='uq_user_id_user_id'),
+        Index('ix_user_library_user_id_added_at', 'user_id', 'added_at'),
     )
 
 
@@ -69,6 +70,11 @@ class ChatSession(Base):
     book_id = Column(Integer, ForeignKey("books.id"))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        Index('ix_chat_sessions_user_id_id', 'user_id', 'id'),
+    )
+
+
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
 
@@ -77,3 +83,26 @@ class ChatMessage(Base):
     sender = Column(String, nullable=False)
     content = Column(String)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index('ix_chat_messages_session_id_id', 'session_id', 'id'),
+    )
+
+
+class BookIngestion(Base):
+    __tablename__ = "book_ingestions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # no foreign key, deleting a book must not wait on (or fail because of) its ingestion history
+    book_id = Column(Integer, nullable=False, unique=True)
+    slug = Column(String, nullable=False)
+    # queued, embedding, committing, done or failed
+    status = Column(String, nullable=False, default='queued')
+    lane = Column(String)
+    pages_total = Column(Integer, nullable=False, default=0)
+    pages_done = Column(Integer, nullable=False, default=0)
+    chunks = Column(Integer, nullable=False, default=0)
+    error = Column(String)
+    started_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True))
@@ -1,14 +1,17 @@
+import asyncio
 from typing import Annotated
-from fastapi import APIRouter, Depends, HTTPException,BackgroundTasks
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Request
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel, Field
 from starlette import status
 
-from ..database import SessionLocal
-from ..models import Book
+from ..database import get_db, get_read_db, AsyncReadSessionLocal
+from ..models import Book, BookIngestion
 from .auth import get_current_user
 from ..tasks import ai_tasks, book_tasks
-from ..services import ai_service
+from ..services import ai_service, book_import, ingestions
+from ..services.response_cache import catalog_cache
 
 
 class BookRequest(BaseModel):
@@ -19,26 +22,56 @@ class BookRequest(BaseModel):
     content_url: str
 
 
+class WarmUpRequest(BaseModel):
+    slugs: list[str] = Field(min_length=1)
+
+
 router = APIRouter(
     prefix="/admin",
     tags=["admin"]
 )
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
+user_dependency = Annotated[dict, Depends(get_current_user)]
 
 
-db_dependency = Annotated[Session, Depends(get_db)]
-user_dependency = Annotated[dict, Depends(get_current_user)]
+# books read and embedded per round when rebuilding the catalog index
+CATALOG_REBUILD_BATCH_SIZE = 500
+
+
+def catalog_entry(record: Book):
+    return {
+        "id": record.id,
+        "slug": record.slug,
+        "title": record.title,
+        "author": record.author,
+        "rating": record.rating,
+        "description": record.description,
+    }
+
+
+async def rebuild_catalog():
+    last_id = 0
+    async with AsyncReadSessionLocal() as db:
+        while True:
+            result = await db.execute(
+                select(Book.id, Book.slug, Book.title, Book.author, Book.rating, Book.description)
+                .where(Book.id > last_id)
+                .order_by(Book.id)
+                .limit(CATALOG_REBUILD_BATCH_SIZE)
+            )
+            books = [dict(row._mapping) for row in result]
+            if not books:
+                break
+            await ai_service.index_catalog(books)
+            last_id = books[-1]["id"]
 
 
 @router.post("/books")
-async def create_book(user: user_dependency, db: db_dependency, book_request: BookRequest):
+async def create_book(user: user_dependency, db: db_dependency, book_request: BookRequest,
+                      background_tasks: BackgroundTasks):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication Failed")
     if not user.get('role') == 'admin':
@@ -46,48 +79,169 @@ async def create_book(user: user_dependency, db: db_dependency, book_request: Bo
 
     record = Book(**book_request.model_dump())
     db.add(record)
-    db.commit()
-    db.refresh(record)
+    await db.commit()
+    await db.refresh(record)
+    await catalog_cache.bump()
+
+    # progress shows up at /admin/books/{id}/ingestion from the moment the book exists
+    db.add(BookIngestion(book_id=record.id, slug=record.slug, status="queued", pages_total=0, pages_done=0,
+                         chunks=0))
+    await db.commit()
 
     #long task
-    # ai_tasks.embed_book_task.delay(record.content_url, record.slug)
+    ai_tasks.ingest_book_task.delay(record.id, record.content_url, record.slug)
+    background_tasks.add_task(ai_service.index_catalog, [catalog_entry(record)])
+
+    return {"message": "Adding book", "book_id": record.id}
+
 
-    ai_tasks.embed_book_task.delay(record.content_url, record.slug)
+@router.get("/books/{book_id}/ingestion")
+async def get_book_ingestion(user: user_dependency, db: read_db_dependency, book_id: int):
+    if user is None:
+        raise HTTPException(status_code=401, detail="Authentication Failed")
+    if not user.get('role') == 'admin':
+        raise HTTPException(status_code=401, detail="Authentication Failed")
 
-    return {"message": "Adding book"}
+    ingestion = await db.scalar(select(BookIngestion).where(BookIngestion.book_id == book_id))
+    if ingestion is None:
+        raise HTTPException(status_code=404, detail="No ingestion for this book")
+    return ingestions.describe(ingestion)
+
+
+@router.get("/ingestions")
+async def list_ingestions(user: user_dependency, db: read_db_dependency,
+                          status_filter: str | None = Query(default=None, alias="status",
+                                                            pattern="^(queued|embedding|committing|done|failed)$"),
+                          limit: int = Query(default=100, ge=1, le=500)):
+    if user is None:
+        raise HTTPException(status_code=401, detail="Authentication Failed")
+    if not user.get('role') == 'admin':
+        raise HTTPException(status_code=401, detail="Authentication Failed")
+
+    query = select(BookIngestion).order_by(BookIngestion.id.desc()).limit(limit)
+    if status_filter is not None:
+        query = query.where(BookIngestion.status == status_filter)
+    else:
+        # finished ones are only listed when asked for
+        query = query.where(BookIngestion.status.notin_(("done", "failed")))
+    result = await db.scalars(query)
+    return [ingestions.describe(ingestion) for ingestion in result]
+
+
+@router.post("/books/import")
+async def import_books(user: user_dependency, db: db_dependency, request: Request,
+                       background_tasks: BackgroundTasks,
+                       format: str | None = Query(default=None, pattern="^(csv|jsonl)$")):
+    if user is None:
+        raise HTTPException(status_code=401, detail="Authentication Failed")
+    if not user.get('role') == 'admin':
+        raise HTTPException(status_code=401, detail="Authentication Failed")
+
+    # the file is the raw request body, e.g. curl --data-binary @books.csv -H "Content-Type: text/csv"
+    fmt = format or book_import.detect_format(content_type=request.headers.get("content-type"))
+    if fmt is None:
+        raise HTTPException(status_code=415, detail="Send text/csv or application/x-ndjson, or pass ?format=")
+    try:
+        data = (await request.body()).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="The file must be UTF-8")
+
+    report, books = await book_import.import_books(db, data, fmt, BookRequest)
+    if books:
+        await catalog_cache.bump()
+    await asyncio.to_thread(book_import.enqueue_ingestion, books)
+    background_tasks.add_task(book_import.index_in_catalog, books)
+    return report
 
 
 @router.put("/books/{book_id}")
-async def update_book(user: user_dependency, db: db_dependency, book_id: int, book_request: BookRequest):
+async def update_book(user: user_dependency, db: db_dependency, book_id: int, book_request: BookRequest,
+                      background_tasks: BackgroundTasks):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication Failed")
     if not user.get('role') == 'admin':
         raise HTTPException(status_code=401, detail="Authentication Failed")
 
-    record = db.query(Book).filter(Book.id == book_id).first()
+    record = await db.scalar(select(Book).where(Book.id == book_id))
     if record is None:
         raise HTTPException(status_code=404, detail="Book not found")
+    content_changed = record.content_url != book_request.content_url
     record.author = book_request.author
     record.title = book_request.title
     record.rating = book_request.rating
     record.description = book_request.description
     record.content_url = book_request.content_url
-    db.commit()
+    await db.commit()
+    await catalog_cache.bump()
+
+    background_tasks.add_task(ai_service.index_catalog, [catalog_entry(record)])
+    # edits of the title or description leave the chunks alone, only a different, replaced or edited
+    # file is re-embedded, and then only the chunks that changed
+    if content_changed or await asyncio.to_thread(ai_service.source_changed, record.content_url, record.slug):
+        ai_tasks.update_book_embedding_task.delay(record.id, record.content_url, record.slug)
 
 
 @router.delete("/books/{book_id}")
-async def delete_book(user: user_dependency, db: db_dependency, book_id: int):
+async def delete_book(user: user_dependency, db: db_dependency, book_id: int, background_tasks: BackgroundTasks):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication Failed")
     if not user.get('role') == 'admin':
         raise HTTPException(status_code=401, detail="Authentication Failed")
 
-    record = db.query(Book).filter(Book.id == book_id).first()
+    record = await db.scalar(select(Book).where(Book.id == book_id))
     if record is None:
         raise HTTPException(status_code=404, detail="Book not found")
-    db.delete(record)
-    db.commit()
+    await db.delete(record)
+    # sqlite may hand the id out again, the next book must not inherit this one's progress
+    await db.execute(delete(BookIngestion).where(BookIngestion.book_id == book_id))
+    await db.commit()
+    await catalog_cache.bump()
 
-    # book_tasks.delete_book_embedding.delay(record.content_url, record.slug)
+    ai_service.remove_book_from_vector_stores(record.slug)
+    background_tasks.add_task(ai_service.unindex_catalog, book_id)
+    book_tasks.delete_book_embedding.delay(record.slug)
 
     return {"message": f"Book deleted"}
+
+
+@router.get("/ai/stats")
+async def get_ai_stats(user: user_dependency):
+    if user is None:
+        raise HTTPException(status_code=401, detail="Authentication Failed")
+    if not user.get('role') == 'admin':
+        raise HTTPException(status_code=401, detail="Authentication Failed")
+
+    return await ai_service.run_blocking(ai_service.get_stats)
+
+
+@router.post("/ai/warm-up")
+async def warm_up_vector_stores(user: user_dependency, warm_up_request: WarmUpRequest):
+    if user is None:
+        raise HTTPException(status_code=401, detail="Authentication Failed")
+    if not user.get('role') == 'admin':
+        raise HTTPException(status_code=401, detail="Authentication Failed")
+
+    warmed = await ai_service.run_blocking(ai_service.warm_up_vector_stores, warm_up_request.slugs)
+    return {"warmed": warmed}
+
+
+@router.post("/ai/vector-stores/gc")
+async def collect_vector_store_garbage(user: user_dependency):
+    if user is None:
+        raise HTTPException(status_code=401, detail="Authentication Failed")
+    if not user.get('role') == 'admin':
+        raise HTTPException(status_code=401, detail="Authentication Failed")
+
+    task = ai_tasks.collect_vector_store_garbage_task.delay()
+    return {"message": "Collecting vector store garbage", "task_id": task.id}
+
+
+@router.post("/ai/catalog/rebuild")
+async def rebuild_catalog_index(user: user_dependency, background_tasks: BackgroundTasks):
+    if user is None:
+        raise HTTPException(status_code=401, detail="Authentication Failed")
+    if not user.get('role') == 'admin':
+        raise HTTPException(status_code=401, detail="Authentication Failed")
+
+    background_tasks.add_task(rebuild_catalog)
+    return {"message": "Rebuilding catalog index"}
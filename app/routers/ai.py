@@ -1,10 +1,14 @@
-from fastapi import APIRouter
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Request
+from pydantic import BaseModel, Field
 from ..services import ai_service
+from ..services.llm_scheduler import SchedulerBusy
 
 
 class SearchRequest(BaseModel):
-    query: str
+    query: str = Field(min_length=1)
+    k: int = Field(default=10, gt=0, le=50)
+    min_rating: float | None = Field(default=None, ge=0, le=5)
+    author: str | None = None
 
 
 router = APIRouter(
@@ -13,5 +17,12 @@ router = APIRouter(
 )
 
 @router.post("/search")
-async def search_ai(search_request: SearchRequest):
-    return ai_service.search_ai(search_request.query)
\ No newline at end of file
+async def search_ai(search_request: SearchRequest, request: Request):
+    # search is anonymous, clients are queued fairly by address instead
+    client = request.client.host if request.client else None
+    try:
+        return await ai_service.search_ai(search_request.query, search_request.k,
+                                          search_request.min_rating, search_request.author, client)
+    except SchedulerBusy as exc:
+        raise HTTPException(status_code=429, detail="Too many searches in progress, try again shortly",
+                            headers={"Retry-After": str(exc.retry_after)})
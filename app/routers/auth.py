@@ -1,13 +1,17 @@
+import time
+from collections import OrderedDict
 from datetime import timedelta, datetime, timezone
 from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, Response
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
-from ..database import SessionLocal
+from ..database import get_db, get_read_db
 from ..models import User
+from ..services.password_hashing import PasswordHasher, PasswordHasherBusy
 
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
@@ -23,6 +27,18 @@ ALGORITHM = "HS256"
 
 bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt runs on its own bounded pool, past BCRYPT_MAX_QUEUE waiting requests we answer 503
+BCRYPT_WORKERS = 4
+BCRYPT_MAX_QUEUE = 64
+
+password_hasher = PasswordHasher(bcrypt_context, workers=BCRYPT_WORKERS, max_queue=BCRYPT_MAX_QUEUE)
+
+# decoded claims of recently seen tokens, an entry never outlives the token's own exp
+TOKEN_CACHE_SIZE = 10_000
+TOKEN_CACHE_TTL = 60
+
+token_cache = OrderedDict()
+
 # only put tokenUrl for docs
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl="auth/login")
 
@@ -38,22 +54,15 @@ class Token(BaseModel):
     token_type: str
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
 
 
-def authenticate_user(username: str, password: str, db):
-    user = db.query(User).filter(User.username == username).first()
+async def authenticate_user(username: str, password: str, db):
+    user = await db.scalar(select(User).where(User.username == username))
     if user is None:
         return False
-    if not bcrypt_context.verify(password, user.password_hash):
+    if not await password_hasher.verify(password, user.password_hash):
         return False
     return user
 
@@ -69,36 +78,83 @@ def create_access_token(role: str, user_id: int, username: str, expires_delta: t
     return jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)]):
+def get_cached_user(token: str):
+    entry = token_cache.get(token)
+    if entry is None:
+        return None
+    user, expires_at = entry
+    if expires_at <= time.time():
+        del token_cache[token]
+        return None
+    token_cache.move_to_end(token)
+    return user
+
+
+def cache_user(token: str, user: dict, exp):
+    if exp is None:
+        return
+    expires_at = min(float(exp), time.time() + TOKEN_CACHE_TTL)
+    token_cache[token] = (user, expires_at)
+    token_cache.move_to_end(token)
+    while len(token_cache) > TOKEN_CACHE_SIZE:
+        token_cache.popitem(last=False)
+
+
+def decode_access_token(token: str):
+    # the signature of a cached token was already verified, skip decoding it again
+    user = get_cached_user(token)
+    if user is not None:
+        return user
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get('sub')
-        user_id: int = payload.get('id')
-        role: str = payload.get('role')
-        if username is None or user_id is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                                detail="Could not validate credentials")
-        return {'username': username, 'id': user_id, 'role': role}
     except JWTError:
+        return None
+    username: str = payload.get('sub')
+    user_id: int = payload.get('id')
+    role: str = payload.get('role')
+    if username is None or user_id is None:
+        return None
+    user = {'username': username, 'id': user_id, 'role': role}
+    cache_user(token, user, payload.get('exp'))
+    return user
+
+
+async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)]):
+    user = decode_access_token(token)
+    if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Could not validate credentials")
+    return user
+
+
+def hasher_busy():
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                         detail="Too many authentication requests, try again shortly",
+                         headers={"Retry-After": "1"})
 
 
 @router.post("/register")
-def create_user(create_user_request: CreateUserRequest, db: db_dependency):
+async def create_user(create_user_request: CreateUserRequest, db: db_dependency):
+    try:
+        password_hash = await password_hasher.hash(create_user_request.password)
+    except PasswordHasherBusy:
+        raise hasher_busy()
     user = User(username=create_user_request.username,
                 email=create_user_request.email,
-                password_hash=bcrypt_context.hash(create_user_request.password))
+                password_hash=password_hash)
     db.add(user)
-    db.commit()
+    await db.commit()
 
 
 @router.post("/login", response_model=Token)
-def login(response: Response, form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: db_dependency):
+async def login(response: Response, form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: read_db_dependency):
     username = form_data.username
     password = form_data.password
 
-    user = authenticate_user(username, password, db)
+    try:
+        user = await authenticate_user(username, password, db)
+    except PasswordHasherBusy:
+        raise hasher_busy()
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Invalid credentials")
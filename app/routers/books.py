@@ -1,17 +1,32 @@
-from typing import Annotated
-from fastapi import APIRouter, Depends, Path, HTTPException, status
-from sqlalchemy.orm import Session
+import asyncio
+from datetime import datetime
+from typing import Annotated, Literal
+from fastapi import APIRouter, Depends, Path, HTTPException, Query, Request, status
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 
 from .auth import get_current_user
-from ..database import SessionLocal
+from ..database import AsyncReadSessionLocal, get_read_db
 from ..models import Book
 
-from ..services import ai_service
-
-
+from ..services import ai_service, book_content, catalog, search
+from ..services.response_cache import CachedResponse, catalog_cache
 
 
+class BookResponse(BaseModel):
+    # every field is optional, GET /books?fields= returns only the columns asked for
+    id: int | None = None
+    author: str | None = None
+    title: str | None = None
+    rating: float | None = None
+    description: str | None = None
+    content_url: str | None = None
+    slug: str | None = None
+    created_at: datetime | None = None
+    updated_at: datetime | None = None
 
 
 router = APIRouter(
@@ -20,36 +35,161 @@ router = APIRouter(
 )
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
+user_dependency = Annotated[dict, Depends(get_current_user)]
 
 
-db_dependency = Annotated[Session, Depends(get_db)]
-user_dependency = Annotated[dict, Depends(get_current_user)]
+@router.get("", status_code=status.HTTP_200_OK, response_model=list[BookResponse])
+async def read_all_books(db: db_dependency, request: Request,
+                         limit: int = Query(default=catalog.DEFAULT_PAGE_SIZE, ge=1, le=catalog.MAX_PAGE_SIZE),
+                         cursor: str | None = None,
+                         sort: Literal["id", "rating", "title"] = "id",
+                         order: Literal["asc", "desc"] = "asc",
+                         fields: str | None = None,
+                         stream: bool = False):
+    try:
+        columns = catalog.parse_fields(fields, sort)
+        query = catalog.books_query(columns, sort, order, None if stream else cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if stream:
+        return StreamingResponse(export_books(query), media_type="application/json")
+
+    async def build():
+        result = await db.execute(query.limit(limit + 1))
+        books = [dict(row._mapping) for row in result]
+        headers = {}
+        if len(books) > limit:
+            books = books[:limit]
+            headers["X-Next-Cursor"] = catalog.encode_cursor(books[-1], sort)
+        return CachedResponse(200, catalog.dumps(books), headers)
+
+    return await cached(request, f"books:{limit}:{cursor}:{sort}:{order}:{','.join(columns)}", build)
+
+
+async def cached(request: Request, key: str, build):
+    # the catalog only changes through the admin routes, which bump the cache version
+    version = await catalog_cache.version()
+    entry = None if version is None else await catalog_cache.get(version, key)
+    if entry is None:
+        entry = await build()
+        if version is not None:
+            await catalog_cache.put(version, key, entry)
+    return entry.to_response(request.headers)
+
+
+async def cached_book(db, request: Request, key: str, condition):
+    async def build():
+        result = await db.execute(select(*catalog.book_columns()).where(condition).limit(1))
+        row = result.first()
+        if row is None:
+            # misses are cached as well, the next create bumps the version anyway
+            return CachedResponse(404, catalog.dumps({"detail": "Book not found"}))
+        return CachedResponse(200, catalog.dumps(dict(row._mapping)))
+
+    return await cached(request, key, build)
+
+
+async def export_books(query):
+    # the request session is already closed once the body streams, so the export owns its own
+    async with AsyncReadSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=catalog.EXPORT_BATCH_SIZE))
+        yield b"["
+        first = True
+        async for rows in result.partitions():
+            chunk = b",".join(catalog.dumps(dict(row._mapping)) for row in rows)
+            yield chunk if first else b"," + chunk
+            first = False
+        yield b"]"
+
+
+# declared before /{book_id} so "search" is never parsed as a book id
+@router.get("/search", status_code=status.HTTP_200_OK)
+async def search_books(db: db_dependency, q: str = Query(min_length=1),
+                       limit: int = Query(default=20, ge=1, le=100),
+                       offset: int = Query(default=0, ge=0)):
+    return await search.search_books(db, q, limit, offset)
+
+
+async def serve_content(content_url: str | None, request: Request):
+    if content_url is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+    try:
+        # relative paths are relative to the data directory, and nothing outside the
+        # book directory is ever served
+        return await book_content.content_response(ai_service.content_path(content_url), request.headers,
+                                                   root=ai_service.book_directory,
+                                                   base=ai_service.data_dir)
+    except book_content.ContentNotFound:
+        raise HTTPException(status_code=404, detail="Book content not found")
 
 
-@router.get("", status_code=status.HTTP_200_OK)
-async def read_all_books(db: db_dependency):
-    return db.query(Book).all()
+# pages of text per request, a reader asks for the next ones as they go
+MAX_PAGES_PER_REQUEST = 20
 
 
-@router.get("/{book_id}", status_code=status.HTTP_200_OK)
-async def read_book(db: db_dependency, book_id: int = Path(gt=0)):
-    record = db.query(Book).filter(Book.id == book_id).first()
-    if record is None:
+async def open_page_store(db, book_id: int):
+    slug = await db.scalar(select(Book.slug).where(Book.id == book_id))
+    if slug is None:
         raise HTTPException(status_code=404, detail="Book not found")
-    return record
+    # opening maps the file, that and reading cold pages can touch the disk
+    store = await asyncio.to_thread(ai_service.page_stores.get, slug)
+    if store is None:
+        raise HTTPException(status_code=404, detail="The text of this book isn't available yet")
+    return store
 
 
-@router.get("/", status_code=status.HTTP_200_OK)
-async def search_by_title(db: db_dependency, title: str):
-    record = db.query(Book).filter(Book.title == title).first()
-    if record is None:
-        raise HTTPException(status_code=404, detail="Book not found")
-    return record
+@router.get("/{book_id}/pages", status_code=status.HTTP_200_OK)
+async def read_book_pages(db: db_dependency, book_id: int = Path(gt=0),
+                          first: int = Query(default=1, ge=1, alias="from"),
+                          last: int | None = Query(default=None, ge=1, alias="to")):
+    if last is not None and last < first:
+        # the same shape as every other invalid query parameter
+        raise RequestValidationError([{"type": "value_error", "loc": ("query", "to"), "input": last,
+                                       "msg": "Value error, to must not be before from"}])
+    store = await open_page_store(db, book_id)
+    # page numbers are 1-based and inclusive here, the store counts from 0
+    last = min(last or first + MAX_PAGES_PER_REQUEST - 1, first + MAX_PAGES_PER_REQUEST - 1, store.page_count)
+    if first > last:
+        raise HTTPException(status_code=404, detail=f"The book has {store.page_count} pages")
+    pages = await asyncio.to_thread(lambda: list(store.pages(first - 1, last)))
+    return {"book_id": book_id, "page_count": store.page_count,
+            "pages": [{"page": page_number + 1, "text": text} for page_number, text in pages]}
+
+
+@router.get("/{book_id}/pages/search", status_code=status.HTTP_200_OK)
+async def search_book_pages(db: db_dependency, book_id: int = Path(gt=0), q: str = Query(min_length=1),
+                            limit: int = Query(default=20, ge=1, le=100)):
+    store = await open_page_store(db, book_id)
+    hits = await asyncio.to_thread(store.find, q, limit)
+    return [{"page": hit["page"] + 1, "snippet": hit["snippet"]} for hit in hits]
+
+
+@router.api_route("/by-slug/{slug}/content", methods=["GET", "HEAD"], status_code=status.HTTP_200_OK)
+async def read_book_content_by_slug(db: db_dependency, request: Request, slug: str):
+    content_url = await db.scalar(select(Book.content_url).where(Book.slug == slug))
+    return await serve_content(content_url, request)
+
+
+@router.api_route("/{book_id}/content", methods=["GET", "HEAD"], status_code=status.HTTP_200_OK)
+async def read_book_content(db: db_dependency, request: Request, book_id: int = Path(gt=0)):
+    content_url = await db.scalar(select(Book.content_url).where(Book.id == book_id))
+    return await serve_content(content_url, request)
+
+
+@router.get("/by-slug/{slug}", status_code=status.HTTP_200_OK, response_model=BookResponse)
+async def read_book_by_slug(db: db_dependency, request: Request, slug: str):
+    return await cached_book(db, request, f"slug:{slug}", Book.slug == slug)
+
+
+@router.get("/{book_id}", status_code=status.HTTP_200_OK, response_model=BookResponse)
+async def read_book(db: db_dependency, request: Request, book_id: int = Path(gt=0)):
+    return await cached_book(db, request, f"book:{book_id}", Book.id == book_id)
+
+
+@router.get("/", status_code=status.HTTP_200_OK, response_model=BookResponse)
+async def search_by_title(db: db_dependency, request: Request, title: str):
+    return await cached_book(db, request, f"title:{title}", Book.title == title)
 
 
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, Response
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database import get_read_db
+from ..models import Book, ChatSession
+from ..services import ai_service
+
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    tags=["health"]
+)
+
+db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
+
+# books with the most recent chat sessions are opened by the warm-up, half the store cache
+# so the first questions of other books still find room
+WARM_UP_BOOKS = ai_service.VECTOR_STORE_CACHE_SIZE // 2
+WARM_UP_RETRY_AFTER = 5
+
+warm_up_task = None
+
+
+async def hot_book_slugs(db, limit: int):
+    result = await db.execute(
+        select(Book.slug)
+        .join(ChatSession, ChatSession.book_id == Book.id)
+        .where(Book.slug.isnot(None))
+        .group_by(Book.slug)
+        .order_by(func.max(ChatSession.id).desc())
+        .limit(limit)
+    )
+    return [slug for (slug,) in result]
+
+
+def start_warm_up(slugs: list[str]):
+    global warm_up_task
+    warm_up_task = asyncio.create_task(ai_service.warm_up(slugs))
+    warm_up_task.add_done_callback(log_warm_up)
+    return warm_up_task
+
+
+def log_warm_up(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("warm-up failed: %s", task.exception())
+
+
+@router.get("/ready")
+async def ready(db: db_dependency, response: Response, warm: bool = False):
+    """Readiness probe. With ``warm=true`` it also loads the AI stack, the models and the
+    stores of the hottest books, and only reports ready once that is done."""
+    try:
+        await db.execute(text("SELECT 1"))
+    except Exception as exc:
+        logger.warning("readiness check failed: %s", exc)
+        response.status_code = 503
+        return {"status": "unavailable", "error": "database unreachable"}
+
+    if not warm:
+        return {"status": "ready"}
+
+    task = warm_up_task
+    error = None
+    if task is not None and task.done() and (task.cancelled() or task.exception() is not None):
+        # e.g. ollama wasn't up yet, every probe after a failure tries again
+        error = "warm-up was cancelled" if task.cancelled() else str(task.exception())
+        task = None
+    if task is None:
+        task = start_warm_up(await hot_book_slugs(db, WARM_UP_BOOKS))
+    if not task.done():
+        response.status_code = 503
+        response.headers["Retry-After"] = str(WARM_UP_RETRY_AFTER)
+        return {"status": "warming"} if error is None else {"status": "warming", "last_error": error}
+    return {"status": "ready", "warm_up": task.result()}
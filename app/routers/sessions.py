@@ -1,19 +1,30 @@
+import asyncio
+import logging
+import time
+from contextlib import suppress
+from datetime import datetime
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from starlette import status
 
-from .auth import get_current_user, SECRET_KEY, ALGORITHM
-from ..database import SessionLocal
-from sqlalchemy.orm import Session
+from .auth import get_current_user, decode_access_token
+from ..database import get_db, get_read_db, AsyncReadSessionLocal
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..models import ChatSession, ChatMessage, Book
 from ..services import ai_service
-from jose import jwt, JWTError
+from ..services.chat_writer import chat_writer
+from ..services.llm_scheduler import SchedulerBusy
 import json
 
 
+logger = logging.getLogger(__name__)
+
+
 class SessionCreateRequest(BaseModel):
     book_id: int
 
@@ -22,138 +33,295 @@ class QuestionRequest(BaseModel):
     question: str
 
 
+class ChatSessionResponse(BaseModel):
+    id: int
+    user_id: int | None
+    book_id: int | None
+    created_at: datetime | None
+
+
+class ChatSessionListItem(ChatSessionResponse):
+    # a session outlives its book, the book columns are then null
+    title: str | None
+    slug: str | None
+    author: str | None
+
+
+class ChatMessageResponse(BaseModel):
+    id: int
+    session_id: int | None
+    sender: str
+    content: str | None
+    created_at: datetime | None
+
+
 router = APIRouter(
     prefix="/sessions",
     tags=["sessions"]
 )
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# an idle connection gets a ping this often so proxies keep it open, and is closed after WS_IDLE_TIMEOUT
+WS_KEEPALIVE_INTERVAL = 20
+WS_IDLE_TIMEOUT = 10 * 60
+# a client that doesn't take a frame within this long is too slow to keep streaming to
+WS_SEND_TIMEOUT = 30
 
+# questions about a book whose ingestion hasn't finished get this instead of an empty store
+BOOK_NOT_INDEXED = "This book is still being indexed, try again later"
 
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
 
-def check_user_session_permission(use_id: int, session_id: int, db):
-    session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
+async def get_session_with_book(session_id: int, db):
+    # ownership and the book the session is about in one indexed lookup
+    result = await db.execute(
+        select(ChatSession.id, ChatSession.user_id, ChatSession.book_id, Book.slug, Book.title, Book.author)
+        .outerjoin(Book, Book.id == ChatSession.book_id)
+        .where(ChatSession.id == session_id)
+    )
+    return result.first()
+
+
+async def check_user_session_permission(use_id: int, session_id: int, db):
+    session = await get_session_with_book(session_id, db)
 
     if not session:
-        return None
+        return None, None
 
-    return session.user_id == use_id
+    return session.user_id == use_id, session
 
 
-@router.get("")
-async def get_all_sessions(db: db_dependency, user: user_dependency):
+@router.get("", response_model=list[ChatSessionListItem])
+async def get_all_sessions(db: read_db_dependency, user: user_dependency):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication Failed")
-    result = db.query(ChatSession).filter(ChatSession.user_id == user.get('id')).all()
-    return result
-
-
-@router.get("/{session_id}")
-async def get_session_messages(db: db_dependency, session_id: int, user: user_dependency):
+    result = await db.execute(
+        select(ChatSession.id, ChatSession.user_id, ChatSession.book_id, ChatSession.created_at,
+               Book.title, Book.slug, Book.author)
+        .outerjoin(Book, Book.id == ChatSession.book_id)
+        .where(ChatSession.user_id == user.get('id'))
+        .order_by(ChatSession.id.desc())
+    )
+    return [dict(row._mapping) for row in result]
+
+
+@router.get("/{session_id}", response_model=list[ChatMessageResponse])
+async def get_session_messages(db: read_db_dependency, session_id: int, user: user_dependency, response: Response,
+                               before: int | None = Query(default=None, gt=0),
+                               limit: int = Query(default=50, ge=1, le=200)):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication Failed")
 
     # ensure that this session belong to that user
-    permission = check_user_session_permission(user.get("id"), session_id, db)
+    permission, _ = await check_user_session_permission(user.get("id"), session_id, db)
     if permission is None:
         raise HTTPException(status_code=404, detail="Session not found")
     if not permission:
         raise HTTPException(status_code=403, detail="Not allowed to access this session")
 
-    result = db.query(ChatMessage).filter(ChatMessage.session_id == session_id).all()
-    return result
-
-
-#
-# @router.websocket("/{session_id}/chat/")
-# async def websocket_ai_chat(
-#         websocket: WebSocket,
-#         db: db_dependency,
-#         token: str,
-#         session_id: int):
-#     try:
-#         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-#         user_id = payload.get("id")
-#         if user_id is None:
-#             raise HTTPException(status_code=401, detail="Invalid token")
-#     except JWTError:
-#         await websocket.close(code=1008)
-#         return
-#
-#     permission = check_user_session_permission(user_id, session_id, db)
-#     if permission is None:
-#         raise HTTPException(status_code=404, detail="Session not found")
-#     if not permission:
-#         raise HTTPException(status_code=403, detail="Not allowed to access this session")
-#
-#     session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
-#     book = db.query(Book).filter(Book.id == session.book_id).first()
-#
-#     await websocket.accept()
-#
-#     try:
-#         while True:
-#             question = await websocket.receive_text()
-#
-#             answer = await ai_service.answer_about_book(question, book.slug)
-#
-#             question_model = ChatMessage(session_id=session_id, sender='user', content=question)
-#             answer_model = ChatMessage(session_id=session_id, sender='AI', content=answer)
-#
-#             db.add(question_model)
-#             db.add(answer_model)
-#             db.commit()
-#
-#             # send back the answer (you can also stream in chunks here)
-#             await websocket.send_text(answer)
-#
-#     except WebSocketDisconnect:
-#         print(f"Client disconnected from session {session_id}")
+    # newest first, the next page is everything older than the last message returned
+    query = (
+        select(ChatMessage.id, ChatMessage.session_id, ChatMessage.sender, ChatMessage.content,
+               ChatMessage.created_at)
+        .where(ChatMessage.session_id == session_id)
+    )
+    if before is not None:
+        query = query.where(ChatMessage.id < before)
+    result = await db.execute(query.order_by(ChatMessage.id.desc()).limit(limit + 1))
+    messages = [dict(row._mapping) for row in result]
+    if len(messages) > limit:
+        messages = messages[:limit]
+        response.headers["X-Next-Cursor"] = str(messages[-1]["id"])
+    return messages
+
+
+@router.websocket("/{session_id}/chat")
+async def websocket_ai_chat(websocket: WebSocket, session_id: int, token: str = ""):
+    # browsers can't set headers on a websocket, so the token comes as a query parameter
+    user = decode_access_token(token)
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Authentication Failed")
+        return
+
+    # ownership and the book are resolved once for the whole conversation, the book's store is
+    # looked up for every question (a registry hit) so a rebuilt or deleted book is noticed
+    async with AsyncReadSessionLocal() as db:
+        permission, session = await check_user_session_permission(user.get('id'), session_id, db)
+    if permission is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Session not found")
+        return
+    if not permission:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Not allowed to access this session")
+        return
+    if session.slug is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Book not found")
+        return
+    slug = session.slug
+
+    await websocket.accept()
+
+    send_lock = asyncio.Lock()
+    last_activity = time.monotonic()
+    generation = None
+
+    async def send(message: dict):
+        nonlocal last_activity
+        # tokens are sent one at a time and each send waits for the socket, so a slow client
+        # holds back its own stream only and is dropped once it stops reading altogether
+        async with send_lock:
+            await asyncio.wait_for(websocket.send_json(message), WS_SEND_TIMEOUT)
+        last_activity = time.monotonic()
+
+    async def answer(question: str):
+        answer_chunks = []
+        try:
+            try:
+                chunks = await ai_service.answer_about_book(question, slug, user.get('id'))
+            except SchedulerBusy as exc:
+                await send({"type": "error", "status": 429, "retry_after": exc.retry_after,
+                            "detail": "Too many questions in progress, try again shortly"})
+                return
+            except ai_service.BookNotIndexed:
+                await send({"type": "error", "status": 409, "detail": BOOK_NOT_INDEXED})
+                return
+            chat_writer.write(session_id, 'user', question)
+
+            async for chunk in chunks:
+                answer_chunks.append(chunk)
+                await send({"type": "token", "data": chunk})
+            await send({"type": "done"})
+        except asyncio.TimeoutError:
+            with suppress(Exception):
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Client too slow")
+        except WebSocketDisconnect:
+            pass
+        except Exception:
+            logger.exception("answering a question in session %s failed", session_id)
+            with suppress(Exception):
+                await send({"type": "error", "status": 500, "detail": "Could not answer the question"})
+        finally:
+            # also keeps what was generated before a cancel or a disconnect
+            if answer_chunks:
+                chat_writer.write(session_id, 'AI', "".join(answer_chunks))
+
+    async def cancel_generation():
+        if generation is None or generation.done():
+            return False
+        generation.cancel()
+        try:
+            await generation
+        except asyncio.CancelledError:
+            pass
+        return True
+
+    try:
+        while True:
+            try:
+                text = await asyncio.wait_for(websocket.receive_text(), WS_KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                busy = generation is not None and not generation.done()
+                if not busy and time.monotonic() - last_activity > WS_IDLE_TIMEOUT:
+                    await websocket.close(code=status.WS_1000_NORMAL_CLOSURE, reason="Idle")
+                    break
+                if not busy:
+                    await send({"type": "ping"})
+                continue
+            last_activity = time.monotonic()
+
+            # plain text frames are questions, json frames carry a type
+            try:
+                message = json.loads(text)
+            except ValueError:
+                message = None
+            if not isinstance(message, dict):
+                message = {"type": "question", "question": text}
+
+            kind = message.get("type")
+            if kind == "ping":
+                await send({"type": "pong"})
+            elif kind == "pong":
+                continue
+            elif kind == "cancel":
+                if await cancel_generation():
+                    await send({"type": "cancelled"})
+            elif kind == "question":
+                question = str(message.get("question") or "").strip()
+                if not question:
+                    await send({"type": "error", "status": 422, "detail": "Question is empty"})
+                elif generation is not None and not generation.done():
+                    await send({"type": "error", "status": 409, "detail": "A question is already being answered"})
+                else:
+                    generation = asyncio.create_task(answer(question))
+            else:
+                await send({"type": "error", "status": 400, "detail": f"Unknown message type {kind!r}"})
+    except (WebSocketDisconnect, asyncio.TimeoutError):
+        pass
+    finally:
+        await cancel_generation()
+
+
 @router.post("/{session_id}/chat")
-async def ask_ai_about_book(db: db_dependency, session_id: int, user: user_dependency,
+async def ask_ai_about_book(db: read_db_dependency, session_id: int, user: user_dependency,
                             question_request: QuestionRequest):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication Failed")
 
-    permission = check_user_session_permission(user.get('id'), session_id, db)
+    permission, session = await check_user_session_permission(user.get('id'), session_id, db)
     if permission is None:
         raise HTTPException(status_code=404, detail="Session not found")
     if not permission:
         raise HTTPException(status_code=403, detail="Not allowed to access this session")
+    if session.slug is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+    slug = session.slug
+
+    question = question_request.question
+    try:
+        chunks = await ai_service.answer_about_book(question, slug, user.get('id'))
+    except SchedulerBusy as exc:
+        raise HTTPException(status_code=429, detail="Too many questions in progress, try again shortly",
+                            headers={"Retry-After": str(exc.retry_after)})
+    except ai_service.BookNotIndexed:
+        raise HTTPException(status_code=409, detail=BOOK_NOT_INDEXED)
 
-    session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
-    book = db.query(Book).filter(Book.id == session.book_id).first()
+    # persisted through the write-behind buffer so the stream never waits on the database
+    chat_writer.write(session_id, 'user', question)
 
     async def event_publisher():
-        async for chunk in ai_service.answer_about_book(question_request.question, book.slug):
-            payload = {"data": chunk}
-            yield f"data: {json.dumps(payload)}\n\n"
-        yield "data: [DONE]\n\n"
+        answer = []
+        try:
+            async for chunk in chunks:
+                answer.append(chunk)
+                payload = {"data": chunk}
+                yield f"data: {json.dumps(payload)}\n\n"
+            yield "data: [DONE]\n\n"
+        finally:
+            # also keeps what was generated before a client went away
+            if answer:
+                chat_writer.write(session_id, 'AI', "".join(answer))
 
     return StreamingResponse(event_publisher(), media_type="text/event-stream")
 
 
-@router.post("")
+@router.post("", response_model=ChatSessionResponse)
 async def create_new_session(db: db_dependency, user: user_dependency, session_create_request: SessionCreateRequest):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication Failed")
 
-    book = db.query(Book).filter(Book.id == session_create_request.book_id).first()
+    book = await db.scalar(select(Book.id).where(Book.id == session_create_request.book_id))
 
     if book is None:
         raise HTTPException(status_code=404, detail="Book not found")
 
-    session = ChatSession(user_id=user.get('id'), book_id=session_create_request.book_id)
-    db.add(session)
-    db.commit()
-    db.refresh(session)
+    # RETURNING hands back the row with its server side created_at, no refresh query needed
+    result = await db.execute(
+        insert(ChatSession)
+        .values(user_id=user.get('id'), book_id=session_create_request.book_id)
+        .returning(ChatSession.id, ChatSession.user_id, ChatSession.book_id, ChatSession.created_at)
+    )
+    session = dict(result.one()._mapping)
+    await db.commit()
     return session
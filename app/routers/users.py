@@ -1,11 +1,13 @@
+from datetime import datetime
 from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel, Field
 
 from .auth import get_current_user
-from ..database import SessionLocal
-from sqlalchemy.orm import Session
+from ..database import get_db, get_read_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..models import Book, UserLibrary
 
@@ -14,32 +16,43 @@ class BooKRequest(BaseModel):
     book_id: int = Field(gt=0)
 
 
+class LibraryBookResponse(BaseModel):
+    id: int
+    book_id: int | None
+    user_id: int | None
+    added_at: datetime | None
+    # an entry outlives its book, the book columns are then null
+    title: str | None
+    slug: str | None
+    author: str | None
+
+
 router = APIRouter(
     prefix="/users",
     tags=["users"]
 )
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
 
 # need auth
-@router.get("/me/library", status_code=status.HTTP_200_OK)
-async def get_library_books(user: user_dependency, db: db_dependency):
+@router.get("/me/library", status_code=status.HTTP_200_OK, response_model=list[LibraryBookResponse])
+async def get_library_books(user: user_dependency, db: read_db_dependency):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication Failed")
     user_id = user.get('id')
-    library_books = db.query(UserLibrary).filter(UserLibrary.user_id == user_id).all()
-    return library_books
+    # the book details come along so clients don't need a GET /books/{id} per entry
+    library_books = await db.execute(
+        select(UserLibrary.id, UserLibrary.book_id, UserLibrary.user_id, UserLibrary.added_at,
+               Book.title, Book.slug, Book.author)
+        .outerjoin(Book, Book.id == UserLibrary.book_id)
+        .where(UserLibrary.user_id == user_id)
+        .order_by(UserLibrary.added_at.desc(), UserLibrary.id.desc())
+    )
+    return [dict(row._mapping) for row in library_books]
 
 
 # need auth
@@ -49,11 +62,11 @@ async def add_book_to_library(user: user_dependency, book_request: BooKRequest,
         raise HTTPException(status_code=401, detail="Authentication Failed")
     user_id = user.get('id')
     book_id = book_request.book_id
-    if db.query(Book).filter(Book.id == book_id).first() is None:
+    if await db.scalar(select(Book.id).where(Book.id == book_id)) is None:
         raise HTTPException(status_code=404, detail="Added Book not found")
     book = UserLibrary(book_id=book_id, user_id=user_id)
     db.add(book)
-    db.commit()
+    await db.commit()
 
 
 @router.delete("/me/library/{book_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -62,8 +75,10 @@ async def remove_book_from_library(user: user_dependency, book_id: int, db: db_d
         raise HTTPException(status_code=401, detail="Authentication Failed")
     user_id = user.get('id')
     book_id = book_id
-    book = db.query(UserLibrary).filter(UserLibrary.book_id == book_id).filter(UserLibrary.user_id == user_id).first()
+    book = await db.scalar(select(UserLibrary)
+                           .where(UserLibrary.book_id == book_id)
+                           .where(UserLibrary.user_id == user_id))
     if book is None:
         raise HTTPException(status_code=404, detail="Book not found")
-    db.delete(book)
-    db.commit()
+    await db.delete(book)
+    await db.commit()
@@ -0,0 +1,17 @@
+from . import models  # noqa: F401 registers the tables on Base.metadata
+from .database import Base, engine
+from .services import search
+
+
+def create_schema():
+    """Create the tables that don't exist yet and the search index.
+
+    Runs on API startup unless SMART_BOOK_CREATE_SCHEMA=0, deployments that migrate with
+    ``alembic upgrade head`` run ``python -m app.schema`` once instead, for the search index.
+    """
+    Base.metadata.create_all(bind=engine)
+    search.create_search_index(engine)
+
+
+if __name__ == "__main__":
+    create_schema()
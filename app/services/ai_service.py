@@ -1,32 +1,197 @@
-from langchain_chroma import Chroma
-from langchain_ollama import OllamaEmbeddings, ChatOllama
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema import SystemMessage, HumanMessage, AIMessage
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import asyncio
+import contextlib
+import functools
+import json
+import logging
 import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from . import context_builder, metrics
+from .answer_cache import AnswerCache
+from .embedding_cache import EmbeddingCache
+from .llm_scheduler import FairScheduler, InFlightGenerations
+from .page_store import EXTENSION as PAGE_STORE_EXTENSION, PageStoreRegistry, write_page_store
+from .vector_stores import VectorStoreRegistry, directory_size
+
+logger = logging.getLogger(__name__)
 
 # just from current directory go two directory up to reach project directory
 # this is just know the path of current file then know its directory three times
 project_directory = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-data_dir = os.path.join(project_directory, "data")
+# can be pointed somewhere else, e.g. a scratch directory for the benchmarks
+data_dir = os.getenv("SMART_BOOK_DATA_DIR", os.path.join(project_directory, "data"))
 book_directory = os.path.join(data_dir, "books")
+
+
+def content_path(content_url: str):
+    # relative urls are relative to the data directory, either as books/x.pdf or as seen from
+    # the project, data/books/x.pdf, so they still point at it when SMART_BOOK_DATA_DIR moves it
+    if not content_url or os.path.isabs(content_url):
+        return content_url
+    parts = os.path.normpath(content_url).split(os.sep)
+    if parts[0] == "data":
+        parts = parts[1:]
+    return os.path.join(data_dir, *parts)
+
+
 vector_directory = os.path.join(data_dir, "vectorstores")
 
 # determine model for embedding
-embeddings = OllamaEmbeddings(model='nomic-embed-text')
+EMBEDDING_MODEL = 'nomic-embed-text'
+CHAT_MODEL = 'llama3.2'
+
+# chunks already embedded once (same model, same text) are read back instead of re-embedded,
+# shared on disk between the api and the celery workers
+EMBEDDING_CACHE_SIZE = 2_000_000
+
+embedding_cache = EmbeddingCache(os.path.join(data_dir, "embedding_cache.sqlite3"), max_entries=EMBEDDING_CACHE_SIZE)
 
-model = ChatOllama(model='llama3.2', temperature=0)
+# langchain, chroma and the ollama clients take seconds to import, so they are only loaded by
+# load_ai_stack() on first use. processes that never answer a question never pay for them
+embeddings = None
+model = None
+splitter = None
+prompt_template = None
+_ai_stack_lock = threading.Lock()
 
 # determine splitter
-splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1000,
-    chunk_overlap=200
-)
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# retrieval takes up to RETRIEVAL_MAX_K hits but keeps only those within RETRIEVAL_DISTANCE_SLACK
+# of the best one (at least RETRIEVAL_MIN_K), then packs them into CONTEXT_TOKEN_BUDGET tokens
+RETRIEVAL_MAX_K = 20
+RETRIEVAL_MIN_K = 3
+RETRIEVAL_DISTANCE_SLACK = 0.25
+CONTEXT_TOKEN_BUDGET = 1500
 
 # batch size help not to load all data at once but chunk it then add it
 BATCH_SIZE = 100
 
+# progress of an ingestion, kept next to the store so a crashed run resumes where it stopped
+INGEST_CHECKPOINT = "ingest.json"
+
+# a book is ingested by many workers at once in page ranges of this size, the chunks of every
+# range are kept here until all of them are embedded and the store is built in one go
+INGEST_PAGES_PER_TASK = 25
+ingest_staging_directory = os.path.join(data_dir, "ingest")
+
+# the text of every page, extracted from the PDF once and read from here by everything after
+page_stores = PageStoreRegistry(os.path.join(data_dir, "pages"))
+
+# chroma has no async client, its blocking calls run on this bounded pool instead of the event loop
+AI_EXECUTOR_WORKERS = 8
+
+ai_executor = ThreadPoolExecutor(max_workers=AI_EXECUTOR_WORKERS, thread_name_prefix="ai")
+
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(ai_executor, functools.partial(func, *args, **kwargs))
+
+
+# how many opened vector stores (and how much of their on-disk data) we keep around between questions
+VECTOR_STORE_CACHE_SIZE = 16
+VECTOR_STORE_CACHE_BYTES = 2 * 1024 ** 3
+
+
+def open_vector_store(slug: str, persistent_directory: str):
+    load_ai_stack()
+    from langchain_chroma import Chroma
+
+    return Chroma(
+        collection_name=slug,
+        embedding_function=embeddings,
+        persist_directory=persistent_directory,
+    )
+
+
+class BookNotIndexed(Exception):
+    def __init__(self, slug: str):
+        super().__init__(f"{slug} is not indexed yet")
+        self.slug = slug
+
+
+def open_book_store(slug: str, persistent_directory: str):
+    # only finished stores are opened, opening one that is still being ingested would create an
+    # empty store at the final path and keep it open, and the book would stay empty for this process
+    checkpoint = read_ingest_checkpoint(persistent_directory)
+    if checkpoint is None or not checkpoint["complete"]:
+        raise BookNotIndexed(slug)
+    return open_vector_store(slug, persistent_directory)
+
+
+def close_vector_store(vector_store):
+    # chroma keeps one system per directory for the life of the process, let go of it before
+    # the directory is moved, deleted or opened again after another process rebuilt it
+    close = getattr(vector_store._client, "close", None)
+    if close is not None:
+        close()
+
+
+vector_stores = VectorStoreRegistry(
+    open_store=open_book_store,
+    directory=vector_directory,
+    max_stores=VECTOR_STORE_CACHE_SIZE,
+    max_bytes=VECTOR_STORE_CACHE_BYTES,
+    close_store=close_vector_store,
+)
+
+# answers to (nearly) the same question about the same book are replayed instead of regenerated
+ANSWER_CACHE_THRESHOLD = 0.95
+ANSWER_CACHE_TTL = 60 * 60
+
+answer_cache = AnswerCache(threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL)
+
+# whenever a book's vectors change its cached answers may be wrong
+vector_stores.add_invalidation_listener(answer_cache.invalidate)
+
+# a single local ollama gets slower for everyone past a few concurrent calls, the rest wait
+# their turn (fairly per user) for up to QUEUE_MAX_WAIT seconds and are turned away after that.
+# embeddings are quick so a user (or an anonymous address) may have more of them queued
+GENERATION_SLOTS = 2
+GENERATION_QUEUE_PER_USER = 4
+EMBEDDING_SLOTS = 4
+EMBEDDING_QUEUE_PER_USER = 32
+QUEUE_MAX_SIZE = 256
+QUEUE_MAX_WAIT = 30
+
+generation_scheduler = FairScheduler("generation", GENERATION_SLOTS, max_wait=QUEUE_MAX_WAIT,
+                                     max_queue=QUEUE_MAX_SIZE, max_queue_per_user=GENERATION_QUEUE_PER_USER)
+embedding_scheduler = FairScheduler("embedding", EMBEDDING_SLOTS, max_wait=QUEUE_MAX_WAIT,
+                                    max_queue=QUEUE_MAX_SIZE, max_queue_per_user=EMBEDDING_QUEUE_PER_USER)
+
+# the same question about the same book asked while it is being answered shares that answer
+in_flight = InFlightGenerations()
+
+# one book level embedding (title, author, description) per book so discovery is a single lookup
+# instead of querying every book collection, slugs never start with "_" so the directory can't clash
+CATALOG_DIRECTORY = "_catalog"
+CATALOG_COLLECTION = "book-catalog"
+
+
+def open_catalog_store(name: str, persistent_directory: str):
+    load_ai_stack()
+    from langchain_chroma import Chroma
+
+    return Chroma(
+        collection_name=CATALOG_COLLECTION,
+        embedding_function=embeddings,
+        persist_directory=persistent_directory,
+    )
+
+
+catalog_index = VectorStoreRegistry(
+    open_store=open_catalog_store,
+    directory=vector_directory,
+    max_stores=1,
+    close_store=close_vector_store,
+)
+
 SYSTEM_MESSAGE = """
 You are an expert assistant specialized in answering questions about books using only provided source material.
  Do NOT use external knowledge beyond what is included in the Context. 
@@ -34,7 +199,7 @@ You are an expert assistant specialized in answering questions about books using
 """
 
 HUMAN_MESSAGE = """
-CONTEXT (retrieved documents):
+CONTEXT (retrieved passages, numbered, with their page):
 {docs}
 -- End of Context --
 
@@ -44,71 +209,734 @@ QUESTION:
 INSTRUCTIONS (follow exactly):
 1. Base your entire answer only on the passages in "CONTEXT". Do not invent facts or use outside knowledge.
 2. If the context contains a clear, direct answer or even partial information, answer concisely (1–4 sentences)
-4. If the context is contradictory, explicitly state: "Conflicting information found" and list the differing passages with citations.
+4. If the context is contradictory, explicitly state: "Conflicting information found" and list the differing passages with citations like [1] or [2, page 14].
 5. If no relevant information exists in CONTEXT, reply exactly: "I could not find the answer in the provided book excerpts."
 6. Keep the entire response ≤ 400 words unless the user asks for more detail.
 """
 
-messages_template = [
-    SystemMessage(content=SYSTEM_MESSAGE),
-    ('human', HUMAN_MESSAGE)
-]
 
-prompt_template = ChatPromptTemplate.from_messages(messages=messages_template)
+def load_ai_stack():
+    """Import the AI libraries and build the model clients, once per process."""
+    global embeddings, model, splitter, prompt_template
+    if prompt_template is not None:
+        return
+    with _ai_stack_lock:
+        if prompt_template is not None:
+            return
+        from langchain.prompts import ChatPromptTemplate
+        from langchain.schema import SystemMessage
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        from langchain_ollama import OllamaEmbeddings, ChatOllama
+        # chroma is imported now as well, so opening the first store doesn't stall on it
+        import langchain_chroma  # noqa: F401
+
+        from .cached_embeddings import CachedEmbeddings
+
+        # models swapped in by use_models() before the first load are kept
+        if embeddings is None:
+            embeddings = CachedEmbeddings(OllamaEmbeddings(model=EMBEDDING_MODEL), embedding_cache, EMBEDDING_MODEL)
+        if model is None:
+            model = ChatOllama(model=CHAT_MODEL, temperature=0)
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            # lets the context builder merge neighbouring chunks exactly
+            add_start_index=True,
+        )
+        messages_template = [
+            SystemMessage(content=SYSTEM_MESSAGE),
+            ('human', HUMAN_MESSAGE)
+        ]
+        # set last, everything else is in place once this isn't None
+        prompt_template = ChatPromptTemplate.from_messages(messages=messages_template)
 
 
-async def answer_about_book(question: str, slug: str):
-    persistent_directory = os.path.join(vector_directory, slug)
+async def ensure_ai_stack():
+    # the first load imports for seconds, it must not stall the event loop
+    if prompt_template is None:
+        await run_blocking(load_ai_stack)
 
-    vector_store = Chroma(
-        collection_name=slug,
-        embedding_function=embeddings,
-        persist_directory=persistent_directory,
-    )
 
-    # embede question
-    question_embedding = embeddings.embed_query(question)
-    import time
+async def embed_query(text: str, user=None):
+    await ensure_ai_stack()
+    # cache hits never reach the model, only misses wait for an embedding slot
+    vector = await embeddings.acached_query(text)
+    if vector is None:
+        async with embedding_scheduler.slot(user):
+            vector = await embeddings.aembed_uncached_query(text)
+    return vector
 
 
-    # find most similar parts of the book
-    similar_docs = vector_store.similarity_search_by_vector(question_embedding, 20)
+def question_key(slug: str, question: str):
+    return slug, " ".join(question.lower().split())
+
 
+async def open_book(slug: str):
+    # opening is usually a cache hit, a miss touches the disk so keep it off the loop.
+    # it also notices stores rebuilt by a worker, which drops this book's cached answers
+    with metrics.timed(metrics.RAG_STAGE_SECONDS, "vector_store", stage="vector_store_open"):
+        return await run_blocking(vector_stores.get, slug)
 
-    prompt = prompt_template.invoke({'question': question, 'docs': [doc.page_content for doc in similar_docs]})
 
+def retrieve(slug: str, question_embedding, k: int):
+    # leased, a store evicted or rebuilt meanwhile is only closed once the search is done
+    with vector_stores.lease(slug) as vector_store:
+        return vector_store.similarity_search_by_vector_with_relevance_scores(question_embedding, k)
 
 
+async def answer_about_book(question: str, slug: str, user=None):
+    """Admit a question about a book and return the stream of its answer chunks.
+
+    Waiting for the model happens here, before anything is streamed, so callers can
+    still turn ``SchedulerBusy`` or ``BookNotIndexed`` into a proper error response. The store is looked up
+    for every question, so a rebuilt or deleted book is noticed even by a long chat.
+    """
+    started = time.perf_counter()
+    await ensure_ai_stack()
+
+    await open_book(slug)
+
+    # embede question
+    with metrics.timed(metrics.RAG_STAGE_SECONDS, "embed", stage="embed_query"):
+        question_embedding = await embed_query(question, user)
+
+    with metrics.timed(metrics.RAG_STAGE_SECONDS, stage="answer_cache"):
+        cached_answer = answer_cache.lookup(slug, question_embedding)
+    if cached_answer is not None:
+        metrics.RAG_ANSWERS.inc(source="cache")
+        return replay_answer(cached_answer, started)
+
+    key = question_key(slug, question)
+    generation = in_flight.get(key)
+    if generation is not None:
+        metrics.RAG_ANSWERS.inc(source="coalesced")
+        return timed_answer(generation.subscribe(), started)
+
+    # find most similar parts of the book
+    with metrics.timed(metrics.RAG_STAGE_SECONDS, "retrieve", stage="retrieve"):
+        similar_docs = await run_blocking(retrieve, slug, question_embedding, RETRIEVAL_MAX_K)
+
+    # merged, deduplicated and packed so the prompt stays small without losing the relevant text
+    with metrics.timed(metrics.RAG_STAGE_SECONDS, stage="prompt_build"):
+        context, citations, relevant = context_builder.build_context(
+            similar_docs, CONTEXT_TOKEN_BUDGET, RETRIEVAL_MIN_K, RETRIEVAL_DISTANCE_SLACK, CHUNK_OVERLAP)
+        prompt = prompt_template.invoke({'question': question, 'docs': context})
+    metrics.RAG_RETRIEVED_DOCS.observe(relevant)
+    metrics.RAG_CONTEXT_PASSAGES.observe(len(citations))
+    metrics.RAG_PROMPT_CHARS.observe(sum(len(message.content) for message in prompt.to_messages()))
+
+    with metrics.timed(metrics.RAG_STAGE_SECONDS, "queue", stage="queue"):
+        await generation_scheduler.acquire(user)
+
+    # someone else may have started on the same question while we were waiting
+    generation = in_flight.get(key)
+    if generation is not None:
+        generation_scheduler.release()
+        metrics.RAG_ANSWERS.inc(source="coalesced")
+        return timed_answer(generation.subscribe(), started)
+
+    metrics.RAG_ANSWERS.inc(source="model")
+    # runs on its own task so one client going away doesn't cut the answer off for the others
+    generation = in_flight.start(key, generate_answer(prompt, slug, question_embedding),
+                                 on_done=generation_scheduler.release)
+    return timed_answer(generation.subscribe(), started)
+
+
+async def generate_answer(prompt, slug: str, question_embedding):
+    answer = []
+    generation_started = time.perf_counter()
     async for data in model.astream(prompt):
+        answer.append(data.content)
         yield data.content
+    metrics.RAG_STAGE_SECONDS.observe(time.perf_counter() - generation_started, stage="generate")
+
+    # only reached when the whole answer was streamed, a dropped generation leaves nothing half cached
+    answer_cache.store(slug, question_embedding, "".join(answer))
+
+
+async def timed_answer(chunks, started: float):
+    first = True
+    async for chunk in chunks:
+        if first:
+            metrics.RAG_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - started)
+            first = False
+        yield chunk
+
+
+async def replay_answer(answer: str, started: float):
+    metrics.RAG_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - started)
+    for chunk in replay_chunks(answer):
+        yield chunk
+
+
+def replay_chunks(answer: str, words_per_chunk: int = 8):
+    # cached answers go out in small pieces so clients render them like a live answer
+    words = answer.split(" ")
+    for i in range(0, len(words), words_per_chunk):
+        chunk = " ".join(words[i:i + words_per_chunk])
+        yield chunk if i + words_per_chunk >= len(words) else chunk + " "
+
+
+def catalog_text(title: str, author: str, description: str | None):
+    return f"{title}\nby {author}\n\n{description or ''}".strip()
+
+
+def index_books_in_catalog(books: list[dict]):
+    # ids are the book ids so re-indexing an updated book replaces its entry
+    with catalog_index.lease(CATALOG_DIRECTORY) as catalog_store:
+        catalog_store.add_texts(
+            texts=[catalog_text(book["title"], book["author"], book.get("description")) for book in books],
+            metadatas=[{
+                "book_id": book["id"],
+                "slug": book.get("slug") or "",
+                "title": book["title"],
+                "author": book["author"],
+                "rating": float(book["rating"]),
+            } for book in books],
+            ids=[str(book["id"]) for book in books],
+        )
+
+
+def remove_book_from_catalog(book_id: int):
+    with catalog_index.lease(CATALOG_DIRECTORY) as catalog_store:
+        catalog_store.delete(ids=[str(book_id)])
+
+
+# chroma never shows a process what another one wrote to a collection it has open, so the catalog
+# is written by the api process that searches it (one embedding per book) and not by the workers
+async def index_catalog(books: list[dict]):
+    try:
+        await ensure_ai_stack()
+        await run_blocking(index_books_in_catalog, books)
+    except Exception:
+        logger.exception("indexing %d books in the catalog failed", len(books))
+
+
+async def unindex_catalog(book_id: int):
+    try:
+        await ensure_ai_stack()
+        await run_blocking(remove_book_from_catalog, book_id)
+    except Exception:
+        logger.exception("removing book %s from the catalog failed", book_id)
+
+
+def catalog_filter(min_rating: float | None = None, author: str | None = None):
+    conditions = []
+    if min_rating is not None:
+        conditions.append({"rating": {"$gte": min_rating}})
+    if author is not None:
+        conditions.append({"author": {"$eq": author}})
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+
+def search_catalog(query_embedding, k: int, where=None):
+    with catalog_index.lease(CATALOG_DIRECTORY) as catalog_store:
+        return catalog_store.similarity_search_by_vector_with_relevance_scores(query_embedding, k, filter=where)
 
 
-def search_ai(query: str):
-    return "this is list of books match what you need"
+async def search_ai(query: str, k: int = 10, min_rating: float | None = None, author: str | None = None,
+                    user=None):
+    query_embedding = await embed_query(query, user)
+    results = await run_blocking(search_catalog, query_embedding, k, catalog_filter(min_rating, author))
+
+    return [
+        {
+            "id": doc.metadata["book_id"],
+            "title": doc.metadata["title"],
+            "author": doc.metadata["author"],
+            "rating": doc.metadata["rating"],
+            "slug": doc.metadata["slug"],
+            "distance": distance,
+        }
+        for doc, distance in results
+    ]
+
+
+def read_ingest_checkpoint(persistent_directory: str):
+    try:
+        with open(os.path.join(persistent_directory, INGEST_CHECKPOINT)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_ingest_checkpoint(persistent_directory: str, checkpoint: dict):
+    # write then rename so a crash never leaves a torn checkpoint behind
+    path = os.path.join(persistent_directory, INGEST_CHECKPOINT)
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def load_pages(url: str, start: int = 0, end: int | None = None):
+    """Yield the text of pages [start, end) of a PDF, the same text PyPDFLoader extracts."""
+    import pypdf
+
+    reader = pypdf.PdfReader(url)
+    for page in reader.pages[start:end]:
+        yield page.extract_text(extraction_mode="plain").strip()
+
+
+def count_pages(url: str):
+    """Page count of a PDF, read from its page tree without extracting any text."""
+    import pypdf
+
+    url = content_path(url)
+    if not os.path.exists(url):
+        raise FileNotFoundError("The URL you entered doesn't exist")
+    return len(pypdf.PdfReader(url).pages)
+
+
+def extract_pages(url: str, slug: str):
+    """The book's page store, parsing the PDF only when there is none for this exact file yet."""
+    url = content_path(url)
+    if not os.path.exists(url):
+        raise FileNotFoundError("The URL you entered doesn't exist")
+    stamp = source_stamp(url)
+    store = page_stores.get(slug)
+    if store is None or store.source != url or store.stamp != stamp:
+        write_page_store(page_stores.path_for(slug), url, stamp, load_pages(url))
+        store = page_stores.get(slug)
+    return store
+
+
+def book_pages(url: str, slug: str, start: int = 0, end: int | None = None):
+    """Yield (page number, document) for pages [start, end) of a book, read from its page store."""
+    from langchain_core.documents import Document
+
+    store = extract_pages(url, slug)
+    for page_number, text in store.pages(start, end):
+        yield page_number, Document(page_content=text,
+                                    metadata={"source": url, "page": page_number, "total_pages": store.page_count})
 
 
 def add_book_to_vector_stores(url: str, slug: str):
+    url = content_path(url)
     if not os.path.exists(url):
         raise FileNotFoundError("The URL you entered doesn't exist")
 
     persistent_directory = os.path.join(vector_directory, slug)
-    if not os.path.exists(persistent_directory):
-
-        loader = PyPDFLoader(url)
-        documents = loader.load()
+    checkpoint = read_ingest_checkpoint(persistent_directory)
+    if checkpoint is not None and checkpoint["complete"]:
+        return
+
+    if checkpoint is None and os.path.exists(persistent_directory):
+        # a store without checkpoint was left by a crashed run of the old ingestion, its chunks
+        # have random ids so it can't be resumed safely, start it over
+        shutil.rmtree(persistent_directory)
+
+    if checkpoint is None:
+        checkpoint = {"source": url, "source_stamp": source_stamp(url), "pages_done": 0, "chunks": 0,
+                      "complete": False}
+
+    vector_store = open_vector_store(slug, persistent_directory)
+    os.makedirs(persistent_directory, exist_ok=True)
+
+    try:
+        # pages stream in one by one and are split on their own, so memory is bounded by the
+        # batch size and not by the book size
+        batch = []
+        batch_ids = []
+        pages_read = checkpoint["pages_done"]
+        for page_number, page in book_pages(url, slug, start=checkpoint["pages_done"]):
+            for chunk_number, chunk in enumerate(splitter.split_documents([page])):
+                batch.append(chunk)
+                # ids are stable so a batch replayed after a crash overwrites instead of duplicating
+                batch_ids.append(f"p{page_number}-c{chunk_number}")
+            pages_read = page_number + 1
+
+            # only whole pages are committed so the checkpoint always lands on a page boundary
+            if len(batch) >= BATCH_SIZE:
+                _commit_ingest_batch(vector_store, persistent_directory, checkpoint, batch, batch_ids, pages_read)
+                batch = []
+                batch_ids = []
+
+        if batch:
+            _commit_ingest_batch(vector_store, persistent_directory, checkpoint, batch, batch_ids, pages_read)
+
+        checkpoint["complete"] = True
+        write_ingest_checkpoint(persistent_directory, checkpoint)
+    finally:
+        close_vector_store(vector_store)
+
+    vector_stores.invalidate(slug)
+
+
+def _commit_ingest_batch(vector_store, persistent_directory, checkpoint, batch, batch_ids, pages_done):
+    # a single page may overflow the batch, chroma still gets at most BATCH_SIZE at a time
+    for i in range(0, len(batch), BATCH_SIZE):
+        with metrics.timed(metrics.INGEST_BATCH_SECONDS):
+            vector_store.add_documents(batch[i:i + BATCH_SIZE], ids=batch_ids[i:i + BATCH_SIZE])
+        metrics.INGEST_BATCH_CHUNKS.observe(len(batch[i:i + BATCH_SIZE]))
+    metrics.INGEST_PAGES.inc(pages_done - checkpoint["pages_done"])
+    checkpoint["pages_done"] = pages_done
+    checkpoint["chunks"] += len(batch)
+    write_ingest_checkpoint(persistent_directory, checkpoint)
+
+
+def page_ranges(page_count: int, pages_per_task: int = INGEST_PAGES_PER_TASK):
+    return [[start, min(start + pages_per_task, page_count)] for start in range(0, page_count, pages_per_task)]
+
+
+def _range_path(slug: str, start: int, end: int, kind: str = "chunks"):
+    return os.path.join(ingest_staging_directory, slug, f"{start:06d}-{end:06d}.{kind}.jsonl")
+
+
+def _write_range_file(path: str, records: list):
+    # written then renamed so a retried range never leaves a torn file behind
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    os.replace(path + ".tmp", path)
+
+
+def _read_range_file(path: str):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def embed_page_range(url: str, slug: str, start: int, end: int):
+    """Extract, split and embed pages [start, end) of a book, the chunks and the page text
+    are kept for ``commit_page_ranges``."""
+    from langchain_core.documents import Document
+
+    load_ai_stack()
+    url = content_path(url)
+    # only this range is parsed, the ranges of a book are extracted in parallel on its lane
+    texts = list(load_pages(url, start, end))
+    total_pages = count_pages(url)
+    chunks = []
+    for page_number, text in enumerate(texts, start):
+        page = Document(page_content=text, metadata={"source": url, "page": page_number, "total_pages": total_pages})
+        for chunk_number, chunk in enumerate(splitter.split_documents([page])):
+            chunks.append({"id": f"p{page_number}-c{chunk_number}", "text": chunk.page_content,
+                           "metadata": chunk.metadata})
+
+    # the vectors go to the shared embedding cache, the commit reads them back from there
+    for i in range(0, len(chunks), BATCH_SIZE):
+        with metrics.timed(metrics.INGEST_BATCH_SECONDS):
+            embeddings.embed_documents([chunk["text"] for chunk in chunks[i:i + BATCH_SIZE]])
+        metrics.INGEST_BATCH_CHUNKS.observe(len(chunks[i:i + BATCH_SIZE]))
+    metrics.INGEST_PAGES.inc(end - start)
+
+    _write_range_file(_range_path(slug, start, end, "pages"), texts)
+    _write_range_file(_range_path(slug, start, end), chunks)
+    return {"pages": end - start, "chunks": len(chunks)}
+
+
+def commit_page_ranges(url: str, slug: str, ranges: list[list[int]], stamp=None):
+    """Build the book's store from its embedded page ranges and swap it in whole.
+
+    Questions keep being answered from the previous store (or get none) until the swap,
+    they never see a half built one.
+    """
+    url = content_path(url)
+    staging_store = _staging_store(slug)
+    vector_store = open_vector_store(slug, staging_store)
+    chunks = 0
+    try:
+        for start, end in ranges:
+            records = _read_range_file(_range_path(slug, start, end))
+            # all embedding cache hits, nothing is sent to the model again
+            for i in range(0, len(records), BATCH_SIZE):
+                batch = records[i:i + BATCH_SIZE]
+                vector_store.add_texts([record["text"] for record in batch],
+                                       metadatas=[record["metadata"] for record in batch],
+                                       ids=[record["id"] for record in batch])
+            chunks += len(records)
+        write_ingest_checkpoint(staging_store, {
+            "source": url, "source_stamp": stamp or source_stamp(url), "pages_done": ranges[-1][1] if ranges else 0,
+            "chunks": chunks, "complete": True,
+        })
+    except BaseException:
+        close_vector_store(vector_store)
+        shutil.rmtree(staging_store, ignore_errors=True)
+        raise
+    close_vector_store(vector_store)
+
+    # the page store is put together from the text the ranges extracted, the PDF isn't parsed again
+    texts = (text for start, end in ranges for text in _read_range_file(_range_path(slug, start, end, "pages")))
+    write_page_store(page_stores.path_for(slug), url, stamp or source_stamp(url), texts)
+    _swap_in_store(slug, staging_store)
+    shutil.rmtree(os.path.join(ingest_staging_directory, slug), ignore_errors=True)
+    return chunks
+
+
+def _staging_store(slug: str):
+    # a fresh name every time, chroma must never find a cached system for it
+    return os.path.join(vector_directory, f".staging-{slug}-{uuid.uuid4().hex}")
+
+
+def _swap_in_store(slug: str, staging_store: str):
+    # a new directory, so a process that has the old store open notices it and opens this one
+    persistent_directory = os.path.join(vector_directory, slug)
+    previous = None
+    if os.path.exists(persistent_directory):
+        previous = os.path.join(vector_directory, f".trash-{slug}-{uuid.uuid4().hex}")
+        os.rename(persistent_directory, previous)
+    os.rename(staging_store, persistent_directory)
+    vector_stores.invalidate(slug)
+
+    if previous is not None:
+        shutil.rmtree(previous, ignore_errors=True)
+
+
+def source_stamp(url: str):
+    # a replaced or edited file changes size or mtime, either makes the stored chunks suspect
+    stat = os.stat(content_path(url))
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def source_changed(url: str, slug: str):
+    """Whether the file at ``url`` is not the one the book's committed store was built from."""
+    checkpoint = read_ingest_checkpoint(os.path.join(vector_directory, slug))
+    if checkpoint is None or not checkpoint["complete"]:
+        # an ingestion that is still running reads the file as it is now
+        return False
+    try:
+        return checkpoint["source"] != content_path(url) or checkpoint.get("source_stamp") != source_stamp(url)
+    except OSError:
+        # gone, there is nothing new to embed
+        return False
+
+
+def update_book_in_vector_stores(url: str, slug: str):
+    """Bring a book's store in line with its current content, re-embedding only what changed.
+
+    Chunk ids are positional, so every chunk is compared with what is stored under its id.
+    Unchanged chunks keep their stored vectors, only new or different ones are embedded.
+    The new store is built aside and swapped in like an ingestion, other processes never
+    keep reading a store that was changed under them.
+    """
+    url = content_path(url)
+    if not os.path.exists(url):
+        raise FileNotFoundError("The URL you entered doesn't exist")
 
-        docs = splitter.split_documents(documents)
+    persistent_directory = os.path.join(vector_directory, slug)
+    checkpoint = read_ingest_checkpoint(persistent_directory)
+    if checkpoint is None or not checkpoint["complete"]:
+        # the book's ingestion hasn't committed a store yet, building one here would race its swap-in
+        raise BookNotIndexed(slug)
+
+    stamp = source_stamp(url)
+    if checkpoint["source"] == url and checkpoint.get("source_stamp") == stamp:
+        return {"added": 0, "changed": 0, "unchanged": checkpoint["chunks"], "removed": 0}
+
+    previous_store = open_vector_store(slug, persistent_directory)
+    staging_store = _staging_store(slug)
+    vector_store = open_vector_store(slug, staging_store)
+    report = {"added": 0, "changed": 0, "unchanged": 0, "removed": 0}
+    try:
+        stale_ids = set(previous_store.get(include=[])["ids"])
+
+        batch = []
+        batch_ids = []
+        pages_read = 0
+        chunks = 0
+        for page_number, page in book_pages(url, slug):
+            for chunk_number, chunk in enumerate(splitter.split_documents([page])):
+                batch.append(chunk)
+                batch_ids.append(f"p{page_number}-c{chunk_number}")
+            pages_read = page_number + 1
+
+            if len(batch) >= BATCH_SIZE:
+                _sync_ingest_batch(previous_store, vector_store, batch, batch_ids, stale_ids, report)
+                chunks += len(batch)
+                batch = []
+                batch_ids = []
+
+        if batch:
+            _sync_ingest_batch(previous_store, vector_store, batch, batch_ids, stale_ids, report)
+            chunks += len(batch)
+        report["removed"] = len(stale_ids)
+
+        write_ingest_checkpoint(staging_store, {
+            "source": url, "source_stamp": stamp, "pages_done": pages_read, "chunks": chunks, "complete": True,
+        })
+    except BaseException:
+        close_vector_store(previous_store)
+        close_vector_store(vector_store)
+        shutil.rmtree(staging_store, ignore_errors=True)
+        raise
+    close_vector_store(previous_store)
+    close_vector_store(vector_store)
+
+    _swap_in_store(slug, staging_store)
+    return report
+
+
+# document wide metadata (total_pages, moddate, ...) changes with any edit of the file,
+# a chunk only counts as changed when its text or its place in the book does
+CHUNK_IDENTITY_METADATA = ("source", "page", "start_index")
+
+
+def _same_chunk(stored, chunk):
+    text, metadata = stored
+    return text == chunk.page_content and all(
+        metadata.get(key) == chunk.metadata.get(key) for key in CHUNK_IDENTITY_METADATA
+    )
 
-        vector_store = Chroma(
-            collection_name=slug,
-            embedding_function=embeddings,
-            persist_directory=persistent_directory,
-        )
 
-        for i in range(0, len(docs), BATCH_SIZE):
-            batch = docs[i:i + BATCH_SIZE]
-            vector_store.add_documents(batch)
+def _sync_ingest_batch(previous_store, vector_store, batch, batch_ids, stale_ids, report):
+    stored = previous_store.get(ids=batch_ids, include=["documents", "metadatas", "embeddings"])
+    stored = {chunk_id: (text, metadata, vector) for chunk_id, text, metadata, vector
+              in zip(stored["ids"], stored["documents"], stored["metadatas"], stored["embeddings"])}
+
+    kept = []
+    changed = []
+    changed_ids = []
+    for chunk, chunk_id in zip(batch, batch_ids):
+        stale_ids.discard(chunk_id)
+        previous = stored.get(chunk_id)
+        if previous is not None and _same_chunk(previous[:2], chunk):
+            report["unchanged"] += 1
+            kept.append((chunk_id, chunk, previous[2]))
+            continue
+        report["changed" if previous is not None else "added"] += 1
+        changed.append(chunk)
+        changed_ids.append(chunk_id)
+
+    # unchanged chunks are copied over with their vectors, with the metadata of the new file
+    if kept:
+        vector_store._collection.add(ids=[chunk_id for chunk_id, _, _ in kept],
+                                     embeddings=[vector for _, _, vector in kept],
+                                     documents=[chunk.page_content for _, chunk, _ in kept],
+                                     metadatas=[chunk.metadata for _, chunk, _ in kept])
+
+    # text that moved to another id is still an embedding cache hit, only new text reaches the model
+    for i in range(0, len(changed), BATCH_SIZE):
+        with metrics.timed(metrics.INGEST_BATCH_SECONDS):
+            vector_store.add_documents(changed[i:i + BATCH_SIZE], ids=changed_ids[i:i + BATCH_SIZE])
+        metrics.INGEST_BATCH_CHUNKS.observe(len(changed[i:i + BATCH_SIZE]))
 
 
 def remove_book_from_vector_stores(slug: str):
-    pass
+    # the files are deleted by a worker, this only stops the api from serving them
+    vector_stores.invalidate(slug)
+
+
+def delete_vector_store(slug: str):
+    vector_stores.invalidate(slug)
+    persistent_directory = os.path.join(vector_directory, slug)
+    if not os.path.isdir(persistent_directory):
+        return 0
+    reclaimed = directory_size(persistent_directory)
+    shutil.rmtree(persistent_directory, ignore_errors=True)
+    return reclaimed
+
+
+# a store directory is only an orphan once it has been left alone this long, so a book that is
+# being created (its row committed a moment later) is never collected
+VECTOR_STORE_GC_GRACE = 60 * 60
+
+
+def delete_page_store(slug: str):
+    return page_stores.delete(slug)
+
+
+def collect_vector_store_garbage(live_slugs: set[str]):
+    """Delete store directories that belong to no book any more and report the space reclaimed."""
+    report = {"removed": [], "bytes_reclaimed": 0}
+    now = time.time()
+    for entry in (os.scandir(vector_directory) if os.path.isdir(vector_directory) else []):
+        # "_" directories (the catalog) aren't books
+        if not entry.is_dir() or entry.name.startswith("_") or entry.name in live_slugs:
+            continue
+        if now - entry.stat().st_mtime < VECTOR_STORE_GC_GRACE:
+            continue
+        if entry.name.startswith("."):
+            # staging and trash directories left behind by a commit that crashed
+            report["bytes_reclaimed"] += directory_size(entry.path)
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            report["bytes_reclaimed"] += delete_vector_store(entry.name)
+        report["removed"].append(entry.name)
+
+    # page ranges of books deleted (or failed) before their ingestion was committed
+    if os.path.isdir(ingest_staging_directory):
+        for entry in os.scandir(ingest_staging_directory):
+            if not entry.is_dir() or entry.name in live_slugs or now - entry.stat().st_mtime < VECTOR_STORE_GC_GRACE:
+                continue
+            report["bytes_reclaimed"] += directory_size(entry.path)
+            shutil.rmtree(entry.path, ignore_errors=True)
+            report["removed"].append(os.path.join("ingest", entry.name))
+
+    # page stores of deleted books, and temporary files of extractions that crashed
+    if os.path.isdir(page_stores.directory):
+        for entry in os.scandir(page_stores.directory):
+            slug = entry.name[:-len(PAGE_STORE_EXTENSION)] if entry.name.endswith(PAGE_STORE_EXTENSION) else None
+            if not entry.is_file() or slug in live_slugs or now - entry.stat().st_mtime < VECTOR_STORE_GC_GRACE:
+                continue
+            report["bytes_reclaimed"] += entry.stat().st_size
+            if slug is not None:
+                page_stores.invalidate(slug)
+            os.remove(entry.path)
+            report["removed"].append(os.path.join("pages", entry.name))
+    return report
+
+
+def use_models(chat_model=None, embedding_model=None, embedding_model_name: str | None = None):
+    # lets the benchmarks (or another deployment) swap in different models without touching the call sites
+    global model, embeddings
+    if chat_model is not None:
+        model = chat_model
+    if embedding_model is not None:
+        # a different model means different vectors, so it gets its own cache namespace and fresh stores
+        from .cached_embeddings import CachedEmbeddings
+
+        name = embedding_model_name or type(embedding_model).__name__
+        embeddings = CachedEmbeddings(embedding_model, embedding_cache, name)
+        vector_stores.clear()
+        catalog_index.clear()
+
+
+def warm_up_vector_stores(slugs: list[str]):
+    indexed = [slug for slug in slugs
+               if (read_ingest_checkpoint(vector_stores.path_for(slug)) or {}).get("complete")]
+    return vector_stores.warm_up(indexed)
+
+
+async def warm_up(slugs: list[str]):
+    """Load the AI stack, both models and the given books' stores before the process takes traffic."""
+    report = {}
+    started = time.perf_counter()
+    await ensure_ai_stack()
+    report["ai_stack_seconds"] = round(time.perf_counter() - started, 3)
+
+    # straight to the model, a cache hit would leave ollama without the model loaded
+    started = time.perf_counter()
+    await embeddings.embeddings.aembed_query("warm up")
+    report["embedding_model_seconds"] = round(time.perf_counter() - started, 3)
+
+    # the first token means the chat model is in memory, the rest of the answer isn't needed
+    started = time.perf_counter()
+    async with contextlib.aclosing(model.astream("Reply with OK.")) as chunks:
+        async for _ in chunks:
+            break
+    report["chat_model_seconds"] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    await run_blocking(catalog_index.get, CATALOG_DIRECTORY)
+    report["vector_stores"] = await run_blocking(warm_up_vector_stores, slugs)
+    report["vector_store_seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def get_stats():
+    return {
+        "vector_stores": vector_stores.stats(),
+        "catalog_index": catalog_index.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "generation_scheduler": generation_scheduler.stats(),
+        "embedding_scheduler": embedding_scheduler.stats(),
+        "in_flight": in_flight.stats(),
+        "page_stores": page_stores.stats(),
+    }
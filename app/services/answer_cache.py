@@ -0,0 +1,87 @@
+import threading
+import time
+
+import numpy as np
+
+
+class AnswerCache:
+    """Per book cache of generated answers looked up by question embedding similarity.
+
+    A question hits when its cosine similarity to a cached question of the same
+    book is at least ``threshold`` and the entry is younger than ``ttl`` seconds.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl: float = 3600, max_entries_per_book: int = 256):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries_per_book = max_entries_per_book
+        self._books = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, slug: str, embedding):
+        query = _normalize(embedding)
+        with self._lock:
+            book = self._books.get(slug)
+            if book is not None:
+                self._expire(slug, book)
+                book = self._books.get(slug)
+            if book is None:
+                self.misses += 1
+                return None
+            similarities = book["vectors"] @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return book["answers"][best]
+
+    def store(self, slug: str, embedding, answer: str):
+        vector = _normalize(embedding)[np.newaxis, :]
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            book = self._books.get(slug)
+            if book is None or book["vectors"].shape[1] != vector.shape[1]:
+                self._books[slug] = {"vectors": vector, "answers": [answer], "expires": [expires_at]}
+                return
+            # oldest entries go first when the book is full
+            keep = self.max_entries_per_book - 1
+            book["vectors"] = np.vstack([book["vectors"][-keep:], vector]) if keep else vector
+            book["answers"] = (book["answers"][-keep:] if keep else []) + [answer]
+            book["expires"] = (book["expires"][-keep:] if keep else []) + [expires_at]
+
+    def invalidate(self, slug: str):
+        with self._lock:
+            self._books.pop(slug, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "books": len(self._books),
+                "entries": sum(len(book["answers"]) for book in self._books.values()),
+                "threshold": self.threshold,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _expire(self, slug, book):
+        # entries are stored in insertion order and share one ttl, so expired ones are a prefix
+        now = time.monotonic()
+        alive = next((i for i, expires_at in enumerate(book["expires"]) if expires_at > now), None)
+        if alive is None:
+            del self._books[slug]
+        elif alive:
+            book["vectors"] = book["vectors"][alive:]
+            book["answers"] = book["answers"][alive:]
+            book["expires"] = book["expires"][alive:]
+
+
+def _normalize(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from mimetypes import guess_type
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, PlainTextResponse, Response
+
+
+# files being streamed at once, every one holds a descriptor and a read buffer
+MAX_OPEN_FILES = int(os.getenv("BOOK_CONTENT_MAX_OPEN_FILES", "512"))
+
+# behind nginx the file can be handed over with X-Accel-Redirect, nginx then does the
+# sendfile, ranges and validators itself and no worker ever reads the book
+ACCEL_REDIRECT_PREFIX = os.getenv("BOOK_CONTENT_ACCEL_PREFIX")
+
+# readers always revalidate, which is a cheap 304 as long as the file didn't change
+CACHE_CONTROL = "public, no-cache"
+
+
+class ContentNotFound(Exception):
+    pass
+
+
+def resolve_path(content_url: str, root: str, base: str):
+    """Absolute path of a book file, refusing anything that resolves outside ``root``."""
+    if not content_url:
+        raise ContentNotFound()
+    path = os.path.realpath(os.path.join(base, content_url))
+    root = os.path.realpath(root)
+    if os.path.commonpath([path, root]) != root:
+        raise ContentNotFound()
+    return path
+
+
+async def stat_file(path: str):
+    try:
+        stat_result = await asyncio.to_thread(os.stat, path)
+    except OSError:
+        raise ContentNotFound()
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise ContentNotFound()
+    return stat_result
+
+
+def entity_tag(stat_result: os.stat_result):
+    # strong: any write moves mtime_ns or the size, and a replaced file gets a new inode
+    return f'"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def not_modified(request_headers: Headers, etag: str, stat_result: os.stat_result):
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        # when both are sent If-None-Match wins, If-Modified-Since is ignored
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(stat_result.st_mtime) <= since
+    return False
+
+
+class BookFileResponse(FileResponse):
+    """A FileResponse that only opens the file when a slot is free.
+
+    Starlette already streams in 64KB chunks, answers Range requests and hands the path
+    to the server with ``http.response.pathsend`` when it supports zero-copy sends.
+    """
+
+    def __init__(self, *args, limiter: "OpenFileLimiter", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["method"].upper() == "HEAD":
+            await super().__call__(scope, receive, send)
+            return
+        if not self.limiter.try_acquire():
+            response = PlainTextResponse("Too many books being read, try again shortly", status_code=503,
+                                         headers={"Retry-After": "1"})
+            await response(scope, receive, send)
+            return
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.limiter.release()
+
+
+class OpenFileLimiter:
+    """Counts book files being streamed and turns readers away past ``max_open``."""
+
+    def __init__(self, max_open: int):
+        self.max_open = max_open
+        # only touched from the event loop thread, so no lock
+        self._open = 0
+        self.rejected = 0
+
+    def try_acquire(self):
+        if self._open >= self.max_open:
+            self.rejected += 1
+            return False
+        self._open += 1
+        return True
+
+    def release(self):
+        self._open -= 1
+
+    def stats(self):
+        return {"open": self._open, "max_open": self.max_open, "rejected": self.rejected}
+
+
+limiter = OpenFileLimiter(MAX_OPEN_FILES)
+
+
+async def content_response(content_url: str, request_headers: Headers, root: str, base: str):
+    path = resolve_path(content_url, root, base)
+    stat_result = await stat_file(path)
+    etag = entity_tag(stat_result)
+    filename = os.path.basename(path)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": CACHE_CONTROL,
+    }
+
+    if not_modified(request_headers, etag, stat_result):
+        return Response(status_code=304, headers=headers)
+
+    media_type = guess_type(filename)[0] or "application/octet-stream"
+    if ACCEL_REDIRECT_PREFIX:
+        relative = os.path.relpath(path, os.path.realpath(root)).replace(os.sep, "/")
+        headers["X-Accel-Redirect"] = ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + relative
+        return Response(headers=headers, media_type=media_type)
+
+    # the stat result is passed in so the file isn't stat'ed a second time, and the
+    # ETag given here is also what If-Range is checked against
+    return BookFileResponse(path, headers=headers, media_type=media_type, filename=filename,
+                            stat_result=stat_result, content_disposition_type="inline",
+                            limiter=limiter)
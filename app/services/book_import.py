@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import sys
+
+from pydantic import ValidationError
+from slugify import slugify
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.exc import IntegrityError
+
+from ..models import Book, BookIngestion
+
+
+FORMATS = ("csv", "jsonl")
+
+# rows inserted per statement, and per transaction
+IMPORT_BATCH_SIZE = 2000
+
+# books per celery message, one worker plans the ingestion of a whole group before taking the next one
+INGEST_GROUP_SIZE = 25
+# books embedded per round into the catalog index
+CATALOG_GROUP_SIZE = 500
+
+# an import full of broken rows still answers with a bounded report
+MAX_REPORTED_ERRORS = 1000
+
+# a concurrent writer can take the ids we reserved, the batch is then retried with fresh ones
+MAX_BATCH_ATTEMPTS = 3
+
+
+def detect_format(filename: str | None = None, content_type: str | None = None):
+    if content_type:
+        content_type = content_type.split(";")[0].strip().lower()
+        if content_type in ("text/csv", "application/csv"):
+            return "csv"
+        if content_type in ("application/x-ndjson", "application/jsonl", "application/x-jsonlines"):
+            return "jsonl"
+    if filename:
+        extension = os.path.splitext(filename)[1].lower().lstrip(".")
+        if extension in ("jsonl", "ndjson"):
+            return "jsonl"
+        if extension == "csv":
+            return "csv"
+    return None
+
+
+def read_rows(data: str, fmt: str):
+    """Yield (row number, fields, error) for every record of a CSV or JSON lines document."""
+    if fmt == "csv":
+        reader = csv.DictReader(io.StringIO(data))
+        for number, row in enumerate(reader, start=1):
+            # empty cells mean "not given", so optional columns can be left blank
+            yield number, {key: value if value != "" else None for key, value in row.items() if key}, None
+    elif fmt == "jsonl":
+        number = 0
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                yield number, None, f"Invalid JSON: {exc}"
+                continue
+            if not isinstance(row, dict):
+                yield number, None, "Expected a JSON object"
+                continue
+            yield number, row, None
+    else:
+        raise ValueError(f"Unknown import format {fmt!r}, expected one of {', '.join(FORMATS)}")
+
+
+async def reserve_book_ids(db, count: int):
+    # ids are known before the insert so the slug goes into the same statement instead of
+    # the follow-up UPDATE the after_insert event issues for every single book
+    if db.bind.dialect.name == "postgresql":
+        result = await db.execute(
+            text("SELECT nextval(pg_get_serial_sequence('books', 'id')) FROM generate_series(1, :count)"),
+            {"count": count},
+        )
+        return [row[0] for row in result]
+    start = await db.scalar(select(func.coalesce(func.max(Book.id), 0))) + 1
+    return list(range(start, start + count))
+
+
+async def insert_batch(db, books):
+    for attempt in range(1, MAX_BATCH_ATTEMPTS + 1):
+        ids = await reserve_book_ids(db, len(books))
+        rows = [
+            {**book.model_dump(), "id": book_id, "slug": f"{slugify(book.title)}-{book_id}"}
+            for book_id, book in zip(ids, books)
+        ]
+        try:
+            # a bulk insert runs no per-row mapper events
+            await db.execute(insert(Book), rows)
+            # progress shows up at /admin/books/{id}/ingestion from the moment the books exist
+            await db.execute(insert(BookIngestion), [
+                {"book_id": row["id"], "slug": row["slug"], "status": "queued", "pages_total": 0, "pages_done": 0,
+                 "chunks": 0}
+                for row in rows
+            ])
+            await db.commit()
+            return rows
+        except IntegrityError:
+            await db.rollback()
+            if attempt == MAX_BATCH_ATTEMPTS:
+                raise
+
+
+async def import_books(db, data: str, fmt: str, schema, batch_size: int = IMPORT_BATCH_SIZE):
+    """Validate rows with ``schema`` and insert the valid ones in batches.
+
+    Returns the per-row report and the inserted books, every batch is committed on its own
+    so a failing batch doesn't undo the ones before it.
+    """
+    report = {"imported": 0, "failed": 0, "errors": [], "errors_truncated": False}
+    imported = []
+
+    def fail(number, errors):
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"row": number, "errors": errors})
+        else:
+            report["errors_truncated"] = True
+
+    async def flush(batch):
+        try:
+            rows = await insert_batch(db, [book for _, book in batch])
+        except Exception as exc:
+            await db.rollback()
+            for number, _ in batch:
+                fail(number, [f"Could not insert: {exc.__class__.__name__}"])
+            return
+        report["imported"] += len(rows)
+        imported.extend(rows)
+
+    batch = []
+    for number, row, error in read_rows(data, fmt):
+        if error is not None:
+            fail(number, [error])
+            continue
+        try:
+            book = schema.model_validate(row)
+        except ValidationError as exc:
+            fail(number, [f"{'.'.join(str(part) for part in e['loc']) or 'row'}: {e['msg']}" for e in exc.errors()])
+            continue
+        batch.append((number, book))
+        if len(batch) >= batch_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+
+    return report, imported
+
+
+def enqueue_ingestion(books):
+    from ..tasks import ai_tasks
+
+    # grouped so a 50k book import is a few thousand messages instead of a hundred thousand,
+    # every book is then ingested like one added on its own. publishing blocks, don't call from the event loop
+    for i in range(0, len(books), INGEST_GROUP_SIZE):
+        group = books[i:i + INGEST_GROUP_SIZE]
+        ai_tasks.ingest_books_task.delay([
+            {"id": book["id"], "url": book["content_url"], "slug": book["slug"]} for book in group
+        ])
+
+
+async def index_in_catalog(books):
+    from . import ai_service
+
+    # the catalog index is written by the api process itself, see ai_service.index_catalog
+    for i in range(0, len(books), CATALOG_GROUP_SIZE):
+        group = books[i:i + CATALOG_GROUP_SIZE]
+        await ai_service.index_catalog([
+            {key: book[key] for key in ("id", "slug", "title", "author", "rating", "description")}
+            for book in group
+        ])
+
+
+async def _import_file(path: str, fmt: str, enqueue: bool):
+    from ..database import AsyncSessionLocal, async_engine
+    from ..routers.admin import BookRequest
+    from .response_cache import catalog_cache
+
+    with open(path, encoding="utf-8-sig") as f:
+        data = f.read()
+    try:
+        async with AsyncSessionLocal() as db:
+            report, books = await import_books(db, data, fmt, BookRequest)
+        if books:
+            # only reaches the api processes when the catalog cache is shared through redis
+            await catalog_cache.bump()
+    finally:
+        await async_engine.dispose()
+    if enqueue and books:
+        enqueue_ingestion(books)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import books from a CSV or JSON lines file.")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS, help="defaults to the file extension")
+    parser.add_argument("--no-enqueue", action="store_true", help="don't queue the embedding jobs")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or detect_format(filename=args.path)
+    if fmt is None:
+        parser.error("can't tell the format from the file name, pass --format")
+    report = asyncio.run(_import_file(args.path, fmt, not args.no_enqueue))
+    print(json.dumps(report, indent=2))
+    if report["imported"]:
+        # only the api process writes the catalog index
+        print("run POST /admin/ai/catalog/rebuild to make the new books searchable with /ai/search", file=sys.stderr)
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,59 @@
+import asyncio
+
+from langchain_core.embeddings import Embeddings
+
+from .embedding_cache import EmbeddingCache
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends texts missing from the cache to the model."""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model_name: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+        # queries and documents get separate keys, some models embed them differently
+        self._document_namespace = f"{model_name}:document"
+        self._query_namespace = f"{model_name}:query"
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors = self.cache.get_many(self._document_namespace, texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            computed = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            self.cache.put_many(self._document_namespace, missing, [computed[text] for text in missing])
+            vectors = [computed[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        vector = self.cache.get_many(self._query_namespace, [text])[0]
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put_many(self._query_namespace, [text], [vector])
+        return vector
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors = await asyncio.to_thread(self.cache.get_many, self._document_namespace, texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            computed = dict(zip(missing, await self.embeddings.aembed_documents(missing)))
+            await asyncio.to_thread(self.cache.put_many, self._document_namespace, missing,
+                                    [computed[text] for text in missing])
+            vectors = [computed[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+        return vectors
+
+    async def acached_query(self, text: str) -> list[float] | None:
+        return (await asyncio.to_thread(self.cache.get_many, self._query_namespace, [text]))[0]
+
+    async def aembed_uncached_query(self, text: str) -> list[float]:
+        # for callers that already missed with acached_query, the lookup isn't repeated
+        vector = await self.embeddings.aembed_query(text)
+        await asyncio.to_thread(self.cache.put_many, self._query_namespace, [text], [vector])
+        return vector
+
+    async def aembed_query(self, text: str) -> list[float]:
+        vector = (await asyncio.to_thread(self.cache.get_many, self._query_namespace, [text]))[0]
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            await asyncio.to_thread(self.cache.put_many, self._query_namespace, [text], [vector])
+        return vector
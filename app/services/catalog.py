@@ -0,0 +1,86 @@
+import base64
+import json
+
+import orjson
+from sqlalchemy import select, tuple_
+
+from ..models import Book
+
+
+BOOK_FIELDS = ("id", "author", "title", "rating", "description", "content_url", "slug", "created_at", "updated_at")
+
+# id is always the tie breaker so every sort is a total order and a cursor points at exactly one row
+SORT_COLUMNS = {
+    "id": Book.id,
+    "rating": Book.rating,
+    "title": Book.title,
+}
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# rows fetched per round trip when streaming a full export
+EXPORT_BATCH_SIZE = 1000
+
+
+def book_columns(fields=BOOK_FIELDS):
+    return [getattr(Book, name) for name in fields]
+
+
+def parse_fields(fields: str | None, sort: str = "id"):
+    if not fields:
+        return list(BOOK_FIELDS)
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in requested if name not in BOOK_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    # the cursor is built from the sort column and id so they are always selected
+    for required in ("id", sort):
+        if required not in requested:
+            requested.insert(0, required)
+    return list(dict.fromkeys(requested))
+
+
+def encode_cursor(row: dict, sort: str) -> str:
+    raw = json.dumps([row[sort], row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, last_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(last_id, int):
+        raise ValueError("Invalid cursor")
+    if sort == "rating" and not isinstance(value, (int, float)):
+        raise ValueError("Invalid cursor")
+    if sort == "title" and not isinstance(value, str):
+        raise ValueError("Invalid cursor")
+    return value, last_id
+
+
+def books_query(fields: list[str], sort: str = "id", order: str = "asc", cursor: str | None = None):
+    columns = book_columns(fields)
+    sort_column = SORT_COLUMNS[sort]
+    query = select(*columns)
+
+    if cursor is not None:
+        value, last_id = decode_cursor(cursor, sort)
+        if sort == "id":
+            key, bound = Book.id, last_id
+        else:
+            key, bound = tuple_(sort_column, Book.id), tuple_(value, last_id)
+        query = query.where(key > bound if order == "asc" else key < bound)
+
+    if order == "asc":
+        query = query.order_by(sort_column.asc(), Book.id.asc())
+    else:
+        query = query.order_by(sort_column.desc(), Book.id.desc())
+    return query
+
+
+def dumps(value) -> bytes:
+    # the same compact output as json.dumps with isoformat datetimes, several times faster
+    return orjson.dumps(value)
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import insert
+
+from ..database import AsyncSessionLocal
+from ..models import ChatMessage
+
+
+logger = logging.getLogger(__name__)
+
+
+class ChatMessageWriter:
+    """Write-behind buffer for chat messages.
+
+    Streams hand messages over with ``write`` which never waits on the database,
+    a background task inserts them in batches shared across requests.
+    """
+
+    def __init__(self, session_factory, batch_size: int = 200, flush_interval: float = 0.05,
+                 max_pending: int = 10_000, max_retries: int = 3):
+        self._session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self._queue = None
+        self._task = None
+        self.written = 0
+        self.dropped = 0
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # let the writer drain what is already queued before shutting down
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def write(self, session_id: int, sender: str, content: str):
+        if self._queue is None:
+            raise RuntimeError("ChatMessageWriter is not started")
+        message = {
+            "session_id": session_id,
+            "sender": sender,
+            "content": content,
+            # stamped now, not when the batch is flushed
+            "created_at": datetime.now(timezone.utc),
+        }
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("chat writer queue full, dropping message for session %s", session_id)
+
+    def stats(self):
+        return {
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch):
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                async with self._session_factory() as db:
+                    await db.execute(insert(ChatMessage), batch)
+                    await db.commit()
+                self.written += len(batch)
+                return
+            except Exception:
+                logger.exception("failed to write %d chat messages (attempt %d)", len(batch), attempt)
+                await asyncio.sleep(0.1 * attempt)
+        self.dropped += len(batch)
+
+
+chat_writer = ChatMessageWriter(AsyncSessionLocal)
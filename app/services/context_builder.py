@@ -0,0 +1,141 @@
+import re
+
+
+# rough size of a token for the llama/nomic tokenizers on english text
+CHARS_PER_TOKEN = 4
+
+# shortest overlap between two chunks that counts as them being neighbours
+MIN_TEXT_OVERLAP = 40
+
+# word 5-grams shared by two passages above this fraction make them duplicates
+DUPLICATE_THRESHOLD = 0.8
+
+# passages left with less room than this aren't worth truncating into the prompt
+MIN_PASSAGE_TOKENS = 48
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def select_relevant(results, min_k: int, distance_slack: float):
+    """Keep the hits close enough to the best one, but never fewer than ``min_k``.
+
+    ``results`` are (document, distance) pairs, smaller distance is more similar.
+    """
+    results = sorted(results, key=lambda result: result[1])
+    if not results:
+        return []
+    cutoff = results[0][1] * (1 + distance_slack) + 1e-6
+    return [result for i, result in enumerate(results) if i < min_k or result[1] <= cutoff]
+
+
+def _text_overlap(first: str, second: str, max_overlap: int):
+    # the splitter repeats the tail of a chunk at the head of the next one
+    for size in range(min(max_overlap, len(first), len(second)), MIN_TEXT_OVERLAP - 1, -1):
+        if first.endswith(second[:size]):
+            return size
+    return 0
+
+
+def merge_passages(results, max_overlap: int):
+    """Merge chunks of the same page that overlap or touch into single passages."""
+    groups = {}
+    for rank, (doc, distance) in enumerate(results):
+        key = (doc.metadata.get("source"), doc.metadata.get("page"))
+        groups.setdefault(key, []).append({
+            "text": doc.page_content,
+            "start": doc.metadata.get("start_index"),
+            "source": key[0],
+            "page": key[1],
+            "rank": rank,
+        })
+
+    passages = []
+    for chunks in groups.values():
+        if all(chunk["start"] is not None for chunk in chunks):
+            chunks.sort(key=lambda chunk: chunk["start"])
+        merged = [chunks[0]]
+        for chunk in chunks[1:]:
+            current = merged[-1]
+            if current["start"] is not None and chunk["start"] is not None:
+                current_end = current["start"] + len(current["text"])
+                if chunk["start"] <= current_end:
+                    current["text"] += chunk["text"][current_end - chunk["start"]:]
+                    current["rank"] = min(current["rank"], chunk["rank"])
+                    continue
+            else:
+                # stores ingested before start_index was recorded, fall back to matching the text
+                overlap = _text_overlap(current["text"], chunk["text"], max_overlap)
+                if overlap:
+                    current["text"] += chunk["text"][overlap:]
+                    current["rank"] = min(current["rank"], chunk["rank"])
+                    continue
+            merged.append(chunk)
+        passages.extend(merged)
+
+    passages.sort(key=lambda passage: passage["rank"])
+    return passages
+
+
+def _shingles(text: str):
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + 5]) for i in range(max(1, len(words) - 4))}
+
+
+def drop_near_duplicates(passages):
+    kept = []
+    kept_shingles = []
+    for passage in passages:
+        shingles = _shingles(passage["text"])
+        duplicate = False
+        for other in kept_shingles:
+            smaller = min(len(shingles), len(other)) or 1
+            if len(shingles & other) / smaller >= DUPLICATE_THRESHOLD:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(passage)
+            kept_shingles.append(shingles)
+    return kept
+
+
+def pack(passages, token_budget: int):
+    """Take passages in relevance order until the token budget is spent."""
+    packed = []
+    remaining = token_budget
+    for passage in passages:
+        tokens = estimate_tokens(passage["text"])
+        if tokens <= remaining:
+            packed.append(passage)
+            remaining -= tokens
+        elif remaining >= MIN_PASSAGE_TOKENS:
+            packed.append({**passage, "text": passage["text"][:remaining * CHARS_PER_TOKEN].rsplit(" ", 1)[0] + " ..."})
+            remaining = 0
+        if remaining < MIN_PASSAGE_TOKENS:
+            break
+    return packed
+
+
+def format_context(passages):
+    blocks = []
+    for number, passage in enumerate(passages, start=1):
+        # pdf pages are 0-based in the loader metadata
+        page = f" (page {passage['page'] + 1})" if isinstance(passage["page"], int) else ""
+        blocks.append(f"[{number}]{page}\n{passage['text'].strip()}")
+    return "\n\n".join(blocks)
+
+
+def build_context(results, token_budget: int, min_k: int, distance_slack: float, max_overlap: int):
+    """Turn (document, distance) hits into a compact, cited context for the prompt.
+
+    Returns the context text, the citations (number, page, source) it refers to and
+    how many hits passed the relevance cut.
+    """
+    relevant = select_relevant(results, min_k, distance_slack)
+    passages = pack(drop_near_duplicates(merge_passages(relevant, max_overlap)), token_budget)
+    citations = [
+        {"number": number, "page": passage["page"], "source": passage["source"]}
+        for number, passage in enumerate(passages, start=1)
+    ]
+    return format_context(passages), citations, len(relevant)
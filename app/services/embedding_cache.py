@@ -0,0 +1,147 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+
+
+# a hit only writes last_used back once the stored value is this old, so hits stay read only
+# and eviction is least recently used to within this many seconds
+TOUCH_INTERVAL = 60 * 60
+
+# hit and miss counts are kept in memory and added to the shared counters this often
+COUNTER_FLUSH_INTERVAL = 60
+
+
+class EmbeddingCache:
+    """Persistent embedding store keyed by (model name, text hash).
+
+    The file is shared by the API and the celery workers, entries beyond
+    ``max_entries`` are evicted least recently used first. Lookups that hit
+    don't write, see ``TOUCH_INTERVAL`` and ``COUNTER_FLUSH_INTERVAL``.
+    """
+
+    def __init__(self, path: str, max_entries: int = 1_000_000, evict_fraction: float = 0.01):
+        self.path = path
+        self.max_entries = max_entries
+        # evict a little more than needed so we don't evict on every single insert
+        self.evict_batch = max(1, int(max_entries * evict_fraction))
+        self._db = None
+        self._count = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._flushed_at = time.monotonic()
+
+    def _connection(self):
+        if self._db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL) WITHOUT ROWID"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)")
+            db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            db.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0), ('evictions', 0)")
+            db.commit()
+            self._count = db.execute("SELECT count(*) FROM embeddings").fetchone()[0]
+            self._db = db
+        return self._db
+
+    @staticmethod
+    def key(model: str, text: str) -> bytes:
+        return hashlib.sha256(f"{model}\0{text}".encode()).digest()
+
+    def get_many(self, model: str, texts: list[str]):
+        keys = [self.key(model, text) for text in texts]
+        found = {}
+        now = time.time()
+        stale = []
+        with self._lock:
+            db = self._connection()
+            # stay well below sqlite's bound parameter limit
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                for key, vector, last_used in db.execute(
+                        f"SELECT key, vector, last_used FROM embeddings WHERE key IN ({placeholders})", part):
+                    found[key] = vector
+                    if now - last_used > TOUCH_INTERVAL:
+                        stale.append(key)
+            hits = sum(1 for key in keys if key in found)
+            self._hits += hits
+            self._misses += len(keys) - hits
+
+            # the file is shared by every process, only write when there is something worth writing
+            flush = time.monotonic() - self._flushed_at > COUNTER_FLUSH_INTERVAL
+            for i in range(0, len(stale), 500):
+                part = stale[i:i + 500]
+                db.execute(f"UPDATE embeddings SET last_used = ? WHERE key IN ({','.join('?' * len(part))})",
+                           [now, *part])
+            if flush:
+                self._flush_counters(db)
+            if stale or flush:
+                db.commit()
+        return [_decode(found[key]) if key in found else None for key in keys]
+
+    def put_many(self, model: str, texts: list[str], vectors: list[list[float]]):
+        now = time.time()
+        rows = [(self.key(model, text), array("f", vector).tobytes(), now) for text, vector in zip(texts, vectors)]
+        with self._lock:
+            db = self._connection()
+            before = db.total_changes
+            db.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._count += db.total_changes - before
+            if self._count > self.max_entries:
+                self._evict(db)
+            # this commits anyway, the pending counts go along
+            self._flush_counters(db)
+            db.commit()
+
+    def _evict(self, db):
+        # other processes insert too, so recount before deciding how much to drop
+        self._count = db.execute("SELECT count(*) FROM embeddings").fetchone()[0]
+        excess = self._count - self.max_entries
+        if excess <= 0:
+            return
+        amount = excess + self.evict_batch
+        deleted = db.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+            (amount,),
+        ).rowcount
+        db.execute("UPDATE counters SET value = value + ? WHERE name = 'evictions'", (deleted,))
+        self._count -= deleted
+
+    def _flush_counters(self, db):
+        db.execute("UPDATE counters SET value = value + ? WHERE name = 'hits'", (self._hits,))
+        db.execute("UPDATE counters SET value = value + ? WHERE name = 'misses'", (self._misses,))
+        self._hits = self._misses = 0
+        self._flushed_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            db = self._connection()
+            if self._hits or self._misses:
+                self._flush_counters(db)
+                db.commit()
+            counters = dict(db.execute("SELECT name, value FROM counters"))
+            entries = db.execute("SELECT count(*) FROM embeddings").fetchone()[0]
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": counters["hits"],
+            "misses": counters["misses"],
+            "hit_rate": counters["hits"] / lookups if lookups else 0.0,
+            # every hit is one text the model didn't have to embed
+            "embedding_calls_saved": counters["hits"],
+            "evictions": counters["evictions"],
+        }
+
+
+def _decode(blob: bytes):
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
@@ -0,0 +1,97 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import update
+
+from ..models import BookIngestion
+
+
+# an ingestion that hasn't finished yet, a book in one of these has no store to update
+ACTIVE_STATUSES = ("queued", "embedding", "committing")
+
+# books up to this many pages are ingested on the priority lane, so they never wait behind giant ones
+SMALL_BOOK_PAGES = 100
+
+PRIORITY_QUEUE = "ai_priority"
+BULK_QUEUE = "ai"
+
+
+def lane_for(page_count: int):
+    return PRIORITY_QUEUE if page_count <= SMALL_BOOK_PAGES else BULK_QUEUE
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def start(db, book_id: int, slug: str, pages_total: int, lane: str):
+    ingestion = db.query(BookIngestion).filter(BookIngestion.book_id == book_id).first()
+    if ingestion is None:
+        ingestion = BookIngestion(book_id=book_id, slug=slug)
+        db.add(ingestion)
+    ingestion.slug = slug
+    ingestion.status = "embedding"
+    ingestion.lane = lane
+    ingestion.pages_total = pages_total
+    ingestion.pages_done = 0
+    ingestion.chunks = 0
+    ingestion.error = None
+    ingestion.started_at = _now()
+    ingestion.finished_at = None
+    db.commit()
+
+
+def advance(db, book_id: int, pages: int, chunks: int):
+    # increments in sql, the ranges of one book finish on different workers at the same time
+    db.execute(
+        update(BookIngestion)
+        .where(BookIngestion.book_id == book_id)
+        .values(pages_done=BookIngestion.pages_done + pages, chunks=BookIngestion.chunks + chunks)
+    )
+    db.commit()
+
+
+def status_of(db, book_id: int):
+    return db.query(BookIngestion.status).filter(BookIngestion.book_id == book_id).scalar()
+
+
+def set_status(db, book_id: int, status: str, error: str | None = None):
+    values = {"status": status, "error": error}
+    if status in ("done", "failed"):
+        values["finished_at"] = _now()
+    db.execute(update(BookIngestion).where(BookIngestion.book_id == book_id).values(**values))
+    db.commit()
+
+
+def _aware(value: datetime | None):
+    # sqlite hands datetimes back without their timezone, they are always stored in utc
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def describe(ingestion: BookIngestion):
+    started_at = _aware(ingestion.started_at)
+    finished_at = _aware(ingestion.finished_at)
+    progress = ingestion.pages_done / ingestion.pages_total if ingestion.pages_total else 0.0
+
+    eta_seconds = None
+    if ingestion.status == "embedding" and ingestion.pages_done and started_at is not None:
+        elapsed = (_now() - started_at).total_seconds()
+        pages_per_second = ingestion.pages_done / elapsed if elapsed > 0 else 0
+        if pages_per_second:
+            eta_seconds = round((ingestion.pages_total - ingestion.pages_done) / pages_per_second, 1)
+
+    return {
+        "book_id": ingestion.book_id,
+        "slug": ingestion.slug,
+        "status": ingestion.status,
+        "lane": ingestion.lane,
+        "pages_total": ingestion.pages_total,
+        "pages_done": ingestion.pages_done,
+        "chunks": ingestion.chunks,
+        "progress": round(progress, 4),
+        "eta_seconds": eta_seconds,
+        "error": ingestion.error,
+        "started_at": started_at,
+        "finished_at": finished_at,
+    }
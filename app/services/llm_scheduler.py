@@ -0,0 +1,206 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import aclosing, asynccontextmanager
+
+from . import metrics
+
+
+class SchedulerBusy(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("model is busy")
+        self.retry_after = retry_after
+
+
+class FairScheduler:
+    """Caps how many model calls run at once and queues the rest per user.
+
+    Free slots go round-robin over the users that are waiting, so one user firing
+    many questions can't starve everybody else. Callers that can't be queued, or
+    wait longer than ``max_wait``, get ``SchedulerBusy``.
+    """
+
+    def __init__(self, name: str, capacity: int, max_wait: float = 30, max_queue: int = 64,
+                 max_queue_per_user: int = 4, retry_after: int = 5):
+        self.name = name
+        self.capacity = capacity
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.retry_after = retry_after
+        # only touched from the event loop thread, so no lock
+        self._active = 0
+        self._waiting = 0
+        # user -> waiters, in the order users get their next slot
+        self._queues = OrderedDict()
+        self.rejected = 0
+        self.timed_out = 0
+
+    async def acquire(self, user=None):
+        if self._active < self.capacity and not self._waiting:
+            self._active += 1
+            metrics.LLM_ADMISSIONS.inc(pool=self.name, outcome="admitted")
+            return
+
+        queue = self._queues.get(user)
+        if self._waiting >= self.max_queue or (queue is not None and len(queue) >= self.max_queue_per_user):
+            self.rejected += 1
+            metrics.LLM_ADMISSIONS.inc(pool=self.name, outcome="rejected")
+            raise SchedulerBusy(self.retry_after)
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user, deque()).append(future)
+        self._waiting += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if future.done() and not future.cancelled():
+                # the slot was handed over just as we gave up on it
+                self.release()
+            else:
+                self._remove(user, future)
+            if isinstance(exc, asyncio.TimeoutError):
+                self.timed_out += 1
+                metrics.LLM_ADMISSIONS.inc(pool=self.name, outcome="timed_out")
+                raise SchedulerBusy(self.retry_after) from None
+            raise
+        metrics.LLM_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - started, pool=self.name)
+        metrics.LLM_ADMISSIONS.inc(pool=self.name, outcome="queued")
+
+    def release(self):
+        while self._queues:
+            user, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            self._waiting -= 1
+            if queue:
+                self._queues.move_to_end(user)
+            else:
+                del self._queues[user]
+            if not future.done():
+                # the slot passes straight to the waiter, so the active count stays the same
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    def _remove(self, user, future):
+        queue = self._queues.get(user)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        self._waiting -= 1
+        if not queue:
+            del self._queues[user]
+
+    @asynccontextmanager
+    async def slot(self, user=None):
+        await self.acquire(user)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        return {"active": self._active, "capacity": self.capacity, "waiting": self._waiting,
+                "waiting_users": len(self._queues), "rejected": self.rejected, "timed_out": self.timed_out}
+
+
+class SharedGeneration:
+    """One model answer streamed to every request that asked the same question.
+
+    Chunks are kept so a request joining late first catches up on what was already said.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.abandoned = False
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def publish(self, chunk: str):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error: BaseException | None = None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self):
+        # waiters hold on to the old event, the next change gets a fresh one
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self):
+        self.subscribers += 1
+        try:
+            position = 0
+            while True:
+                if position < len(self.chunks):
+                    position += 1
+                    yield self.chunks[position - 1]
+                elif self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                else:
+                    await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            # nobody is listening any more, stop spending the model on it
+            if self.subscribers == 0 and not self.done and self.task is not None:
+                self.abandoned = True
+                self.task.cancel()
+
+
+class GenerationCancelled(Exception):
+    pass
+
+
+class InFlightGenerations:
+    """Generations currently running, by key, so identical requests share one."""
+
+    def __init__(self):
+        self._generations = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def get(self, key):
+        generation = self._generations.get(key)
+        if generation is None or generation.abandoned:
+            return None
+        self.coalesced += 1
+        return generation
+
+    def start(self, key, chunks, on_done=None):
+        generation = SharedGeneration()
+        self._generations[key] = generation
+        self.started += 1
+        generation.task = asyncio.create_task(self._run(generation, chunks))
+        # a done callback also runs for a task cancelled before it ever started
+        generation.task.add_done_callback(lambda task: self._finished(key, generation, on_done))
+        return generation
+
+    async def _run(self, generation, chunks):
+        async with aclosing(chunks):
+            try:
+                async for chunk in chunks:
+                    generation.publish(chunk)
+            except Exception as exc:
+                generation.finish(exc)
+            else:
+                generation.finish()
+
+    def _finished(self, key, generation, on_done):
+        if not generation.done:
+            generation.finish(GenerationCancelled())
+        if self._generations.get(key) is generation:
+            del self._generations[key]
+        if on_done is not None:
+            on_done()
+
+    def stats(self):
+        return {"in_flight": len(self._generations), "started": self.started, "coalesced": self.coalesced}
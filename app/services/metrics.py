@@ -0,0 +1,232 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+
+
+# prometheus' default buckets stretched out to cover llm generations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+CHARS_BUCKETS = (500, 1000, 2000, 4000, 8000, 12000, 16000, 24000, 32000, 64000)
+
+# timings and database time of the request being served, read by the middleware for Server-Timing
+request_state = ContextVar("request_state", default=None)
+
+
+def _format_labels(labels: dict):
+    if not labels:
+        return ""
+    parts = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield f"{self.name}_total{_format_labels(dict(zip(self.labelnames, key)))} {value}"
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        # counts are kept per bucket and only made cumulative when rendered
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            series = {key: ([*counts], total, count) for key, (counts, total, count) in self._series.items()}
+        for key, (counts, total, count) in series.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels({**labels, 'le': bound})} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {total}"
+            yield f"{self.name}_count{_format_labels(labels)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "Time spent serving a request, streaming bodies included.",
+    ["method", "route", "status"])
+REQUEST_DB_SECONDS = registry.histogram(
+    "http_request_db_seconds", "Time a request spent in database queries.", ["route"])
+REQUEST_DB_QUERIES = registry.counter(
+    "http_request_db_queries", "Database queries issued while serving requests.", ["route"])
+
+RAG_STAGE_SECONDS = registry.histogram(
+    "rag_stage_seconds", "Time spent in each stage of answering a book question.", ["stage"])
+RAG_TIME_TO_FIRST_TOKEN = registry.histogram(
+    "rag_time_to_first_token_seconds", "Time from receiving a book question to its first answer token.")
+RAG_RETRIEVED_DOCS = registry.histogram(
+    "rag_retrieved_docs", "Chunks retrieved for a book question that passed the relevance cut.",
+    buckets=SIZE_BUCKETS)
+RAG_CONTEXT_PASSAGES = registry.histogram(
+    "rag_context_passages", "Passages packed into the prompt after merging and deduplication.",
+    buckets=SIZE_BUCKETS)
+RAG_PROMPT_CHARS = registry.histogram(
+    "rag_prompt_chars", "Size of the prompt sent to the chat model.", buckets=CHARS_BUCKETS)
+RAG_ANSWERS = registry.counter(
+    "rag_answers", "Book questions answered, by whether the answer came from the answer cache.", ["source"])
+
+LLM_ADMISSIONS = registry.counter(
+    "llm_admissions", "Model calls by scheduler pool and whether they ran, queued, or were turned away.",
+    ["pool", "outcome"])
+LLM_QUEUE_WAIT_SECONDS = registry.histogram(
+    "llm_queue_wait_seconds", "Time model calls waited for a free slot.", ["pool"])
+
+INGEST_BATCH_SECONDS = registry.histogram(
+    "ingest_batch_seconds", "Time to embed and store one ingestion batch.")
+INGEST_BATCH_CHUNKS = registry.histogram(
+    "ingest_batch_chunks", "Chunks per ingestion batch.", buckets=SIZE_BUCKETS)
+INGEST_PAGES = registry.counter("ingest_pages", "Book pages ingested.")
+
+
+def record_timing(name: str, seconds: float):
+    # becomes part of the Server-Timing header if the response hasn't started yet
+    state = request_state.get()
+    if state is not None:
+        state["timings"].append((name, seconds))
+
+
+@contextmanager
+def timed(histogram: Histogram, server_timing: str | None = None, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram.observe(elapsed, **labels)
+        if server_timing is not None:
+            record_timing(server_timing, elapsed)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # kept on the statement's own context, a statement that fails leaves nothing behind on the
+    # pooled connection for the next one to pick up
+    if context is not None:
+        context.query_started = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "query_started", None)
+    state = request_state.get()
+    if state is not None and started is not None:
+        state["db_seconds"] += time.perf_counter() - started
+        state["db_queries"] += 1
+
+
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+def server_timing_header(state: dict, total: float):
+    entries = [f"db;dur={state['db_seconds'] * 1000:.2f};desc=\"{state['db_queries']} queries\""]
+    entries.extend(f"{name};dur={seconds * 1000:.2f}" for name, seconds in state["timings"])
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    """Times every request, its database work, and adds a Server-Timing header.
+
+    Plain ASGI so streamed chat responses pass through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        state = {"db_seconds": 0.0, "db_queries": 0, "timings": []}
+        token = request_state.set(state)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", server_timing_header(state, time.perf_counter() - started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_state.reset(token)
+            # the matched route template keeps the label set small, unmatched paths share one label
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            REQUEST_SECONDS.observe(time.perf_counter() - started, method=scope["method"], route=path,
+                                    status=status)
+            REQUEST_DB_SECONDS.observe(state["db_seconds"], route=path)
+            REQUEST_DB_QUERIES.inc(state["db_queries"], route=path)
@@ -0,0 +1,185 @@
+import mmap
+import os
+import re
+import struct
+import threading
+import uuid
+from bisect import bisect_right
+from collections import OrderedDict
+
+
+# magic, page count, source path length, index offset, source size, source mtime_ns
+HEADER = struct.Struct("<8sIIQQQ")
+MAGIC = b"SBPAGES1"
+OFFSET = struct.Struct("<Q")
+
+EXTENSION = ".pages"
+
+# characters of page text shown on each side of a match
+SNIPPET_CONTEXT = 80
+
+
+class PageStoreError(Exception):
+    pass
+
+
+def write_page_store(path: str, source: str, stamp, pages):
+    """Write the text of ``pages`` (an iterable of str, in page order) as one page store file.
+
+    The layout is a fixed header, the source path, the UTF-8 text of every page back to back
+    and then one offset per page boundary, so any page is two index reads and a slice away.
+    Pages are written as they come, only the offsets are held in memory.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    source_bytes = source.encode()
+    # a fresh name every time, two writers of the same book never share a temporary file
+    temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temporary, "wb") as f:
+            f.write(b"\0" * HEADER.size)
+            f.write(source_bytes)
+            offsets = [f.tell()]
+            for text in pages:
+                f.write(text.encode())
+                offsets.append(f.tell())
+            index_offset = f.tell()
+            for offset in offsets:
+                f.write(OFFSET.pack(offset))
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, len(offsets) - 1, len(source_bytes), index_offset, stamp[0], stamp[1]))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
+    return len(offsets) - 1
+
+
+class PageStore:
+    """Read only view of a page store file, memory-mapped so pages are read without copies
+    of the whole book and the OS page cache is shared by every process reading it."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._stat = os.fstat(f.fileno())
+            if self._stat.st_size < HEADER.size:
+                raise PageStoreError(f"{path} is not a page store")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.page_count, source_length, self._index_offset, size, mtime_ns = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise PageStoreError(f"{path} is not a page store")
+        self.source = self._map[HEADER.size:HEADER.size + source_length].decode()
+        self.stamp = [size, mtime_ns]
+
+    @property
+    def file_stamp(self):
+        return self._stat.st_ino, self._stat.st_mtime_ns
+
+    def _offset(self, page_number: int):
+        return OFFSET.unpack_from(self._map, self._index_offset + page_number * OFFSET.size)[0]
+
+    def page(self, page_number: int) -> str:
+        if not 0 <= page_number < self.page_count:
+            raise IndexError(page_number)
+        return self._map[self._offset(page_number):self._offset(page_number + 1)].decode()
+
+    def pages(self, start: int = 0, end: int | None = None):
+        end = self.page_count if end is None else min(end, self.page_count)
+        for page_number in range(max(start, 0), end):
+            yield page_number, self.page(page_number)
+
+    def find(self, query: str, limit: int = 20):
+        """Pages containing ``query`` (case insensitive), with a snippet around each first match."""
+        words = query.split()
+        if not words:
+            return []
+        pattern = re.compile(rb"\s+".join(re.escape(word.encode()) for word in words), re.IGNORECASE)
+        text_start = self._offset(0)
+        boundaries = [self._offset(page_number) for page_number in range(self.page_count + 1)]
+
+        hits = []
+        # the regex runs over the mapping itself, nothing is decoded until a page matches
+        position = text_start
+        end = boundaries[-1]
+        while len(hits) < limit:
+            match = pattern.search(self._map, position, end)
+            if match is None:
+                break
+            page_number = bisect_right(boundaries, match.start()) - 1
+            page_start, page_end = boundaries[page_number], boundaries[page_number + 1]
+            if match.end() > page_end:
+                # the match runs over a page boundary, look again from just after its start
+                position = match.start() + 1
+                continue
+            before = self._map[max(page_start, match.start() - SNIPPET_CONTEXT):match.start()]
+            after = self._map[match.end():min(page_end, match.end() + SNIPPET_CONTEXT)]
+            snippet = (before.decode(errors="ignore") + "[" + match.group().decode(errors="ignore") + "]"
+                       + after.decode(errors="ignore"))
+            hits.append({"page": page_number, "snippet": " ".join(snippet.split())})
+            # one hit per page, the next search starts on the following page
+            position = page_end
+        return hits
+
+
+class PageStoreRegistry:
+    """Process wide LRU of mapped page stores keyed by book slug.
+
+    A store rewritten by another process (a worker re-extracting the book) has a new
+    inode, it is noticed on the next ``get`` and mapped again.
+    """
+
+    def __init__(self, directory: str, max_stores: int = 256):
+        self.directory = directory
+        self.max_stores = max_stores
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path_for(self, slug: str) -> str:
+        return os.path.join(self.directory, slug + EXTENSION)
+
+    def get(self, slug: str):
+        """The store of ``slug``, or None when the book has not been extracted yet."""
+        path = self.path_for(slug)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.invalidate(slug)
+            return None
+        with self._lock:
+            store = self._entries.get(slug)
+            if store is not None and store.file_stamp == (stat.st_ino, stat.st_mtime_ns):
+                self._entries.move_to_end(slug)
+                return store
+        try:
+            store = PageStore(path)
+        except (OSError, PageStoreError):
+            return None
+        with self._lock:
+            self._entries[slug] = store
+            self._entries.move_to_end(slug)
+            # evicted maps aren't closed, a search may still run over them, they go with their last reference
+            while len(self._entries) > self.max_stores:
+                self._entries.popitem(last=False)
+        return store
+
+    def invalidate(self, slug: str):
+        with self._lock:
+            self._entries.pop(slug, None)
+
+    def delete(self, slug: str):
+        self.invalidate(slug)
+        path = self.path_for(slug)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return 0
+        return size
+
+    def stats(self):
+        with self._lock:
+            return {"open": len(self._entries), "max_stores": self.max_stores}
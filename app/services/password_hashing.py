@@ -0,0 +1,45 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """Runs bcrypt on a small dedicated pool and refuses work once the backlog is full.
+
+    bcrypt releases the GIL so the pool gives real parallelism, and the bounded
+    backlog turns a login storm into fast 503s instead of a stalled worker.
+    """
+
+    def __init__(self, context, workers: int = 4, max_queue: int = 64):
+        self._context = context
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        # only touched from the event loop thread, so no lock
+        self._pending = 0
+        self.rejected = 0
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(self._context.hash, password)
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return await self._submit(self._context.verify, password, password_hash)
+
+    async def _submit(self, func, *args):
+        if self._pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise PasswordHasherBusy()
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args))
+        finally:
+            self._pending -= 1
+
+    def stats(self):
+        return {"pending": self._pending, "workers": self.workers, "max_queue": self.max_queue,
+                "rejected": self.rejected}
@@ -0,0 +1,170 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from starlette.responses import Response
+
+
+logger = logging.getLogger(__name__)
+
+# clients always revalidate, a matching ETag makes that a bodiless 304
+CACHE_CONTROL = "public, no-cache"
+
+# while redis is unreachable it is retried this often, requests go uncached in between
+SHARED_RETRY_INTERVAL = 5
+
+
+class CachedResponse:
+    def __init__(self, status_code: int, body: bytes, headers: dict | None = None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = dict(headers or {})
+        # strong, from the bytes themselves, so a version bump that didn't change a response
+        # still lets clients keep their copy
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+    def to_response(self, request_headers):
+        headers = {**self.headers, "ETag": self.etag, "Cache-Control": CACHE_CONTROL}
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None and self.status_code == 200:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            if "*" in tags or self.etag in tags:
+                return Response(status_code=304, headers=headers)
+        return Response(self.body, status_code=self.status_code, headers=headers, media_type="application/json")
+
+
+class ResponseCache:
+    """Responses keyed by a version that every write to the underlying data bumps.
+
+    Nothing is ever invalidated one by one: a bump makes every key of the old version
+    unreachable. With ``shared_url`` the version lives in redis, so all api processes (and
+    the import CLI) agree on it, and responses are kept there too for the other processes.
+    The version is then re-read at most every ``version_ttl`` seconds, which is how stale
+    another process may be after a write.
+    """
+
+    def __init__(self, name: str, max_entries: int = 4096, shared_url: str | None = None,
+                 version_ttl: float = 1.0, shared_ttl: int = 3600):
+        self.name = name
+        self.max_entries = max_entries
+        self.version_ttl = version_ttl
+        self.shared_ttl = shared_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = 0
+        self._version_read_at = None
+        self._shared_failed_at = None
+        self._redis = None
+        if shared_url:
+            import redis.asyncio
+
+            self._redis = redis.asyncio.Redis.from_url(shared_url)
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @property
+    def _version_key(self):
+        return f"response-cache:{self.name}:version"
+
+    async def version(self):
+        """The current version, or None when it can't be known and nothing should be cached."""
+        if self._redis is None:
+            return self._version
+        now = time.monotonic()
+        if self._version_read_at is None or now - self._version_read_at >= self.version_ttl:
+            if self._shared_failed_at is not None and now - self._shared_failed_at < SHARED_RETRY_INTERVAL:
+                return None
+            try:
+                self._version = int(await self._redis.get(self._version_key) or 0)
+            except Exception as exc:
+                logger.warning("can't read the %s cache version, serving uncached: %s", self.name, exc)
+                self._shared_failed_at = now
+                return None
+            self._shared_failed_at = None
+            self._version_read_at = now
+        return self._version
+
+    async def bump(self):
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+        if self._redis is not None:
+            try:
+                self._version = await self._redis.incr(self._version_key)
+                self._version_read_at = time.monotonic()
+            except Exception as exc:
+                # the other processes keep serving the old version until redis is back, this one
+                # serves uncached so it never stores responses under a version it made up
+                logger.warning("can't bump the shared %s cache version: %s", self.name, exc)
+                self._version_read_at = None
+                self._shared_failed_at = time.monotonic()
+
+    async def get(self, version: int, key: str):
+        with self._lock:
+            entry = self._entries.get((version, key))
+            if entry is not None:
+                self._entries.move_to_end((version, key))
+                self.hits += 1
+                return entry
+        if self._redis is not None:
+            try:
+                shared = await self._redis.hgetall(self._shared_key(version, key))
+            except Exception:
+                shared = None
+            if shared:
+                entry = CachedResponse(int(shared[b"status_code"]), shared[b"body"],
+                                       _decode_headers(shared.get(b"headers", b"")))
+                self._remember(version, key, entry)
+                self.shared_hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    async def put(self, version: int, key: str, entry: CachedResponse):
+        self._remember(version, key, entry)
+        if self._redis is not None:
+            shared_key = self._shared_key(version, key)
+            try:
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    pipe.hset(shared_key, mapping={"status_code": entry.status_code, "body": entry.body,
+                                                   "headers": _encode_headers(entry.headers)})
+                    pipe.expire(shared_key, self.shared_ttl)
+                    await pipe.execute()
+            except Exception:
+                pass
+        return entry
+
+    def _remember(self, version: int, key: str, entry: CachedResponse):
+        with self._lock:
+            # a process that was told of a newer version drops what it kept for the older ones
+            if version != self._version:
+                return
+            self._entries[(version, key)] = entry
+            self._entries.move_to_end((version, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _shared_key(self, version: int, key: str):
+        return f"response-cache:{self.name}:{version}:{key}"
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "version": self._version,
+                    "shared": self._redis is not None, "hits": self.hits, "shared_hits": self.shared_hits,
+                    "misses": self.misses}
+
+
+def _encode_headers(headers: dict):
+    return "\n".join(f"{name}:{value}" for name, value in headers.items())
+
+
+def _decode_headers(raw: bytes):
+    return dict(line.split(":", 1) for line in raw.decode().splitlines() if line)
+
+
+# CATALOG_CACHE_REDIS_URL shares the catalog cache between api processes, e.g. redis://localhost:6379/1
+catalog_cache = ResponseCache("catalog", shared_url=os.getenv("CATALOG_CACHE_REDIS_URL"))
@@ -0,0 +1,160 @@
+import difflib
+import re
+
+from sqlalchemy import text, select, or_
+
+from ..models import Book
+
+
+# column weights for bm25 in the order the index declares them: title, author, description
+TITLE_WEIGHT = 10.0
+AUTHOR_WEIGHT = 5.0
+DESCRIPTION_WEIGHT = 1.0
+
+# how much a 5 star rating boosts the text relevance of a hit (0 disables the blend)
+RATING_WEIGHT = 0.5
+
+MAX_QUERY_TERMS = 8
+
+# terms shorter than this are never spell corrected, there are too many close matches
+MIN_CORRECTION_LENGTH = 4
+CORRECTION_CUTOFF = 0.75
+
+# the index is an external content table over books, the triggers keep it in sync with every
+# insert/update/delete on books so the admin routes (and bulk loads) never have to touch it
+SEARCH_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE books_fts USING fts5(
+        title, author, description,
+        content='books', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts_vocab USING fts5vocab(books_fts, 'row')",
+    """
+    CREATE TRIGGER IF NOT EXISTS books_fts_after_insert AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts(rowid, title, author, description)
+        VALUES (new.id, new.title, new.author, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_fts_after_delete AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, description)
+        VALUES ('delete', old.id, old.title, old.author, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_fts_after_update AFTER UPDATE OF title, author, description ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, description)
+        VALUES ('delete', old.id, old.title, old.author, old.description);
+        INSERT INTO books_fts(rowid, title, author, description)
+        VALUES (new.id, new.title, new.author, new.description);
+    END
+    """,
+]
+
+SEARCH_QUERY = f"""
+    SELECT books.id, books.title, books.author, books.rating, books.slug,
+           snippet(books_fts, 2, '[', ']', '...', 12) AS snippet
+    FROM books_fts
+    JOIN books ON books.id = books_fts.rowid
+    WHERE books_fts MATCH :match
+    ORDER BY bm25(books_fts, {TITLE_WEIGHT}, {AUTHOR_WEIGHT}, {DESCRIPTION_WEIGHT})
+             * (1.0 + {RATING_WEIGHT} * books.rating / 5.0)
+    LIMIT :limit OFFSET :offset
+"""
+
+
+def create_search_index(engine):
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as connection:
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'")
+        ).first()
+        for statement in SEARCH_INDEX_DDL[0 if exists is None else 1:]:
+            connection.execute(text(statement))
+        if exists is None:
+            # index books that were added before the index existed
+            connection.execute(text("INSERT INTO books_fts(books_fts) VALUES ('rebuild')"))
+
+
+def tokenize(query: str):
+    return re.findall(r"\w+", query.lower())[:MAX_QUERY_TERMS]
+
+
+def match_expression(terms):
+    # every term is a prefix so "time mach" finds "The Time Machine" while the user is typing
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+async def _correct_terms(db, terms):
+    corrected = []
+    changed = False
+    for term in terms:
+        if len(term) < MIN_CORRECTION_LENGTH:
+            corrected.append(term)
+            continue
+        # only look at vocabulary sharing the first letter, typos there are rare and it keeps the scan small
+        result = await db.execute(
+            text("SELECT term FROM books_fts_vocab WHERE term >= :low AND term < :high"),
+            {"low": term[0], "high": chr(ord(term[0]) + 1)},
+        )
+        candidates = [row.term for row in result if abs(len(row.term) - len(term)) <= 2]
+        if term in candidates:
+            corrected.append(term)
+            continue
+        matches = difflib.get_close_matches(term, candidates, n=1, cutoff=CORRECTION_CUTOFF)
+        if matches:
+            corrected.append(matches[0])
+            changed = True
+        else:
+            corrected.append(term)
+    return corrected if changed else None
+
+
+async def _search_fts(db, terms, limit, offset):
+    result = await db.execute(
+        text(SEARCH_QUERY),
+        {"match": match_expression(terms), "limit": limit, "offset": offset},
+    )
+    return [dict(row._mapping) for row in result]
+
+
+async def _search_fallback(db, terms, limit, offset):
+    # server databases without fts5, still ranked by rating and paginated
+    conditions = []
+    for term in terms:
+        pattern = f"%{term}%"
+        conditions.append(or_(Book.title.ilike(pattern), Book.author.ilike(pattern),
+                              Book.description.ilike(pattern)))
+    query = (
+        select(Book.id, Book.title, Book.author, Book.rating, Book.slug)
+        .where(*conditions)
+        .order_by(Book.rating.desc(), Book.id)
+        .limit(limit)
+        .offset(offset)
+    )
+    result = await db.execute(query)
+    return [dict(row._mapping, snippet=None) for row in result]
+
+
+async def search_books(db, query: str, limit: int, offset: int = 0):
+    terms = tokenize(query)
+    if not terms:
+        return {"results": [], "corrected_query": None}
+
+    if db.bind.dialect.name != "sqlite":
+        return {"results": await _search_fallback(db, terms, limit, offset), "corrected_query": None}
+
+    results = await _search_fts(db, terms, limit, offset)
+    corrected_query = None
+    if not results and offset == 0:
+        corrected = await _correct_terms(db, terms)
+        if corrected is not None:
+            results = await _search_fts(db, corrected, limit, offset)
+            # only suggested when it finds something, "did you mean" a dead end helps nobody
+            if results:
+                corrected_query = " ".join(corrected)
+    return {"results": results, "corrected_query": corrected_query}
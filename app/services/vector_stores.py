@@ -0,0 +1,214 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _store_stamp(path: str):
+    # chroma keeps its metadata in chroma.sqlite3, any rewrite of the store touches it
+    try:
+        stat = os.stat(os.path.join(path, "chroma.sqlite3"))
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class VectorStoreRegistry:
+    """Process wide LRU of opened vector stores keyed by book slug.
+
+    Entries are evicted when either the number of open stores exceeds
+    ``max_stores`` or the on-disk size of the open stores exceeds ``max_bytes``.
+
+    A store that is evicted, invalidated or found rebuilt is closed with ``close_store``.
+    Chroma keeps one system per directory for the life of the process, so the directory is
+    only opened again once the old store is closed, otherwise it would be handed back the
+    same stale system. Stores taken with ``lease`` are closed when the last lease ends.
+    """
+
+    def __init__(self, open_store, directory: str, max_stores: int = 16, max_bytes: int | None = None,
+                 close_store=None):
+        self._open_store = open_store
+        self._close_store = close_store
+        self._directory = directory
+        self.max_stores = max_stores
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # notified whenever a retired store is closed
+        self._closed = threading.Condition(self._lock)
+        # dropped entries not closed yet by slug, leased ones are closed by their last lease
+        self._retired = {}
+        self._slug_locks = {}
+        self._listeners = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def path_for(self, slug: str) -> str:
+        return os.path.join(self._directory, slug)
+
+    def add_invalidation_listener(self, listener):
+        self._listeners.append(listener)
+
+    def get(self, slug: str):
+        return self._acquire(slug, lease=False)["store"]
+
+    @contextmanager
+    def lease(self, slug: str):
+        """The store of ``slug``, kept open until the block is left even if it is dropped meanwhile."""
+        entry = self._acquire(slug, lease=True)
+        try:
+            yield entry["store"]
+        finally:
+            with self._lock:
+                entry["leases"] -= 1
+                close = entry["retired"] and entry["leases"] == 0
+            if close:
+                self._close(slug, entry)
+
+    def _acquire(self, slug: str, lease: bool):
+        path = self.path_for(slug)
+        closing = []
+        with self._lock:
+            entry = self._entries.get(slug)
+            if entry is not None:
+                if entry["stamp"] == _store_stamp(path):
+                    self._entries.move_to_end(slug)
+                    self.hits += 1
+                    entry["leases"] += lease
+                    return entry
+                # the store was rebuilt by another process (e.g. a celery worker)
+                closing += self._drop(slug)
+                stale = True
+            else:
+                stale = False
+            self.misses += 1
+            slug_lock = self._slug_locks.setdefault(slug, threading.Lock())
+        self._close_all(closing)
+
+        if stale:
+            self._notify(slug)
+
+        # open outside the registry lock so one slow open doesn't block other books
+        with slug_lock:
+            with self._lock:
+                entry = self._entries.get(slug)
+                if entry is not None:
+                    self._entries.move_to_end(slug)
+                    entry["leases"] += lease
+                    return entry
+                # a store of this directory still being read is closed first, see the class docstring
+                while slug in self._retired:
+                    self._closed.wait()
+
+            store = self._open_store(slug, path)
+            entry = {"store": store, "stamp": _store_stamp(path), "bytes": directory_size(path),
+                     "leases": int(lease), "retired": False}
+
+            with self._lock:
+                self._entries[slug] = entry
+                self._entries.move_to_end(slug)
+                closing = self._evict()
+                self._slug_locks.pop(slug, None)
+            self._close_all(closing)
+        return entry
+
+    def warm_up(self, slugs):
+        warmed = []
+        for slug in slugs:
+            if os.path.isdir(self.path_for(slug)):
+                self.get(slug)
+                warmed.append(slug)
+        return warmed
+
+    def invalidate(self, slug: str):
+        with self._lock:
+            closing = self._drop(slug)
+            self.invalidations += 1
+        self._close_all(closing)
+        self._notify(slug)
+
+    def clear(self):
+        with self._lock:
+            slugs = list(self._entries)
+            closing = []
+            for slug in slugs:
+                closing += self._drop(slug)
+        self._close_all(closing)
+        for slug in slugs:
+            self._notify(slug)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "open_stores": len(self._entries),
+                "retired_stores": len(self._retired),
+                "max_stores": self.max_stores,
+                "bytes": sum(entry["bytes"] for entry in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "slugs": list(self._entries),
+            }
+
+    def _drop(self, slug: str):
+        # called with the lock held, returns what the caller closes once it has let go of it
+        entry = self._entries.pop(slug, None)
+        if entry is None:
+            return []
+        # retired until it is closed, so nothing opens the directory again in between
+        entry["retired"] = True
+        self._retired[slug] = entry
+        return [] if entry["leases"] else [(slug, entry)]
+
+    def _evict(self):
+        # always keep the most recently used store even if it alone is over budget
+        closing = []
+        while len(self._entries) > 1 and (len(self._entries) > self.max_stores or self._over_bytes()):
+            closing += self._drop(next(iter(self._entries)))
+            self.evictions += 1
+        return closing
+
+    def _close_all(self, entries):
+        for slug, entry in entries:
+            self._close(slug, entry)
+
+    def _close(self, slug: str, entry: dict):
+        if self._close_store is not None:
+            try:
+                self._close_store(entry["store"])
+            except Exception as exc:
+                logger.warning("closing the vector store of %s failed: %s", slug, exc)
+        with self._lock:
+            if self._retired.get(slug) is entry:
+                del self._retired[slug]
+            self._closed.notify_all()
+
+    def _over_bytes(self):
+        if self.max_bytes is None:
+            return False
+        return sum(entry["bytes"] for entry in self._entries.values()) > self.max_bytes
+
+    def _notify(self, slug: str):
+        for listener in self._listeners:
+            listener(slug)
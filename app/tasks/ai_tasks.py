@@ -1,8 +1,111 @@
+import logging
+
+from celery import chord
+
 from .celery_app import celery_app
-from app.services.ai_service import add_book_to_vector_stores
+from app.database import SessionLocal
+from app.models import Book
+from app.services import ingestions
+from app.services.ai_service import (add_book_to_vector_stores, update_book_in_vector_stores,
+                                     collect_vector_store_garbage, count_pages, page_ranges, embed_page_range,
+                                     commit_page_ranges, source_stamp)
+
+logger = logging.getLogger(__name__)
+
+# an edit made while its book is still being ingested waits for the ingestion, for up to an hour
+UPDATE_RETRY_SECONDS = 30
+UPDATE_MAX_RETRIES = 120
 
 
 @celery_app.task
 def embed_book_task(url: str, slug: str):
     add_book_to_vector_stores(url, slug)
 
+
+@celery_app.task
+def ingest_book_task(book_id: int, url: str, slug: str):
+    # only reads the page count and plans the work: the page ranges are extracted and embedded
+    # in parallel on the book's lane, and the commit builds the vector store and the page
+    # store once all of them are done
+    with SessionLocal() as db:
+        try:
+            page_count = count_pages(url)
+            stamp = source_stamp(url)
+        except Exception as exc:
+            ingestions.set_status(db, book_id, "failed", str(exc))
+            raise
+        lane = ingestions.lane_for(page_count)
+        ingestions.start(db, book_id, slug, page_count, lane)
+
+    ranges = page_ranges(page_count)
+    commit = commit_book_ingestion_task.si(book_id, url, slug, ranges, stamp).set(queue=lane)
+    if ranges:
+        chord(embed_page_range_task.si(book_id, url, slug, start, end).set(queue=lane)
+              for start, end in ranges)(commit)
+    else:
+        commit.apply_async()
+    return {"pages": page_count, "ranges": len(ranges), "lane": lane}
+
+
+@celery_app.task
+def embed_page_range_task(book_id: int, url: str, slug: str, start: int, end: int):
+    try:
+        result = embed_page_range(url, slug, start, end)
+    except Exception as exc:
+        with SessionLocal() as db:
+            ingestions.set_status(db, book_id, "failed", f"pages {start}-{end}: {exc}")
+        raise
+    with SessionLocal() as db:
+        ingestions.advance(db, book_id, result["pages"], result["chunks"])
+    return result
+
+
+@celery_app.task
+def commit_book_ingestion_task(book_id: int, url: str, slug: str, ranges: list[list[int]], stamp=None):
+    with SessionLocal() as db:
+        ingestions.set_status(db, book_id, "committing")
+        try:
+            chunks = commit_page_ranges(url, slug, ranges, stamp)
+        except Exception as exc:
+            ingestions.set_status(db, book_id, "failed", str(exc))
+            raise
+        ingestions.set_status(db, book_id, "done")
+    return {"chunks": chunks}
+
+
+@celery_app.task(bind=True, max_retries=UPDATE_MAX_RETRIES)
+def update_book_embedding_task(self, book_id: int, url: str, slug: str):
+    with SessionLocal() as db:
+        status = ingestions.status_of(db, book_id)
+    if status in ingestions.ACTIVE_STATUSES:
+        # the ingestion still reads the old content, the update runs once its store is committed
+        raise self.retry(countdown=UPDATE_RETRY_SECONDS)
+    if status != "done":
+        # nothing was ever committed for this book, the new content is ingested from scratch
+        return ingest_book_task(book_id, url, slug)
+    report = update_book_in_vector_stores(url, slug)
+    logger.info("re-embedded %s: %s", slug, report)
+    return report
+
+
+@celery_app.task
+def ingest_books_task(books: list[dict]):
+    # one message for a group of imported books, a book that fails doesn't stop the rest of its group
+    failed = []
+    for book in books:
+        try:
+            ingest_book_task(book["id"], book["url"], book["slug"])
+        except Exception:
+            logger.exception("planning the ingestion of %s failed", book["slug"])
+            failed.append(book["slug"])
+    return {"planned": len(books) - len(failed), "failed": failed}
+
+
+@celery_app.task
+def collect_vector_store_garbage_task():
+    with SessionLocal() as db:
+        live_slugs = {slug for (slug,) in db.query(Book.slug).filter(Book.slug.isnot(None))}
+    report = collect_vector_store_garbage(live_slugs)
+    logger.info("vector store gc removed %d stores, reclaimed %d bytes",
+                len(report["removed"]), report["bytes_reclaimed"])
+    return report
@@ -1,6 +1,13 @@
+import logging
+
 from .celery_app import celery_app
+from app.services.ai_service import delete_page_store, delete_vector_store
+
+logger = logging.getLogger(__name__)
 
 
 @celery_app.task
-def delete_book_embedding(book_id: int):
-    pass
+def delete_book_embedding(slug: str):
+    reclaimed = delete_vector_store(slug) + delete_page_store(slug)
+    logger.info("deleted vector and page store of %s, reclaimed %d bytes", slug, reclaimed)
+    return {"slug": slug, "bytes_reclaimed": reclaimed}
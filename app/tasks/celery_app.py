@@ -8,6 +8,18 @@ celery_app = Celery(
 )
 
 celery_app.conf.task_routes = {
+    # planning an ingestion only reads the page count, it goes ahead of the embedding work
+    "app.tasks.ai_tasks.ingest_book_task": {"queue": "ai_priority"},
+    "app.tasks.ai_tasks.ingest_books_task": {"queue": "ai_priority"},
     "app.tasks.book_tasks.*": {"queue": "books"},
     "app.tasks.ai_tasks.*": {"queue": "ai"}
-}
\ No newline at end of file
+}
+# stores left behind by books deleted while no worker was running are swept up by celery beat
+VECTOR_STORE_GC_INTERVAL = 6 * 60 * 60
+
+celery_app.conf.beat_schedule = {
+    "collect-vector-store-garbage": {
+        "task": "app.tasks.ai_tasks.collect_vector_store_garbage_task",
+        "schedule": VECTOR_STORE_GC_INTERVAL,
+    },
+}
@@ -0,0 +1,81 @@
+import asyncio
+import hashlib
+import math
+import random
+import time
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessageChunk
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic embeddings with a configurable cost, stands in for OllamaEmbeddings.
+
+    The same text always maps to the same unit vector so retrieval, caching and
+    deduplication behave like they do with a real model.
+    """
+
+    def __init__(self, dimensions: int = 768, latency: float = 0.02, per_text_latency: float = 0.002):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.calls = 0
+        self.texts = 0
+
+    def _vector(self, text: str):
+        rng = random.Random(hashlib.sha256(text.encode()).digest())
+        vector = [rng.gauss(0, 1) for _ in range(self.dimensions)]
+        norm = math.sqrt(sum(value * value for value in vector))
+        return [value / norm for value in vector]
+
+    def _cost(self, count: int):
+        self.calls += 1
+        self.texts += count
+        return self.latency + self.per_text_latency * count
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(self._cost(len(texts)))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(self._cost(1))
+        return self._vector(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        await asyncio.sleep(self._cost(len(texts)))
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        await asyncio.sleep(self._cost(1))
+        return self._vector(text)
+
+
+class FakeChatModel:
+    """Streams a canned answer with chat model like timing, stands in for ChatOllama.
+
+    Time to first token grows with the prompt size (prefill) and tokens then
+    arrive at ``tokens_per_second``.
+    """
+
+    WORDS = ("the", "traveller", "time", "machine", "future", "eloi", "morlocks", "said", "and", "of")
+
+    def __init__(self, first_token_latency: float = 0.2, prefill_per_1k_chars: float = 0.01,
+                 tokens_per_second: float = 50, answer_tokens: int = 80):
+        self.first_token_latency = first_token_latency
+        self.prefill_per_1k_chars = prefill_per_1k_chars
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.generations = 0
+        self.prompt_chars = 0
+
+    async def astream(self, prompt):
+        text = prompt.to_string() if hasattr(prompt, "to_string") else str(prompt)
+        self.generations += 1
+        self.prompt_chars += len(text)
+        rng = random.Random(hashlib.sha256(text.encode()).digest())
+
+        await asyncio.sleep(self.first_token_latency + self.prefill_per_1k_chars * len(text) / 1000)
+        for i in range(self.answer_tokens):
+            if i:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            yield AIMessageChunk(content=rng.choice(self.WORDS) + " ")
@@ -0,0 +1,106 @@
+import os
+import random
+
+from slugify import slugify
+
+
+ADJECTIVES = ("Silent", "Hidden", "Last", "Broken", "Golden", "Distant", "Forgotten", "Crimson", "Endless", "Quiet")
+NOUNS = ("Machine", "River", "Empire", "Garden", "Voyage", "Kingdom", "Harbor", "Letter", "Island", "Winter")
+FIRST_NAMES = ("Ada", "Herbert", "Mary", "Jules", "Virginia", "Arthur", "Emily", "Leo", "Agatha", "Franz")
+LAST_NAMES = ("Wells", "Shelley", "Verne", "Woolf", "Doyle", "Bronte", "Tolstoy", "Christie", "Kafka", "Austen")
+WORDS = (
+    "time", "traveller", "machine", "future", "people", "light", "night", "river", "city", "garden",
+    "strange", "ancient", "world", "fear", "hope", "journey", "darkness", "morning", "stone", "voice",
+    "memory", "water", "house", "letter", "winter", "summer", "king", "island", "sea", "road",
+)
+
+QUESTIONS = (
+    "Summarize chapter {n}.",
+    "Who is the main character?",
+    "What happens at the end of the book?",
+    "Describe the setting of chapter {n}.",
+    "What does the {word} symbolize?",
+    "Why does the traveller return to the {word}?",
+    "How does the author describe the {word}?",
+)
+
+
+def sentence(rng: random.Random, length: int):
+    words = [rng.choice(WORDS) for _ in range(length)]
+    return " ".join(words).capitalize() + "."
+
+
+def generate_catalog(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    books = []
+    for book_id in range(1, count + 1):
+        title = f"The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {book_id}"
+        books.append({
+            "id": book_id,
+            "title": title,
+            "author": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "rating": round(rng.uniform(1, 4.9), 1),
+            "description": " ".join(sentence(rng, rng.randint(8, 20)) for _ in range(rng.randint(3, 12))),
+            "content_url": "",
+            "slug": f"{slugify(title)}-{book_id}",
+        })
+    return books
+
+
+def generate_questions(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    return [
+        rng.choice(QUESTIONS).format(n=rng.randint(1, 12), word=rng.choice(WORDS))
+        for _ in range(count)
+    ]
+
+
+def _escape(text: str):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: list[list[str]]):
+    """Write a minimal text-only PDF, one list of lines per page."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # the page tree is filled in once the page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_numbers = []
+    for lines in pages:
+        stream = ["BT", "/F1 10 Tf", "12 TL", "50 800 Td"]
+        for line in lines:
+            stream.append(f"({_escape(line)}) Tj T*")
+        stream.append("ET")
+        content = "\n".join(stream).encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        content_number = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_number
+        )
+        page_numbers.append(len(objects))
+    kids = " ".join(f"{number} 0 R" for number in page_numbers).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_numbers)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def generate_book_pdf(path: str, page_count: int, lines_per_page: int = 60, seed: int = 0):
+    rng = random.Random(seed)
+    pages = [[sentence(rng, rng.randint(8, 14)) for _ in range(lines_per_page)] for _ in range(page_count)]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_pdf(path, pages)
+    return path
@@ -0,0 +1,380 @@
+"""Offline load test for the whole API.
+
+Runs the app in-process behind uvicorn on a scratch database and data directory,
+with deterministic stand-ins for the Ollama chat and embedding models, and
+drives every router concurrently.
+
+    python -m benchmarks.run --duration 30
+    python -m benchmarks.run compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, errors, duration):
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / duration, 2),
+        "p50_ms": _ms(percentile(latencies, 0.50)),
+        "p95_ms": _ms(percentile(latencies, 0.95)),
+        "p99_ms": _ms(percentile(latencies, 0.99)),
+        "mean_ms": _ms(sum(latencies) / len(latencies)) if latencies else None,
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class Scenario:
+    def __init__(self, name, workers, action):
+        self.name = name
+        self.workers = workers
+        self.action = action
+        self.latencies = []
+        self.ttfts = []
+        self.errors = 0
+
+    async def run(self, client, context, deadline):
+        async def worker(worker_id):
+            rng = random.Random(f"{self.name}-{worker_id}")
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    ttft = await self.action(client, context, rng)
+                except Exception:
+                    self.errors += 1
+                    continue
+                self.latencies.append(time.perf_counter() - started)
+                if ttft is not None:
+                    self.ttfts.append(ttft)
+
+        await asyncio.gather(*(worker(i) for i in range(self.workers)))
+
+
+def check(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.method} {response.request.url} -> {response.status_code}")
+    return response
+
+
+async def catalog_list(client, context, rng):
+    check(await client.get("/books", params={"limit": 50, "sort": rng.choice(["id", "rating", "title"]),
+                                             "fields": "id,title,author,rating"}))
+
+
+async def catalog_book(client, context, rng):
+    check(await client.get(f"/books/{rng.choice(context['book_ids'])}"))
+
+
+async def catalog_search(client, context, rng):
+    from benchmarks.fixtures import WORDS
+    check(await client.get("/books/search", params={"q": f"{rng.choice(WORDS)} {rng.choice(WORDS)[:3]}"}))
+
+
+async def ai_search(client, context, rng):
+    from benchmarks.fixtures import WORDS
+    check(await client.post("/ai/search", json={"query": " ".join(rng.sample(WORDS, 4)), "k": 10}))
+
+
+async def auth_login(client, context, rng):
+    username = rng.choice(context["usernames"])
+    check(await client.post("/auth/login", data={"username": username, "password": context["password"]}))
+
+
+async def library(client, context, rng):
+    headers = rng.choice(context["user_headers"])
+    book_id = rng.choice(context["book_ids"])
+    check(await client.post("/users/me/library", json={"book_id": book_id}, headers=headers))
+    check(await client.get("/users/me/library", headers=headers))
+    check(await client.delete(f"/users/me/library/{book_id}", headers=headers))
+
+
+async def sessions_list(client, context, rng):
+    index = rng.randrange(len(context["user_headers"]))
+    headers = context["user_headers"][index]
+    check(await client.get("/sessions", headers=headers))
+    check(await client.get(f"/sessions/{context['session_ids'][index]}", headers=headers))
+
+
+async def chat(client, context, rng):
+    index = rng.randrange(len(context["user_headers"]))
+    started = time.perf_counter()
+    ttft = None
+    async with client.stream("POST", f"/sessions/{context['session_ids'][index]}/chat",
+                             json={"question": rng.choice(context["questions"])},
+                             headers=context["user_headers"][index]) as response:
+        check(response)
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            if line == "data: [DONE]":
+                break
+    return ttft
+
+
+async def admin_create(client, context, rng):
+    from benchmarks.fixtures import generate_catalog
+    book = generate_catalog(1, seed=rng.random())[0]
+    book["content_url"] = rng.choice(context["pdf_paths"])
+    body = {key: book[key] for key in ("author", "title", "rating", "description", "content_url")}
+    check(await client.post("/admin/books", json=body, headers=context["admin_headers"]))
+
+
+SCENARIOS = {
+    "catalog_list": catalog_list,
+    "catalog_book": catalog_book,
+    "catalog_search": catalog_search,
+    "ai_search": ai_search,
+    "auth_login": auth_login,
+    "library": library,
+    "sessions": sessions_list,
+    "chat": chat,
+    "admin_create": admin_create,
+}
+
+
+def prepare_environment(args):
+    # everything the app touches lives in a scratch directory, set before the app is imported
+    scratch = tempfile.mkdtemp(prefix="smart-book-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(scratch, 'bench.db')}"
+    os.environ["SMART_BOOK_DATA_DIR"] = os.path.join(scratch, "data")
+    os.makedirs(os.path.join(scratch, "data", "books"))
+    return scratch
+
+
+def seed(args, scratch):
+    from sqlalchemy import insert
+
+    from app.database import SessionLocal
+    from app.models import Book, User, ChatSession
+    from app.routers.auth import bcrypt_context
+    from app.services import ai_service
+    from benchmarks.fixtures import generate_catalog, generate_book_pdf
+
+    books = generate_catalog(args.books, seed=args.seed)
+    pdf_paths = []
+    for i in range(args.pdfs):
+        path = os.path.join(scratch, "data", "books", f"bench-{i}.pdf")
+        generate_book_pdf(path, args.pages, seed=args.seed + i)
+        pdf_paths.append(path)
+        books[i]["content_url"] = path
+    for book in books[args.pdfs:]:
+        book["content_url"] = pdf_paths[book["id"] % len(pdf_paths)]
+
+    password_hash = bcrypt_context.hash(args.password)
+    usernames = [f"reader{i}" for i in range(args.users)]
+    with SessionLocal() as db:
+        for i in range(0, len(books), 1000):
+            db.execute(insert(Book), books[i:i + 1000])
+        db.execute(insert(User), [
+            {"username": name, "email": f"{name}@bench.local", "password_hash": password_hash, "role": "user"}
+            for name in usernames
+        ] + [{"username": "admin", "email": "admin@bench.local", "password_hash": password_hash, "role": "admin"}])
+        db.commit()
+        user_ids = [row.id for row in db.query(User.id).filter(User.username.in_(usernames)).order_by(User.id)]
+        sessions = [ChatSession(user_id=user_id, book_id=books[i % args.pdfs]["id"]) for i, user_id in enumerate(user_ids)]
+        db.add_all(sessions)
+        db.commit()
+        session_ids = [session.id for session in sessions]
+
+    # ingestion is measured on its own, the api only ever enqueues it. it takes the path the workers
+    # take: the page ranges of a book are embedded side by side (threads stand in for the worker
+    # processes, the models spend their time waiting) and then committed in one go
+    ingestion = {"path": "fan-out", "workers": args.ingest_workers, "books": 0, "pages": 0, "ranges": 0,
+                 "seconds": 0.0}
+    with ThreadPoolExecutor(max_workers=args.ingest_workers) as workers:
+        for book in books[:args.pdfs]:
+            url, slug = book["content_url"], book["slug"]
+            started = time.perf_counter()
+            ranges = ai_service.page_ranges(ai_service.count_pages(url))
+            list(workers.map(lambda page_range: ai_service.embed_page_range(url, slug, *page_range), ranges))
+            ai_service.commit_page_ranges(url, slug, ranges)
+            ingestion["seconds"] += time.perf_counter() - started
+            ingestion["books"] += 1
+            ingestion["pages"] += args.pages
+            ingestion["ranges"] += len(ranges)
+    ingestion["pages_per_second"] = round(ingestion["pages"] / ingestion["seconds"], 2)
+    ingestion["seconds"] = round(ingestion["seconds"], 3)
+
+    for i in range(0, len(books), 500):
+        ai_service.index_books_in_catalog(books[i:i + 500])
+
+    return {
+        "book_ids": [book["id"] for book in books],
+        "pdf_paths": pdf_paths,
+        "usernames": usernames,
+        "password": args.password,
+        "session_ids": session_ids,
+    }, ingestion
+
+
+async def login(client, username, password):
+    response = check(await client.post("/auth/login", data={"username": username, "password": password}))
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def run_load(args, context):
+    import httpx
+    import uvicorn
+
+    from app.main import app
+    from benchmarks.fixtures import generate_questions
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning", lifespan="on")
+    server = uvicorn.Server(config)
+    serve = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120, limits=limits) as client:
+        context["user_headers"] = [await login(client, name, context["password"]) for name in context["usernames"]]
+        context["admin_headers"] = await login(client, "admin", context["password"])
+        context["questions"] = generate_questions(args.questions, seed=args.seed)
+
+        selected = args.scenarios.split(",") if args.scenarios else list(SCENARIOS)
+        scenarios = [Scenario(name, args.concurrency, SCENARIOS[name]) for name in selected]
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(scenario.run(client, context, deadline) for scenario in scenarios))
+        elapsed = time.perf_counter() - started
+
+    server.should_exit = True
+    await serve
+
+    report = {}
+    for scenario in scenarios:
+        report[scenario.name] = summarize(scenario.latencies, scenario.errors, elapsed)
+        if scenario.ttfts:
+            report[scenario.name]["ttft_p50_ms"] = _ms(percentile(scenario.ttfts, 0.50))
+            report[scenario.name]["ttft_p95_ms"] = _ms(percentile(scenario.ttfts, 0.95))
+            report[scenario.name]["ttft_p99_ms"] = _ms(percentile(scenario.ttfts, 0.99))
+    return report
+
+
+def run(args):
+    scratch = prepare_environment(args)
+
+    from app.services import ai_service
+    from app.tasks.celery_app import celery_app
+    from benchmarks.fakes import FakeChatModel, FakeEmbeddings
+
+    # the admin routes enqueue celery jobs, an in-memory broker keeps them offline
+    celery_app.conf.update(broker_url="memory://", result_backend="cache+memory://")
+    ai_service.use_models(
+        chat_model=FakeChatModel(first_token_latency=args.first_token_latency,
+                                 tokens_per_second=args.tokens_per_second,
+                                 answer_tokens=args.answer_tokens),
+        embedding_model=FakeEmbeddings(latency=args.embedding_latency),
+        embedding_model_name="fake-embeddings",
+    )
+
+    from app.schema import create_schema
+
+    create_schema()
+
+    context, ingestion = seed(args, scratch)
+    scenarios = asyncio.run(run_load(args, context))
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("command", "func")},
+        "ingestion": ingestion,
+        "scenarios": scenarios,
+    }
+    os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+    path = args.output or os.path.join(RESULTS_DIRECTORY, f"{report['commit']}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"report written to {path}", file=sys.stderr)
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"{baseline['commit']} -> {candidate['commit']}")
+    rows = [("ingestion", "pages_per_second", baseline["ingestion"], candidate["ingestion"])]
+    for name, metrics in candidate["scenarios"].items():
+        if name not in baseline["scenarios"]:
+            continue
+        for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "ttft_p50_ms", "ttft_p95_ms"):
+            if metric in metrics:
+                rows.append((name, metric, baseline["scenarios"][name], metrics))
+    for name, metric, old, new in rows:
+        before, after = old.get(metric), new.get(metric)
+        if before in (None, 0) or after is None:
+            continue
+        change = (after - before) / before * 100
+        print(f"{name:16} {metric:18} {before:>10} {after:>10} {change:+8.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+
+    compare_parser = subparsers.add_parser("compare", help="compare two reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.set_defaults(func=compare)
+
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load per run")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients per scenario")
+    parser.add_argument("--scenarios", help=f"comma separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--books", type=int, default=5000, help="catalog size")
+    parser.add_argument("--pdfs", type=int, default=3, help="books with generated content to ingest")
+    parser.add_argument("--pages", type=int, default=50, help="pages per generated book")
+    parser.add_argument("--ingest-workers", type=int, default=4, help="workers embedding the page ranges of a book")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--questions", type=int, default=40, help="size of the chat question pool")
+    parser.add_argument("--password", default="bench-password")
+    parser.add_argument("--first-token-latency", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--answer-tokens", type=int, default=80)
+    parser.add_argument("--embedding-latency", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="report path, defaults to benchmarks/results/<commit>.json")
+    parser.set_defaults(func=run)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+from app.services import answer_cache
+from app.services.answer_cache import AnswerCache
+
+
+def test_similar_question_about_the_same_book_hits():
+    cache = AnswerCache(threshold=0.95)
+    cache.store("book", [1.0, 0.0, 0.0], "answer")
+
+    # scaled and slightly turned, cosine similarity is what counts
+    assert cache.lookup("book", [2.0, 0.1, 0.0]) == "answer"
+    assert cache.lookup("book", [0.0, 1.0, 0.0]) is None
+    assert cache.lookup("other", [1.0, 0.0, 0.0]) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_closest_cached_question_answers():
+    cache = AnswerCache(threshold=0.9)
+    cache.store("book", [1.0, 0.0], "first")
+    cache.store("book", [0.0, 1.0], "second")
+    assert cache.lookup("book", [0.1, 1.0]) == "second"
+
+
+def test_expired_entries_are_dropped(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "monotonic", lambda: now[0])
+    cache = AnswerCache(ttl=10)
+    cache.store("book", [1.0, 0.0], "old")
+    now[0] += 5
+    cache.store("book", [0.0, 1.0], "new")
+
+    now[0] += 6
+    assert cache.lookup("book", [1.0, 0.0]) is None
+    assert cache.lookup("book", [0.0, 1.0]) == "new"
+    now[0] += 10
+    assert cache.lookup("book", [0.0, 1.0]) is None
+    assert cache.stats()["books"] == 0
+
+
+def test_full_book_forgets_its_oldest_answer():
+    cache = AnswerCache(max_entries_per_book=2)
+    cache.store("book", [1.0, 0.0, 0.0], "a")
+    cache.store("book", [0.0, 1.0, 0.0], "b")
+    cache.store("book", [0.0, 0.0, 1.0], "c")
+    assert cache.lookup("book", [1.0, 0.0, 0.0]) is None
+    assert cache.stats()["entries"] == 2
+
+
+def test_invalidated_book_has_no_answers():
+    cache = AnswerCache()
+    cache.store("book", [1.0, 0.0], "answer")
+    cache.invalidate("book")
+    assert cache.lookup("book", [1.0, 0.0]) is None
@@ -0,0 +1,99 @@
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.models import Book, BookIngestion
+from app.routers.admin import BookRequest
+from app.services import book_import
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = tmp_path / "import.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Book.__table__.create(engine)
+    BookIngestion.__table__.create(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(Book), [{"id": 5, "author": "A", "title": "Existing", "rating": 3.0,
+                                           "content_url": "books/existing.pdf", "slug": "existing-5"}])
+    engine.dispose()
+    return f"sqlite+aiosqlite:///{path}"
+
+
+def book(title, **fields):
+    return json.dumps({"author": "Author", "title": title, "rating": 4.0, "description": None,
+                       "content_url": f"books/{title}.pdf", **fields})
+
+
+def run_import(url, data, fmt="jsonl", **kwargs):
+    async def run():
+        engine = create_async_engine(url)
+        try:
+            async with AsyncSession(engine) as db:
+                report, books = await book_import.import_books(db, data, fmt, BookRequest, **kwargs)
+                rows = (await db.execute(select(Book.id, Book.slug).order_by(Book.id))).all()
+                ingestions = (await db.execute(select(BookIngestion.book_id, BookIngestion.status))).all()
+                return report, books, rows, ingestions
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(run())
+
+
+def test_invalid_rows_are_reported_and_the_rest_imported(database):
+    data = "\n".join([book("first"), "{broken", book("second", rating=9), "[1, 2]", book("", author=""),
+                      book("third")])
+    report, books, rows, ingestions = run_import(database, data, batch_size=2)
+
+    assert (report["imported"], report["failed"]) == (2, 4)
+    assert [error["row"] for error in report["errors"]] == [2, 3, 4, 5]
+    assert report["errors"][0]["errors"][0].startswith("Invalid JSON")
+    assert report["errors"][1]["errors"] == ["rating: Input should be less than 5"]
+    assert report["errors"][2]["errors"] == ["Expected a JSON object"]
+    assert len(report["errors"][3]["errors"]) == 2
+    assert [row["title"] for row in books] == ["first", "third"]
+    # every imported book is queued for ingestion right away
+    assert sorted(ingestions) == [(6, "queued"), (7, "queued")]
+
+
+def test_reserved_ids_follow_the_existing_books_and_name_the_slugs(database):
+    _, books, rows, _ = run_import(database, "\n".join([book("One Book"), book("Two Book")]))
+    assert [(row["id"], row["slug"]) for row in books] == [(6, "one-book-6"), (7, "two-book-7")]
+    assert [tuple(row) for row in rows] == [(5, "existing-5"), (6, "one-book-6"), (7, "two-book-7")]
+
+
+def test_batch_is_retried_with_fresh_ids_when_its_ids_were_taken(database, monkeypatch):
+    reserve = book_import.reserve_book_ids
+    attempts = []
+
+    async def taken_once(db, count):
+        attempts.append(count)
+        # the first reservation collides with a book a concurrent writer inserted
+        if len(attempts) == 1:
+            return [5] * count
+        return await reserve(db, count)
+
+    monkeypatch.setattr(book_import, "reserve_book_ids", taken_once)
+    report, books, _, _ = run_import(database, book("Retried"))
+    assert len(attempts) == 2
+    assert report["imported"] == 1 and books[0]["id"] == 6
+
+
+def test_batch_that_keeps_colliding_is_reported_failed(database, monkeypatch):
+    async def always_taken(db, count):
+        return [5] * count
+
+    monkeypatch.setattr(book_import, "reserve_book_ids", always_taken)
+    report, books, rows, ingestions = run_import(database, "\n".join([book("a"), book("b")]))
+    assert (report["imported"], report["failed"]) == (0, 2)
+    assert report["errors"][0]["errors"] == ["Could not insert: IntegrityError"]
+    assert books == [] and len(rows) == 1 and ingestions == []
+
+
+def test_blank_csv_cells_are_not_given():
+    rows = list(book_import.read_rows('author,title,rating,description,content_url\nA,"T, 2",4,,x.pdf\n', "csv"))
+    assert rows == [(1, {"author": "A", "title": "T, 2", "rating": "4", "description": None,
+                         "content_url": "x.pdf"}, None)]
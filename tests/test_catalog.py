@@ -0,0 +1,74 @@
+import base64
+
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from app.models import Book
+from app.services import catalog
+
+
+# ratings repeat so the id tie breaker decides the order within them
+RATINGS = [4.5, 3.0, 4.5, 4.5, 2.0, 3.0, 4.5, 1.0, 3.0, 4.5, 2.0]
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Book.__table__.create(engine)
+    with Session(engine) as session:
+        session.execute(insert(Book), [
+            {"id": i + 1, "author": "author", "title": f"title {(i * 7) % 5}", "rating": rating,
+             "content_url": f"book-{i}.pdf"}
+            for i, rating in enumerate(RATINGS)
+        ])
+        session.commit()
+        yield session
+    engine.dispose()
+
+
+def read_pages(db, sort, order, limit=3):
+    fields = catalog.parse_fields("title", sort)
+    pages = []
+    cursor = None
+    while True:
+        rows = [dict(row._mapping) for row in
+                db.execute(catalog.books_query(fields, sort, order, cursor).limit(limit + 1))]
+        pages.append(rows[:limit])
+        if len(rows) <= limit:
+            return pages
+        cursor = catalog.encode_cursor(rows[limit - 1], sort)
+
+
+@pytest.mark.parametrize("sort", ["id", "rating", "title"])
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_cursor_pages_cover_every_book_once_in_order(db, sort, order):
+    rows = [row for page in read_pages(db, sort, order) for row in page]
+    expected = sorted(rows, key=lambda row: (row[sort], row["id"]), reverse=order == "desc")
+    assert [row["id"] for row in rows] == [row["id"] for row in expected]
+    assert sorted(row["id"] for row in rows) == list(range(1, len(RATINGS) + 1))
+
+
+def test_rating_desc_ties_are_split_across_pages(db):
+    # five books share the top rating, a page of two has to continue inside the tie
+    pages = read_pages(db, "rating", "desc", limit=2)
+    assert [[row["id"] for row in page] for page in pages[:3]] == [[10, 7], [4, 3], [1, 9]]
+
+
+def test_cursor_round_trip():
+    cursor = catalog.encode_cursor({"id": 7, "rating": 4.5, "title": "x"}, "rating")
+    assert "=" not in cursor
+    assert catalog.decode_cursor(cursor, "rating") == (4.5, 7)
+
+
+@pytest.mark.parametrize("cursor, sort", [
+    ("not a cursor", "id"),
+    (base64.urlsafe_b64encode(b"[1, 2, 3]").decode(), "id"),
+    (base64.urlsafe_b64encode(b'[4.5, "7"]').decode(), "rating"),
+    (base64.urlsafe_b64encode(b'["high", 7]').decode(), "rating"),
+    (base64.urlsafe_b64encode(b"[4.5, 7]").decode(), "title"),
+    (base64.urlsafe_b64encode(b"{}").decode(), "id"),
+])
+def test_bad_cursor_is_rejected(cursor, sort):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        catalog.books_query(["id", sort], sort, "asc", cursor)
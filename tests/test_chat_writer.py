@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.models import ChatMessage
+from app.services.chat_writer import ChatMessageWriter
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = tmp_path / "chat.db"
+    engine = create_engine(f"sqlite:///{path}")
+    ChatMessage.__table__.create(engine)
+    engine.dispose()
+    return f"sqlite+aiosqlite:///{path}"
+
+
+async def stored_messages(session_factory):
+    async with session_factory() as db:
+        return list(await db.execute(select(ChatMessage.sender, ChatMessage.content).order_by(ChatMessage.id)))
+
+
+def test_messages_queued_when_stopping_are_flushed(database):
+    async def run():
+        engine = create_async_engine(database)
+        session_factory = async_sessionmaker(engine)
+        writer = ChatMessageWriter(session_factory)
+        await writer.start()
+        writer.write(1, "user", "question")
+        writer.write(1, "AI", "the partial answer of a cancelled stream")
+        await writer.stop()
+
+        assert [tuple(row) for row in await stored_messages(session_factory)] == [
+            ("user", "question"), ("AI", "the partial answer of a cancelled stream")]
+        assert writer.stats() == {"pending": 0, "written": 2, "dropped": 0}
+        await engine.dispose()
+
+    asyncio.run(run())
+
+
+def test_messages_are_written_in_batches(database):
+    async def run():
+        engine = create_async_engine(database)
+        session_factory = async_sessionmaker(engine)
+        batches = []
+
+        class CountingSession:
+            def __init__(self):
+                self.session = session_factory()
+
+            async def __aenter__(self):
+                db = await self.session.__aenter__()
+                execute = db.execute
+
+                async def counted(statement, rows=None):
+                    batches.append(len(rows))
+                    return await execute(statement, rows)
+
+                db.execute = counted
+                return db
+
+            async def __aexit__(self, *exc):
+                return await self.session.__aexit__(*exc)
+
+        writer = ChatMessageWriter(CountingSession, batch_size=4, flush_interval=1)
+        await writer.start()
+        for i in range(10):
+            writer.write(1, "user", str(i))
+        await writer.stop()
+
+        assert batches == [4, 4, 2]
+        async with session_factory() as db:
+            assert await db.scalar(select(func.count()).select_from(ChatMessage)) == 10
+        await engine.dispose()
+
+    asyncio.run(run())
+
+
+def test_batch_that_keeps_failing_is_counted_as_dropped(database):
+    async def run():
+        attempts = []
+
+        def failing_session():
+            attempts.append(True)
+            raise OSError("database is gone")
+
+        writer = ChatMessageWriter(failing_session, flush_interval=0, max_retries=2)
+        await writer.start()
+        writer.write(1, "user", "question")
+        await writer.stop()
+        assert len(attempts) == 2
+        assert writer.stats() == {"pending": 0, "written": 0, "dropped": 1}
+
+    asyncio.run(run())
+
+
+def test_write_before_start_is_an_error():
+    with pytest.raises(RuntimeError):
+        ChatMessageWriter(None).write(1, "user", "question")
@@ -0,0 +1,62 @@
+from langchain_core.documents import Document
+
+from app.services import context_builder
+
+
+def chunk(text, page=0, start=None, source="book.pdf"):
+    metadata = {"source": source, "page": page}
+    if start is not None:
+        metadata["start_index"] = start
+    return Document(page_content=text, metadata=metadata)
+
+
+def test_hits_far_from_the_best_one_are_cut_but_min_k_is_kept():
+    results = [(chunk("c"), 0.9), (chunk("a"), 0.2), (chunk("b"), 0.24), (chunk("d"), 0.5)]
+    relevant = context_builder.select_relevant(results, min_k=1, distance_slack=0.25)
+    assert [doc.page_content for doc, _ in relevant] == ["a", "b"]
+    relevant = context_builder.select_relevant(results, min_k=3, distance_slack=0.25)
+    assert [doc.page_content for doc, _ in relevant] == ["a", "b", "d"]
+    assert context_builder.select_relevant([], min_k=3, distance_slack=0.25) == []
+
+
+def test_overlapping_chunks_of_a_page_become_one_passage():
+    text = " ".join(f"word{i}" for i in range(100))
+    results = [(chunk(text[200:], start=200), 0.1), (chunk(text[:300], start=0), 0.2),
+               (chunk("another page", page=1, start=0), 0.3)]
+    passages = context_builder.merge_passages(results, max_overlap=200)
+    assert [(passage["page"], passage["text"]) for passage in passages] == [(0, text), (1, "another page")]
+
+
+def test_chunks_without_start_index_are_merged_on_their_text():
+    text = " ".join(f"word{i}" for i in range(60))
+    results = [(chunk(text[:250]), 0.1), (chunk(text[150:]), 0.2)]
+    assert [passage["text"] for passage in context_builder.merge_passages(results, max_overlap=200)] == [text]
+
+
+def test_near_duplicate_passages_are_dropped():
+    text = "the traveller came back from the future with a flower in his pocket"
+    passages = [{"text": text}, {"text": text + " again"}, {"text": text.replace("flower", "rose")},
+                {"text": "something else entirely"}]
+    # one more word leaves every 5-gram shared, one word changed in the middle leaves too few of them
+    kept = context_builder.drop_near_duplicates(passages)
+    assert [passage["text"] for passage in kept] == [text, passages[2]["text"], "something else entirely"]
+
+
+def test_last_passage_is_cut_to_the_budget():
+    long = " ".join(["word"] * 400)
+    passages = [{"text": "short passage", "page": 0, "source": "a"}, {"text": long, "page": 1, "source": "a"}]
+    packed = context_builder.pack(passages, token_budget=100)
+    assert packed[0]["text"] == "short passage"
+    assert packed[1]["text"].endswith(" ...")
+    assert sum(context_builder.estimate_tokens(passage["text"]) for passage in packed) <= 100 + len(packed)
+
+
+def test_context_cites_pages_from_one():
+    results = [(chunk("on the first page", page=0, start=0), 0.1),
+               (chunk("on the third page", page=2, start=0), 0.11)]
+    text, citations, relevant = context_builder.build_context(results, token_budget=1500, min_k=3,
+                                                              distance_slack=0.25, max_overlap=200)
+    assert text == "[1] (page 1)\non the first page\n\n[2] (page 3)\non the third page"
+    assert citations == [{"number": 1, "page": 0, "source": "book.pdf"},
+                         {"number": 2, "page": 2, "source": "book.pdf"}]
+    assert relevant == 2
@@ -0,0 +1,38 @@
+from app.services import embedding_cache
+from app.services.embedding_cache import EmbeddingCache
+
+
+def test_hits_do_not_write(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"))
+    cache.put_many("model", ["a", "b"], [[1.0], [2.0]])
+    db = cache._connection()
+    writes = db.total_changes
+
+    for _ in range(10):
+        assert cache.get_many("model", ["a", "b", "missing"]) == [[1.0], [2.0], None]
+
+    assert db.total_changes == writes
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (20, 10)
+
+
+def test_stale_last_used_is_touched(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"))
+    cache.put_many("model", ["a"], [[1.0]])
+    db = cache._connection()
+    db.execute("UPDATE embeddings SET last_used = 0")
+    db.commit()
+
+    cache.get_many("model", ["a"])
+    assert db.execute("SELECT last_used FROM embeddings").fetchone()[0] > embedding_cache.TOUCH_INTERVAL
+
+
+def test_eviction_counts_the_rows_it_deleted(tmp_path):
+    # a batch bigger than the table, fewer rows are deleted than were asked for
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_entries=10, evict_fraction=2.0)
+    cache.put_many("model", [str(i) for i in range(11)], [[float(i)] for i in range(11)])
+
+    assert cache._count == 0
+    assert cache.stats()["evictions"] == 11
+    cache.put_many("model", ["new"], [[1.0]])
+    assert cache._count == 1
@@ -0,0 +1,135 @@
+import os
+
+import pytest
+
+from app.services import ai_service
+from app.services.cached_embeddings import CachedEmbeddings
+from app.services.embedding_cache import EmbeddingCache
+from app.services.page_store import PageStoreRegistry
+from app.services.vector_stores import VectorStoreRegistry
+from benchmarks.fakes import FakeChatModel, FakeEmbeddings
+from benchmarks.fixtures import generate_book_pdf
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    # every directory the ingestion writes to points into tmp_path
+    vector_directory = str(tmp_path / "vectorstores")
+    monkeypatch.setattr(ai_service, "data_dir", str(tmp_path))
+    monkeypatch.setattr(ai_service, "vector_directory", vector_directory)
+    monkeypatch.setattr(ai_service, "ingest_staging_directory", str(tmp_path / "ingest"))
+    monkeypatch.setattr(ai_service, "page_stores", PageStoreRegistry(str(tmp_path / "pages")))
+    monkeypatch.setattr(ai_service, "vector_stores", VectorStoreRegistry(
+        ai_service.open_book_store, vector_directory, close_store=ai_service.close_vector_store))
+    monkeypatch.setattr(ai_service, "model", FakeChatModel())
+    monkeypatch.setattr(ai_service, "embeddings", CachedEmbeddings(
+        FakeEmbeddings(dimensions=16, latency=0, per_text_latency=0),
+        EmbeddingCache(str(tmp_path / "cache.sqlite3")), "fake"))
+    ai_service.load_ai_stack()
+    yield tmp_path
+    ai_service.vector_stores.clear()
+
+
+def ingest(url, slug):
+    # what the planner, the range tasks and the commit task do, in one process
+    ranges = ai_service.page_ranges(ai_service.count_pages(url), pages_per_task=2)
+    for start, end in ranges:
+        ai_service.embed_page_range(url, slug, start, end)
+    return ai_service.commit_page_ranges(url, slug, ranges, ai_service.source_stamp(url))
+
+
+def stored_chunks(slug):
+    with ai_service.vector_stores.lease(slug) as store:
+        return store._collection.count()
+
+
+def test_relative_content_url_is_read_from_the_data_directory(data_dir, monkeypatch):
+    generate_book_pdf(str(data_dir / "books" / "book.pdf"), 3)
+    # the worker runs somewhere else, the url must not be resolved against its working directory
+    monkeypatch.chdir(data_dir / "books")
+
+    chunks = ingest("books/book.pdf", "book")
+
+    assert chunks > 0 and stored_chunks("book") == chunks
+    assert ai_service.page_stores.get("book").page_count == 3
+    checkpoint = ai_service.read_ingest_checkpoint(os.path.join(ai_service.vector_directory, "book"))
+    assert checkpoint["complete"] and checkpoint["pages_done"] == 3
+
+
+def test_page_ranges_cover_every_page_once():
+    assert ai_service.page_ranges(5, pages_per_task=2) == [[0, 2], [2, 4], [4, 5]]
+    assert ai_service.page_ranges(0) == []
+
+
+def test_book_is_only_readable_once_its_ranges_are_committed(data_dir):
+    url = generate_book_pdf(str(data_dir / "books" / "book.pdf"), 5)
+    ranges = ai_service.page_ranges(ai_service.count_pages(url), pages_per_task=2)
+    embedded = [ai_service.embed_page_range(url, "book", start, end) for start, end in ranges]
+    assert [result["pages"] for result in embedded] == [2, 2, 1]
+
+    # the ranges only leave their chunks aside, nothing is at the store's path yet
+    assert not os.path.exists(os.path.join(ai_service.vector_directory, "book"))
+    with pytest.raises(ai_service.BookNotIndexed):
+        ai_service.vector_stores.get("book")
+
+    chunks = ai_service.commit_page_ranges(url, "book", ranges)
+    assert chunks == sum(result["chunks"] for result in embedded) == stored_chunks("book")
+    checkpoint = ai_service.read_ingest_checkpoint(os.path.join(ai_service.vector_directory, "book"))
+    assert checkpoint["complete"] and checkpoint["chunks"] == chunks
+    assert checkpoint["source_stamp"] == ai_service.source_stamp(url)
+    # no staging store, no page ranges left behind
+    assert os.listdir(ai_service.vector_directory) == ["book"]
+    assert not os.path.exists(os.path.join(ai_service.ingest_staging_directory, "book"))
+
+
+def test_ingesting_again_swaps_the_new_store_in(data_dir):
+    url = generate_book_pdf(str(data_dir / "books" / "book.pdf"), 2)
+    first = ingest(url, "book")
+    assert stored_chunks("book") == first
+
+    url = generate_book_pdf(str(data_dir / "books" / "book.pdf"), 4)
+    second = ingest(url, "book")
+    assert second > first
+    # the registry had the old store open, it notices the swap and opens the new one
+    assert stored_chunks("book") == second
+    assert os.listdir(ai_service.vector_directory) == ["book"]
+
+
+def test_update_reembeds_only_what_changed(data_dir):
+    # the same seed gives the same first pages, a longer book only adds pages at the end
+    url = generate_book_pdf(str(data_dir / "books" / "book.pdf"), 3, seed=1)
+    chunks = ingest(url, "book")
+
+    assert ai_service.update_book_in_vector_stores(url, "book") == {
+        "added": 0, "changed": 0, "unchanged": chunks, "removed": 0}
+
+    generate_book_pdf(url, 4, seed=1)
+    report = ai_service.update_book_in_vector_stores(url, "book")
+    assert report["changed"] == report["removed"] == 0
+    assert report["unchanged"] == chunks and report["added"] > 0
+    longer = chunks + report["added"]
+    assert stored_chunks("book") == longer
+
+    generate_book_pdf(url, 2, seed=1)
+    report = ai_service.update_book_in_vector_stores(url, "book")
+    assert report["added"] == report["changed"] == 0
+    assert report["unchanged"] + report["removed"] == longer
+    assert stored_chunks("book") == report["unchanged"]
+
+    generate_book_pdf(url, 2, seed=2)
+    report = ai_service.update_book_in_vector_stores(url, "book")
+    assert report["changed"] > 0 and report["added"] + report["changed"] + report["unchanged"] == stored_chunks("book")
+
+
+def test_update_leaves_an_unfinished_ingestion_alone(data_dir):
+    url = generate_book_pdf(str(data_dir / "books" / "book.pdf"), 4)
+    ranges = ai_service.page_ranges(ai_service.count_pages(url), pages_per_task=2)
+    ai_service.embed_page_range(url, "book", *ranges[0])
+
+    with pytest.raises(ai_service.BookNotIndexed):
+        ai_service.update_book_in_vector_stores(url, "book")
+    assert not os.path.exists(ai_service.vector_directory) or os.listdir(ai_service.vector_directory) == []
+
+    # the ingestion still commits as if nothing happened
+    ai_service.embed_page_range(url, "book", *ranges[1])
+    assert ai_service.commit_page_ranges(url, "book", ranges) == stored_chunks("book")
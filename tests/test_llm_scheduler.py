@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from app.services.llm_scheduler import FairScheduler, InFlightGenerations, SchedulerBusy
+
+
+async def numbers(count: int, delay: float = 0.01):
+    for i in range(count):
+        await asyncio.sleep(delay)
+        yield str(i)
+
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+def test_free_slots_go_round_robin_over_users():
+    async def run():
+        scheduler = FairScheduler("test", 1, max_queue_per_user=4)
+        order = []
+
+        async def job(user, i):
+            async with scheduler.slot(user):
+                order.append(user)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*[job("a", i) for i in range(3)], *[job("b", i) for i in range(2)])
+        assert order == ["a", "a", "b", "a", "b"]
+        assert scheduler.stats()["active"] == 0
+
+    asyncio.run(run())
+
+
+def test_full_user_queue_is_turned_away():
+    async def run():
+        scheduler = FairScheduler("test", 1, max_queue_per_user=1)
+        await scheduler.acquire("a")
+        waiter = asyncio.create_task(scheduler.acquire("a"))
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerBusy):
+            await scheduler.acquire("a")
+        scheduler.release()
+        await waiter
+        scheduler.release()
+        assert scheduler.stats()["active"] == 0 and scheduler.rejected == 1
+
+    asyncio.run(run())
+
+
+def test_waiter_that_times_out_gives_up_its_place():
+    async def run():
+        scheduler = FairScheduler("test", 1, max_wait=0.01)
+        await scheduler.acquire("a")
+        with pytest.raises(SchedulerBusy):
+            await scheduler.acquire("b")
+        assert scheduler.stats()["waiting"] == 0 and scheduler.timed_out == 1
+        scheduler.release()
+        assert scheduler.stats()["active"] == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_passes_the_slot_on():
+    async def run():
+        scheduler = FairScheduler("test", 1)
+        await scheduler.acquire("a")
+        cancelled = asyncio.create_task(scheduler.acquire("b"))
+        waiting = asyncio.create_task(scheduler.acquire("c"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        assert scheduler.stats()["waiting"] == 1
+
+        scheduler.release()
+        await waiting
+        assert scheduler.stats()["active"] == 1
+        scheduler.release()
+        assert scheduler.stats()["active"] == 0
+
+    asyncio.run(run())
+
+
+def test_joiner_gets_the_full_stream_after_the_first_subscriber_leaves():
+    async def run():
+        in_flight = InFlightGenerations()
+        released = []
+        generation = in_flight.start("key", numbers(5), on_done=lambda: released.append(True))
+
+        first = generation.subscribe()
+        assert await first.__anext__() == "0"
+        # joins late, then the one who asked first goes away
+        joiner = asyncio.create_task(collect(in_flight.get("key").subscribe()))
+        await asyncio.sleep(0)
+        await first.aclose()
+
+        assert await joiner == ["0", "1", "2", "3", "4"]
+        await asyncio.sleep(0)
+        assert released == [True] and in_flight.stats()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_generation_is_cancelled_when_every_subscriber_leaves():
+    async def run():
+        in_flight = InFlightGenerations()
+        released = []
+        generation = in_flight.start("key", numbers(100), on_done=lambda: released.append(True))
+
+        subscriber = generation.subscribe()
+        await subscriber.__anext__()
+        await subscriber.aclose()
+        await asyncio.sleep(0.01)
+
+        assert generation.task.cancelled()
+        assert released == [True]
+        # an abandoned generation is never joined, the next request starts over
+        assert in_flight.get("key") is None
+
+    asyncio.run(run())
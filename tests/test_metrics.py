@@ -0,0 +1,30 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from app.services import metrics
+
+
+def test_failed_statement_does_not_skew_later_ones():
+    engine = create_engine("sqlite://")
+    metrics.instrument_engine(engine)
+    state = {"db_seconds": 0.0, "db_queries": 0, "timings": []}
+    token = metrics.request_state.set(state)
+    try:
+        with engine.connect() as connection:
+            for _ in range(3):
+                with pytest.raises(OperationalError):
+                    connection.execute(text("SELECT * FROM missing"))
+            time.sleep(0.2)
+            connection.execute(text("SELECT 1"))
+            # nothing the failed statements started is left on the pooled connection
+            assert not connection.info.get("query_started")
+    finally:
+        metrics.request_state.reset(token)
+        engine.dispose()
+
+    assert state["db_queries"] == 1
+    # timed from its own start, not from the one the failed statement left behind
+    assert state["db_seconds"] < 0.1
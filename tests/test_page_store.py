@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from app.services.page_store import PageStore, PageStoreError, PageStoreRegistry, write_page_store
+
+
+PAGES = ["First page about the time machine.", "", "The Time\nMachine again, and ünïcode.", "Last page."]
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = PageStoreRegistry(str(tmp_path / "pages"))
+    write_page_store(registry.path_for("book"), "books/book.pdf", [123, 456], iter(PAGES))
+    return registry
+
+
+def test_pages_read_back_as_written(registry):
+    store = registry.get("book")
+    assert store.page_count == len(PAGES)
+    assert (store.source, store.stamp) == ("books/book.pdf", [123, 456])
+    assert [store.page(i) for i in range(len(PAGES))] == PAGES
+    assert list(store.pages(1, 3)) == [(1, ""), (2, PAGES[2])]
+    # a range past the end is cut at the last page
+    assert list(store.pages(3, 10)) == [(3, "Last page.")]
+    with pytest.raises(IndexError):
+        store.page(len(PAGES))
+
+
+def test_find_returns_one_hit_per_page_with_a_snippet(registry):
+    hits = registry.get("book").find("time   MACHINE")
+    # words may be split by any whitespace, the match is case insensitive
+    assert [hit["page"] for hit in hits] == [0, 2]
+    assert hits[0]["snippet"] == "First page about the [time machine]."
+    assert hits[1]["snippet"] == "The [Time Machine] again, and ünïcode."
+    assert registry.get("book").find("page", limit=1) == [
+        {"page": 0, "snippet": "First [page] about the time machine."}]
+    assert registry.get("book").find("   ") == []
+
+
+def test_match_across_a_page_boundary_is_not_a_hit(registry):
+    # "...machine." ends page 0, "The Time" starts page 2, page 1 is empty in between
+    assert registry.get("book").find("machine. The") == []
+
+
+def test_rewritten_store_is_mapped_again(registry):
+    first = registry.get("book")
+    assert registry.get("book") is first
+
+    write_page_store(registry.path_for("book"), "books/book.pdf", [124, 457], iter(["only page"]))
+    second = registry.get("book")
+    assert second is not first and second.page_count == 1
+    # the old mapping is still readable by whoever holds it
+    assert first.page(0) == PAGES[0]
+
+
+def test_missing_or_foreign_file_is_no_store(registry, tmp_path):
+    assert registry.get("missing") is None
+    with open(registry.path_for("broken"), "wb") as f:
+        f.write(b"not a page store, just some bytes long enough for a header")
+    assert registry.get("broken") is None
+    with pytest.raises(PageStoreError):
+        PageStore(registry.path_for("broken"))
+
+    assert registry.delete("book") > 0
+    assert registry.get("book") is None and not os.path.exists(registry.path_for("book"))
@@ -0,0 +1,56 @@
+import asyncio
+
+from app.services.response_cache import CachedResponse, ResponseCache
+
+
+def test_bump_makes_every_cached_response_unreachable():
+    async def run():
+        cache = ResponseCache("test")
+        version = await cache.version()
+        await cache.put(version, "books", CachedResponse(200, b"[1]"))
+        assert (await cache.get(version, "books")).body == b"[1]"
+
+        await cache.bump()
+        assert await cache.version() == version + 1
+        assert await cache.get(version + 1, "books") is None
+        # a response built before the bump arrives late, it is not kept
+        await cache.put(version, "books", CachedResponse(200, b"[1]"))
+        assert cache.stats()["entries"] == 0
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    asyncio.run(run())
+
+
+def test_least_recently_used_response_goes_first():
+    async def run():
+        cache = ResponseCache("test", max_entries=2)
+        for key in ("a", "b"):
+            await cache.put(0, key, CachedResponse(200, key.encode()))
+        await cache.get(0, "a")
+        await cache.put(0, "c", CachedResponse(200, b"c"))
+        assert await cache.get(0, "b") is None
+        assert await cache.get(0, "a") is not None
+
+    asyncio.run(run())
+
+
+def test_matching_etag_is_not_modified():
+    entry = CachedResponse(200, b'{"id": 1}', {"X-Total-Count": "1"})
+    # the tag comes from the body, the same response under a later version keeps it
+    assert CachedResponse(200, b'{"id": 1}').etag == entry.etag
+
+    response = entry.to_response({})
+    assert response.status_code == 200 and response.body == b'{"id": 1}'
+    assert response.headers["etag"] == entry.etag and response.headers["x-total-count"] == "1"
+
+    for if_none_match in (entry.etag, f'"other", W/{entry.etag}', "*"):
+        response = entry.to_response({"if-none-match": if_none_match})
+        assert response.status_code == 304 and response.body == b""
+        assert response.headers["etag"] == entry.etag
+
+    assert entry.to_response({"if-none-match": '"other"'}).status_code == 200
+
+
+def test_error_responses_are_never_not_modified():
+    entry = CachedResponse(404, b'{"detail": "Book not found"}')
+    assert entry.to_response({"if-none-match": "*"}).status_code == 404
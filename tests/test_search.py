@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.models import Book
+from app.services import search
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = tmp_path / "search.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Book.__table__.create(engine)
+    search.create_search_index(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(Book), [
+            {"author": "H. G. Wells", "title": "The Time Machine", "rating": 4.0, "content_url": "a.pdf",
+             "description": "A traveller reaches the far future"},
+            {"author": "Jules Verne", "title": "Twenty Thousand Leagues", "rating": 4.5, "content_url": "b.pdf",
+             "description": "A submarine voyage"},
+        ])
+    engine.dispose()
+    return f"sqlite+aiosqlite:///{path}"
+
+
+def run_search(url, query):
+    async def run():
+        engine = create_async_engine(url)
+        try:
+            async with AsyncSession(engine) as db:
+                return await search.search_books(db, query, 10)
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(run())
+
+
+def test_prefix_terms_match_while_typing(database):
+    found = run_search(database, "time mach")
+    assert [book["title"] for book in found["results"]] == ["The Time Machine"]
+    assert found["corrected_query"] is None
+
+
+def test_typo_is_corrected(database):
+    found = run_search(database, "submarene")
+    assert found["corrected_query"] == "submarine"
+    assert [book["title"] for book in found["results"]] == ["Twenty Thousand Leagues"]
+
+
+def test_correction_without_results_is_not_suggested(database):
+    # each term alone corrects to a word of the index, together they match no book
+    found = run_search(database, "submarene travelter")
+    assert found == {"results": [], "corrected_query": None}
@@ -0,0 +1,93 @@
+import multiprocessing
+import os
+import shutil
+import uuid
+
+from app.services.vector_stores import VectorStoreRegistry
+
+
+def open_chroma(slug, path):
+    from langchain_chroma import Chroma
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    return Chroma(collection_name=slug, embedding_function=DeterministicFakeEmbedding(size=8),
+                  persist_directory=path)
+
+
+def close_chroma(store):
+    store._client.close()
+
+
+def rebuild_store(directory, slug, texts):
+    # the way a worker commits an ingestion: built aside, then renamed over the old store
+    staging = os.path.join(directory, f".staging-{uuid.uuid4().hex}")
+    store = open_chroma(slug, staging)
+    store.add_texts(texts, ids=[str(i) for i in range(len(texts))])
+    close_chroma(store)
+    target = os.path.join(directory, slug)
+    if os.path.exists(target):
+        trash = os.path.join(directory, f".trash-{uuid.uuid4().hex}")
+        os.rename(target, trash)
+        shutil.rmtree(trash)
+    os.rename(staging, target)
+
+
+class FakeStore:
+    def __init__(self, slug):
+        self.slug = slug
+        self.closed = False
+
+
+def fake_registry(tmp_path, **kwargs):
+    closed = []
+
+    def close(store):
+        store.closed = True
+        closed.append(store.slug)
+
+    registry = VectorStoreRegistry(lambda slug, path: FakeStore(slug), str(tmp_path), close_store=close, **kwargs)
+    return registry, closed
+
+
+def test_store_rebuilt_by_another_process_is_read_again(tmp_path):
+    directory = str(tmp_path)
+    rebuild_store(directory, "book", ["first"])
+    registry = VectorStoreRegistry(open_chroma, directory, close_store=close_chroma)
+    assert registry.get("book")._collection.count() == 1
+
+    process = multiprocessing.get_context("spawn").Process(
+        target=rebuild_store, args=(directory, "book", ["one", "two", "three"]))
+    process.start()
+    process.join(60)
+    assert process.exitcode == 0
+
+    assert registry.get("book")._collection.count() == 3
+    registry.clear()
+
+
+def test_evicted_store_is_closed(tmp_path):
+    registry, closed = fake_registry(tmp_path, max_stores=1)
+    first = registry.get("a")
+    registry.get("b")
+    assert first.closed and closed == ["a"]
+    assert registry.stats()["open_stores"] == 1
+
+
+def test_leased_store_is_closed_when_the_lease_ends(tmp_path):
+    registry, closed = fake_registry(tmp_path, max_stores=1)
+    with registry.lease("a") as store:
+        registry.get("b")
+        assert not store.closed
+        assert registry.stats()["retired_stores"] == 1
+    assert store.closed and closed == ["a"]
+    assert registry.stats()["retired_stores"] == 0
+
+
+def test_invalidated_store_is_closed_and_opened_again(tmp_path):
+    registry, closed = fake_registry(tmp_path)
+    invalidated = []
+    registry.add_invalidation_listener(invalidated.append)
+    first = registry.get("a")
+    registry.invalidate("a")
+    assert first.closed and invalidated == ["a"]
+    assert registry.get("a") is not first